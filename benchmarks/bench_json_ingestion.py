@@ -0,0 +1,72 @@
+"""
+Compare peak memory and wall time of verifying the event rules against an Insights json
+export that is fully loaded with ``json.load`` versus one that is streamed record by record.
+
+Run with ``python -m benchmarks.bench_json_ingestion [n_events]``
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.synthetic import generate_events
+from src.insights_fields import EventFields
+from src.preprocessing import prepare_records, prepare_record_stream
+from src.rules.event_rules import (
+    jhu_owned_events_are_prefixed_correctly,
+    events_are_invite_only_iff_not_university_wide,
+    advertisement_events_are_labeled,
+    past_events_do_not_have_virtual_event_type
+)
+from src.utils import read_and_delete_json, stream_and_delete_json
+from src.verification_report import verify_rules
+
+NOW = datetime(2022, 3, 1)
+EVENT_RULES = [jhu_owned_events_are_prefixed_correctly, events_are_invite_only_iff_not_university_wide,
+               advertisement_events_are_labeled, past_events_do_not_have_virtual_event_type]
+
+
+def verify_loaded(filepath: str) -> list:
+    events = prepare_records(read_and_delete_json(filepath), EventFields.START_DATE_TIME, now=NOW)
+    return verify_rules([(rule, events) for rule in EVENT_RULES])
+
+
+def verify_streamed(filepath: str) -> list:
+    events = prepare_record_stream(stream_and_delete_json(filepath), EventFields.START_DATE_TIME, now=NOW)
+    return verify_rules([(rule, events) for rule in EVENT_RULES])
+
+
+def run(n: int):
+    work_dir = tempfile.mkdtemp()
+    source_filepath = os.path.join(work_dir, 'events.json')
+    with open(source_filepath, 'w', encoding='utf-8') as file:
+        json.dump(generate_events(n), file)
+    print(f'{n} events ({os.path.getsize(source_filepath) / 2 ** 20:.1f} MiB of json)')
+    try:
+        baseline = None
+        for name, verify in [('json.load', verify_loaded), ('streamed', verify_streamed)]:
+            filepath = os.path.join(work_dir, f'{name}.json')
+            # tracemalloc slows down every allocation, so the time and the peak memory are measured in separate runs
+            shutil.copyfile(source_filepath, filepath)
+            start = time.perf_counter()
+            results = verify(filepath)
+            elapsed = time.perf_counter() - start
+            shutil.copyfile(source_filepath, filepath)
+            tracemalloc.start()
+            verify(filepath)
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            if baseline is None:
+                baseline = results
+            assert results == baseline, f'{name} results differ'
+            print(f'    {name:<10} time: {elapsed:.3f}s    peak memory: {peak_bytes / 2 ** 20:.1f} MiB')
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,54 @@
+"""
+Compare the write time and file size of every available output format, using the errors
+found by the daily rules on synthetic data.
+
+Run with ``python -m benchmarks.bench_output_formats [n_records]``
+"""
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import NOW, generate_events, generate_appointments
+from src.insights_fields import EventFields, AppointmentFields
+from src.output_formats import OUTPUT_FORMATS
+from src.preprocessing import prepare_records
+from src.rule_sets.daily_verification import EVENT_RULES, APPT_RULES
+from src.verification_report import verify_rules
+
+
+def build_records(n: int) -> tuple:
+    return (prepare_records(generate_events(n), EventFields.START_DATE_TIME, now=NOW),
+            prepare_records(generate_appointments(n), AppointmentFields.START_DATE_TIME, now=NOW))
+
+
+def verify(events, appts) -> list:
+    return verify_rules([(rule, events) for rule in EVENT_RULES] + [(rule, appts) for rule in APPT_RULES])
+
+
+def run(n: int, repeat: int = 3):
+    results = verify(*build_records(n))
+    error_count = sum(len(result.errors) for result in results)
+    print(f'{n} events, {n} appointments, {error_count} errors in {len(results)} files')
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, format_class in OUTPUT_FORMATS.items():
+            try:
+                output_format = format_class()
+            except ImportError as error:
+                print(f'    {name:<8} skipped: {error}')
+                continue
+            file_paths = [os.path.join(output_dir, f'{result.rule_abbrev}{output_format.extension}')
+                          for result in results]
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for result, file_path in zip(results, file_paths):
+                    output_format.write(result.errors, file_path)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            size = sum(os.path.getsize(file_path) for file_path in file_paths)
+            print(f'    {name:<8} write: {best:.3f}s    size: {size / 2 ** 20:.2f} MiB')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
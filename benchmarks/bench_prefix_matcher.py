@@ -0,0 +1,64 @@
+"""
+Compare the event prefix rule's precompiled prefix matcher with the previous approach of
+rebuilding each career center's prefix lists for every event and checking them with a
+``startswith`` loop, checking that both find the same errors.
+
+Both are timed as complete prefix checks of an event, including the exemptions for
+University-Wide and test events that the rule declares as separate conditions.
+
+Run with ``python -m benchmarks.bench_prefix_matcher [n_events]``
+"""
+import sys
+
+from benchmarks.bench_verify_rules import _best_time
+from benchmarks.synthetic import generate_events
+from src.insights_fields import EventFields
+from src.rules.event_rules import (
+    CAREER_CENTER_PREFIXES,
+    CANCELLED_PREFIX,
+    TEST_PREFIX,
+    UNIVERSITY_WIDE_PREFIX,
+    _event_has_wrong_career_center_prefix,
+    _strip_cancelled_prefix_from_event_name
+)
+
+
+def startswith_loop_has_prefix_error(career_center: str, event_name: str) -> bool:
+    """The prefix check as it was done before the matcher existed"""
+    if _is_exempt(career_center, event_name):
+        return False
+    valid_prefixes = CAREER_CENTER_PREFIXES[career_center]
+    if event_name.startswith(CANCELLED_PREFIX) or event_name.lower().startswith(('cancelled', 'canceled')):
+        valid_prefixes = [f'{CANCELLED_PREFIX} {prefix}' for prefix in valid_prefixes]
+    return not any(event_name.startswith(prefix) for prefix in valid_prefixes)
+
+
+def matcher_has_prefix_error(career_center: str, event_name: str) -> bool:
+    """The prefix check with the rule's prefix matcher"""
+    if _is_exempt(career_center, event_name):
+        return False
+    return _event_has_wrong_career_center_prefix(career_center, event_name)
+
+
+def _is_exempt(career_center: str, event_name: str) -> bool:
+    """Whether an event needs no prefix: it has no career center, or it is University-Wide or a test event"""
+    return (not career_center or
+            _strip_cancelled_prefix_from_event_name(event_name).startswith((UNIVERSITY_WIDE_PREFIX, TEST_PREFIX)))
+
+
+def count_errors(has_prefix_error, pairs: list) -> int:
+    return sum(1 for career_center, name in pairs if has_prefix_error(career_center, name))
+
+
+def run(n: int, repeat: int = 5):
+    pairs = [(event[EventFields.CAREER_CENTER], event[EventFields.NAME]) for event in generate_events(n)]
+    loop_seconds, loop_errors = _best_time(repeat, count_errors, startswith_loop_has_prefix_error, pairs)
+    matcher_seconds, matcher_errors = _best_time(repeat, count_errors, matcher_has_prefix_error, pairs)
+    assert loop_errors == matcher_errors, 'the prefix matcher finds different errors than the startswith loop'
+    print(f'{n} events, {matcher_errors} prefix errors')
+    print(f'    startswith loop: {loop_seconds:.3f}s')
+    print(f'    prefix matcher:  {matcher_seconds:.3f}s')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
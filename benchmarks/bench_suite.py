@@ -0,0 +1,214 @@
+"""
+Time every rule, ``parse_job_file``, ``merge_staff_data``, ``to_csv`` and report rendering on
+synthetic datasets of several sizes, and save the timings so that later runs can be compared.
+
+Run with ``python -m benchmarks.bench_suite [--sizes 10000 100000 1000000] [--error-rate 0.05]``
+
+Each run is saved as a json file in ``benchmarks/results`` (or ``--output-dir``). Pass a saved
+run with ``--compare`` to print how much slower or faster each benchmark has become since then;
+benchmarks that slowed down by more than ``--threshold`` are flagged as regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from io import StringIO
+from typing import Callable, List
+
+from benchmarks.bench_verify_rules import _best_time
+from benchmarks.synthetic import (NOW, EVENT_PREFIXES, generate_events, generate_appointments,
+                                  generate_staff_data, write_jobs_file)
+from src.data_download_functions import merge_staff_data
+from src.insights_fields import EventFields, AppointmentFields
+from src.job_label_parser import parse_job_file
+from src.preprocessing import prepare_records
+from src.rule_sets.daily_verification import EVENT_RULES, APPT_RULES
+from src.utils import to_csv
+from src.verification_report import VerificationReport, verify_rules
+
+DEFAULT_SIZES = [10000, 100000]
+DEFAULT_RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+class Benchmark:
+    """A timed operation on datasets of a given size"""
+
+    def __init__(self, name: str, setup: Callable[[int], tuple], func: Callable):
+        """
+        :param name: the name of the benchmark, which identifies it across saved runs
+        :param setup: a function that builds the arguments of ``func`` for a dataset size. It is not timed.
+        :param func: the function to time
+        """
+        self.name = name
+        self.setup = setup
+        self.func = func
+
+
+def create_benchmarks(error_rate: float, career_center_weights: dict, work_dir: str) -> List[Benchmark]:
+    """Create every benchmark, generating its data only when it is set up"""
+    datasets = {}
+
+    def dataset(name: str, n: int, generate: Callable[[], list]) -> list:
+        # only the datasets of the size being timed are kept, since the largest sizes use a lot of memory
+        if any(size != n for _, size in datasets):
+            datasets.clear()
+        if (name, n) not in datasets:
+            datasets[(name, n)] = generate()
+        return datasets[(name, n)]
+
+    def events(n: int) -> list:
+        return dataset('events', n, lambda: prepare_records(
+            generate_events(n, error_rate=error_rate, career_center_weights=career_center_weights),
+            EventFields.START_DATE_TIME, now=NOW))
+
+    def appts(n: int) -> list:
+        return dataset('appts', n, lambda: prepare_records(generate_appointments(n, error_rate=error_rate),
+                                                           AppointmentFields.START_DATE_TIME, now=NOW))
+
+    def all_results(n: int) -> list:
+        return (verify_rules([(rule, events(n)) for rule in EVENT_RULES]) +
+                verify_rules([(rule, appts(n)) for rule in APPT_RULES]))
+
+    def jobs_file(n: int) -> tuple:
+        return (write_jobs_file(os.path.join(work_dir, f'jobs_{n}.csv'), n),)
+
+    def staff_data(n: int) -> tuple:
+        return generate_staff_data(max(100, n // 100), n)
+
+    benchmarks = [Benchmark(f'rule:{rule.rule_abbrev}', lambda n: (events(n),), rule) for rule in EVENT_RULES]
+    benchmarks += [Benchmark(f'rule:{rule.rule_abbrev}', lambda n: (appts(n),), rule) for rule in APPT_RULES]
+    benchmarks += [
+        Benchmark('verify_rules:events', lambda n: ([(rule, events(n)) for rule in EVENT_RULES],), verify_rules),
+        Benchmark('verify_rules:appointments', lambda n: ([(rule, appts(n)) for rule in APPT_RULES],),
+                  verify_rules),
+        Benchmark('parse_job_file', jobs_file, parse_job_file),
+        Benchmark('merge_staff_data', staff_data, merge_staff_data),
+        Benchmark('to_csv:events', lambda n: (events(n), os.path.join(work_dir, 'events.csv')), to_csv),
+        Benchmark('render_report', lambda n: (all_results(n),), _render_report),
+    ]
+    return benchmarks
+
+
+def run(sizes: List[int], error_rate: float = 0.05, career_center_weights: dict = None,
+        repeat: int = 3) -> dict:
+    """
+    Run every benchmark at every size
+
+    :return: the run's settings and environment, and the best time of each benchmark at each size
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        benchmarks = create_benchmarks(error_rate, career_center_weights, work_dir)
+        for size in sizes:
+            print(f'{size} rows')
+            for benchmark in benchmarks:
+                args = benchmark.setup(size)
+                seconds, _ = _best_time(repeat, benchmark.func, *args)
+                results.append({'benchmark': benchmark.name, 'size': size, 'seconds': round(seconds, 6),
+                                'rows_per_second': round(size / seconds) if seconds else None})
+                print(f'    {benchmark.name:<36} {seconds:8.3f}s  {size / seconds if seconds else 0:12,.0f} rows/s')
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'sizes': sizes, 'error_rate': error_rate, 'repeat': repeat,
+                     'career_center_weights': _describe_weights(career_center_weights)},
+        'results': results,
+    }
+
+
+def save(run_results: dict, output_dir: str) -> str:
+    """Save a run as a datestamped json file in the given directory, returning its filepath"""
+    os.makedirs(output_dir, exist_ok=True)
+    created = datetime.fromisoformat(run_results['created'])
+    filepath = os.path.join(output_dir, f'bench_suite_{created:%Y-%m-%d_%H-%M-%S}.json')
+    with open(filepath, 'w', encoding='utf-8') as results_file:
+        json.dump(run_results, results_file, indent=2)
+    return filepath
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """
+    Print the change in time of every benchmark that both runs timed at the same size
+
+    :return: the benchmarks, as "name@size", that slowed down by more than the threshold
+    """
+    baseline_seconds = {(result['benchmark'], result['size']): result['seconds'] for result in baseline['results']}
+    regressions = []
+    print(f'Compared with {baseline["created"]} (commit {baseline["commit"] or "unknown"}):')
+    for setting in ('error_rate', 'career_center_weights'):
+        if baseline['settings'].get(setting) != current['settings'].get(setting):
+            print(f'    note: the runs used different {setting} settings, so their timings may not be comparable')
+    for result in current['results']:
+        key = (result['benchmark'], result['size'])
+        if not baseline_seconds.get(key):
+            continue
+        ratio = result['seconds'] / baseline_seconds[key]
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(f'{key[0]}@{key[1]}')
+        print(f'    {key[0]:<36} {key[1]:>9}  {ratio:6.2f}x{flag}')
+    return regressions
+
+
+def _render_report(results: list) -> int:
+    writer = StringIO()
+    VerificationReport(results).write(writer)
+    return writer.tell()
+
+
+def _describe_weights(career_center_weights: dict):
+    if career_center_weights is None:
+        return None
+    return {career_center or 'none': weight for career_center, weight in career_center_weights.items()}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _parse_career_center_mix(mix: List[str]) -> dict:
+    """Parse "prefix=weight" pairs, where the prefix is an event prefix like "Homewood:" or "none" """
+    centers_by_prefix = {prefix.rstrip(':').lower(): center for center, prefix in EVENT_PREFIXES.items()}
+    centers_by_prefix['none'] = None
+    weights = {}
+    for pair in mix:
+        prefix, weight = pair.rsplit('=', 1)
+        weights[centers_by_prefix[prefix.rstrip(':').lower()]] = float(weight)
+    return weights
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the rules and file handling on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='the dataset sizes to time')
+    parser.add_argument('--error-rate', type=float, default=0.05, help='the fraction of records that break a rule')
+    parser.add_argument('--career-centers', nargs='+', metavar='PREFIX=WEIGHT',
+                        help='the mix of career centers, e.g. homewood=5 carey=1 none=1. Defaults to an even mix.')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of times to time each benchmark')
+    parser.add_argument('--output-dir', default=DEFAULT_RESULTS_DIR, help='the directory to save the results in')
+    parser.add_argument('--compare', help='a saved run to compare the results with')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='the slowdown, as a ratio, above which a benchmark counts as a regression')
+    args = parser.parse_args(argv)
+    career_center_weights = _parse_career_center_mix(args.career_centers) if args.career_centers else None
+    run_results = run(args.sizes, args.error_rate, career_center_weights, args.repeat)
+    print(f'Saved results to {save(run_results, args.output_dir)}')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            regressions = compare(json.load(baseline_file), run_results, args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+Compare the single-pass rule engine in ``verify_rules`` with verifying each rule in its own
+full pass over its data.
+
+Run with ``python -m benchmarks.bench_verify_rules [n_events] [n_appts]``
+"""
+import sys
+import time
+
+from benchmarks.synthetic import NOW, generate_events, generate_appointments
+from src.insights_fields import AppointmentFields, EventFields
+from src.preprocessing import prepare_records
+from src.rules.appointment_rules import (
+    past_appointments_have_finalized_status,
+    all_appointments_have_a_type
+)
+from src.rules.event_rules import (
+    jhu_owned_events_are_prefixed_correctly,
+    events_are_invite_only_iff_not_university_wide,
+    advertisement_events_are_labeled,
+    past_events_do_not_have_virtual_event_type
+)
+from src.rule_verification import VerificationResult
+from src.verification_report import verify_rules
+
+
+def verify_rules_per_rule(rules: list) -> list:
+    """The original rule loop: one full pass over the data for every rule, adding each error in turn"""
+    results = []
+    for rule, records in rules:
+        result = VerificationResult(rule.rule, rule.rule_abbrev)
+        for record in records:
+            result.add_error(rule.error_func(record))
+        results.append(result)
+    return results
+
+
+def run(n_events: int, n_appts: int, repeat: int = 3):
+    # the daily verification prepares its records before verifying them, so the rules are timed on prepared records
+    events = prepare_records(generate_events(n_events), EventFields.START_DATE_TIME, now=NOW)
+    appts = prepare_records(generate_appointments(n_appts), AppointmentFields.START_DATE_TIME, now=NOW)
+    rules = [
+        (jhu_owned_events_are_prefixed_correctly, events),
+        (events_are_invite_only_iff_not_university_wide, events),
+        (advertisement_events_are_labeled, events),
+        (past_events_do_not_have_virtual_event_type, events),
+        (all_appointments_have_a_type, appts),
+        (past_appointments_have_finalized_status, appts)
+    ]
+    per_rule_seconds, per_rule_results = _best_time(repeat, verify_rules_per_rule, rules)
+    fused_seconds, fused_results = _best_time(repeat, verify_rules, rules)
+    assert per_rule_results == fused_results, 'single-pass results differ from per-rule results'
+    print(f'{n_events} events, {n_appts} appointments')
+    print(f'    per-rule loop: {per_rule_seconds:.3f}s')
+    print(f'    single pass:   {fused_seconds:.3f}s')
+
+
+def _best_time(repeat: int, func, *args) -> tuple:
+    """Return the fastest of several timed runs of a function, along with its result"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+if __name__ == '__main__':
+    n_events = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    n_appts = int(sys.argv[2]) if len(sys.argv) > 2 else n_events
+    run(n_events, n_appts)
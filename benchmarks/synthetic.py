@@ -0,0 +1,257 @@
+"""
+Generators for synthetic Handshake datasets that use the real Insights field names.
+
+The records are shaped like the rows that ``read_and_delete_json`` returns for the events
+and appointments Insights reports, so they can be fed straight into the rules. Jobs files
+and staff data are shaped like the inputs of ``parse_job_file`` and ``merge_staff_data``.
+
+By default, events and appointments break the rules at whatever rate their random fields
+happen to. Given an ``error_rate``, every record is instead valid except for that fraction,
+each of which breaks exactly one rule when verified at ``NOW``.
+"""
+import csv
+import random
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Dict, Iterator, List, Tuple
+
+from src.constants import CareerCenters
+from src.insights_fields import EventFields, AppointmentFields
+
+BASE_DATE_TIME = datetime(2020, 1, 1, 9, 0, 0)
+# the reference time that records generated with an error rate are valid or invalid at
+NOW = datetime(2022, 3, 1)
+
+EVENT_PREFIXES = {
+    CareerCenters.HOMEWOOD: 'Homewood:',
+    CareerCenters.CAREY: 'Carey:',
+    CareerCenters.SAIS: 'SAIS DC:',
+    CareerCenters.PDCO: 'PDCO:',
+    CareerCenters.NURSING: 'Nursing:',
+    CareerCenters.BSPH: 'BSPH:',
+    CareerCenters.PEABODY: 'Peabody:',
+    CareerCenters.AAP: 'AAP:'
+}
+EVENT_TITLES = ['Resume Review', 'Office Hours', 'Career Fair Prep', 'Networking Night',
+                'Employer Info Session', 'Mock Interviews']
+EVENT_TYPES = ['Other', 'Virtual Session', 'Workshop', 'Info Session', 'Networking']
+APPT_TYPES = ['Career Exploration', 'Resume Review', 'Mock Interview', '']
+APPT_STATUSES = ['completed', 'cancelled', 'no-show', 'approved', 'requested', 'started']
+STAFF_NAMES = [('Alex', 'Vanderbildt'), ('Mary', 'Smith'), (' Elle ', ' Gonzales '), ('John', 'Doe')]
+FIRST_NAMES = ['Alex', 'Mary', 'Elle', 'John', 'Priya', 'Wei', 'Fatima', 'Jos\u00e9', 'Zo\u00eb', 'Sam']
+LAST_NAMES = ['Vanderbildt', 'Smith', 'Gonzales', 'Doe', 'Patel', 'Chen', 'Okafor', 'Garc\u00eda', 'M\u00fcller']
+QUALIFICATION_LABELS = ['qual label 1', 'qual label 2', 'qual label 3', 'gpa: 3.0+', 'us citizens only']
+JOB_FILE_FIELDS = ['Id', 'Job Id', 'Title', 'Applicants', 'Interview Status', 'Job Type', 'Employment Type',
+                   'Employer', 'Job Labels', 'Date Posted', 'Apply Start Date', 'Expires', 'Majors',
+                   'Cumulative GPA', 'School Years', 'Colleges', 'Qualification Labels', 'Located In US',
+                   'Accepts OPT/CPT Candidates', 'Willing To Sponsor Candidate', 'Employer Industry',
+                   'Employer Labels', 'Job Salary', 'Salary Type', 'Job Location', 'Job Roles']
+EVENT_ERRORS = ['prefix', 'invite_only', 'advertisement', 'virtual_session']
+APPT_ERRORS = ['missing_type', 'status']
+
+
+def generate_events(n: int, seed: int = 0, error_rate: float = None,
+                    career_center_weights: Dict[str, float] = None) -> List[dict]:
+    """
+    Generate a list of synthetic event records
+
+    :param n: the number of events to generate
+    :param seed: the random seed to use, so that datasets are reproducible
+    :param error_rate: the fraction of events that break a rule. If not given, events break
+                       the rules at the rate their random fields happen to.
+    :param career_center_weights: the relative number of events of each career center, with
+                                  None for events with no career center. Defaults to an even mix.
+    :return: a list of event dicts keyed by EventFields
+    """
+    return list(iter_events(n, seed, error_rate, career_center_weights))
+
+
+def iter_events(n: int, seed: int = 0, error_rate: float = None,
+                career_center_weights: Dict[str, float] = None) -> Iterator[dict]:
+    """Lazily generate synthetic event records, as in ``generate_events``"""
+    rand = random.Random(seed)
+    if career_center_weights is None:
+        career_centers = list(EVENT_PREFIXES.keys()) + [None]
+        choose_career_center = partial(rand.choice, career_centers)
+    else:
+        career_centers = list(career_center_weights.keys())
+        weights = list(career_center_weights.values())
+        choose_career_center = lambda: rand.choices(career_centers, weights)[0]
+    for i in range(n):
+        career_center = choose_career_center()
+        if error_rate is None:
+            yield {
+                EventFields.ID: str(1000000 + i),
+                EventFields.START_DATE_TIME: _random_date_time_str(rand),
+                EventFields.NAME: _random_event_name(rand, career_center),
+                EventFields.CAREER_CENTER: career_center,
+                EventFields.EVENT_TYPE: rand.choice(EVENT_TYPES),
+                EventFields.LABELS_LIST: rand.choice(['', 'shared: advertisement', 'shared: alumni']),
+                EventFields.IS_INVITE_ONLY: rand.choice(['Yes', 'No'])
+            }
+        else:
+            error = rand.choice(EVENT_ERRORS) if rand.random() < error_rate else None
+            yield _event_with_error(rand, str(1000000 + i), career_center, error)
+
+
+def generate_appointments(n: int, seed: int = 0, error_rate: float = None) -> List[dict]:
+    """
+    Generate a list of synthetic appointment records
+
+    :param n: the number of appointments to generate
+    :param seed: the random seed to use, so that datasets are reproducible
+    :param error_rate: the fraction of appointments that break a rule. If not given, appointments
+                       break the rules at the rate their random fields happen to.
+    :return: a list of appointment dicts keyed by AppointmentFields
+    """
+    return list(iter_appointments(n, seed, error_rate))
+
+
+def iter_appointments(n: int, seed: int = 0, error_rate: float = None) -> Iterator[dict]:
+    """Lazily generate synthetic appointment records, as in ``generate_appointments``"""
+    rand = random.Random(seed)
+    for i in range(n):
+        first_name, last_name = rand.choice(STAFF_NAMES)
+        appt = {
+            AppointmentFields.ID: str(5000000 + i),
+            AppointmentFields.START_DATE_TIME: _random_date_time_str(rand),
+            AppointmentFields.STATUS: rand.choice(APPT_STATUSES),
+            AppointmentFields.TYPE: rand.choice(APPT_TYPES),
+            AppointmentFields.STAFF_MEMBER_FIRST_NAME: first_name,
+            AppointmentFields.STAFF_MEMBER_LAST_NAME: last_name
+        }
+        if error_rate is not None:
+            error = rand.choice(APPT_ERRORS) if rand.random() < error_rate else None
+            _set_appt_error(rand, appt, error)
+        yield appt
+
+
+def write_jobs_file(filepath: str, n: int, seed: int = 0, label_rate: float = 0.3) -> str:
+    """
+    Write a synthetic jobs file like the ones downloaded from Handshake, with padded columns
+
+    :param filepath: the filepath of the csv file to create
+    :param n: the number of jobs to write
+    :param seed: the random seed to use, so that files are reproducible
+    :param label_rate: the fraction of jobs that have qualification labels
+    :return: the filepath of the jobs file
+    """
+    rand = random.Random(seed)
+    with open(filepath, 'w', encoding='utf-8', newline='') as jobs_file:
+        writer = csv.writer(jobs_file, quotechar='"')
+        writer.writerow([f'{field:<20}' for field in JOB_FILE_FIELDS])
+        for i in range(n):
+            labels = ''
+            if rand.random() < label_rate:
+                labels = ', '.join(rand.sample(QUALIFICATION_LABELS, rand.randint(1, 3)))
+            row = dict.fromkeys(JOB_FILE_FIELDS, '')
+            row.update({
+                'Id': str(100000 + i),
+                'Job Id': str(200000 + i),
+                'Title': f'{rand.choice(EVENT_TITLES)} Internship',
+                'Applicants': str(rand.randrange(200)),
+                'Employer': f'Employer {rand.randrange(1000)}, Inc.',
+                'Date Posted': '2018-01-02 21:06:14 UTC',
+                'School Years': 'Freshman, Sophomore, Junior, Senior',
+                'Qualification Labels': labels,
+                'Job Location': '3800 Park Ave, St Louis, MO 63110, USA',
+            })
+            writer.writerow([f'{value:<20}' for value in row.values()])
+    return filepath
+
+
+def generate_staff_data(n_staff: int, n_rows: int, seed: int = 0,
+                        match_rate: float = 0.8) -> Tuple[List[str], List[dict]]:
+    """
+    Generate the inputs of ``merge_staff_data``: staff names, and Insights staff rows
+
+    :param n_staff: the number of staff names to generate
+    :param n_rows: the number of Insights rows to generate
+    :param seed: the random seed to use, so that datasets are reproducible
+    :param match_rate: the fraction of Insights rows that belong to one of the staff
+    :return: a (names, insights rows) tuple
+    """
+    rand = random.Random(seed)
+    staff = [(rand.choice(FIRST_NAMES), f'{rand.choice(LAST_NAMES)}{i}') for i in range(n_staff)]
+    names = [f'{first_name} {last_name}' for first_name, last_name in staff]
+    rows = []
+    for i in range(n_rows):
+        if rand.random() < match_rate:
+            first_name, last_name = rand.choice(staff)
+        else:
+            first_name, last_name = 'Archived', f'Staff{i}'
+        rows.append({
+            'Career Service Staffs First Name': rand.choice(['', ' ']) + first_name,
+            'Career Service Staffs Last Name': last_name + rand.choice(['', ' ']),
+            'Career Service Staffs Email': f'staff{i}@jhu.edu',
+        })
+    return names, rows
+
+
+def _event_with_error(rand: random.Random, event_id: str, career_center: str, error: str = None) -> dict:
+    """Create an event that breaks only the given rule, or no rule at all"""
+    if career_center is None and error in ('prefix', 'invite_only', 'virtual_session'):
+        career_center = CareerCenters.HOMEWOOD
+    title = rand.choice([title for title in EVENT_TITLES if title != 'Office Hours'])
+    event = {
+        EventFields.ID: event_id,
+        EventFields.START_DATE_TIME: _random_date_time_str(rand),
+        EventFields.NAME: title if career_center is None else f'{EVENT_PREFIXES[career_center]} {title}',
+        EventFields.CAREER_CENTER: career_center,
+        EventFields.EVENT_TYPE: rand.choice([event_type for event_type in EVENT_TYPES
+                                             if event_type not in ('Other', 'Virtual Session')]),
+        EventFields.LABELS_LIST: rand.choice(['', 'shared: alumni']),
+        EventFields.IS_INVITE_ONLY: 'Yes'
+    }
+    if error == 'prefix':
+        event[EventFields.NAME] = title
+    elif error == 'invite_only':
+        event[EventFields.START_DATE_TIME] = _random_date_time_str(rand, after=NOW)
+        event[EventFields.IS_INVITE_ONLY] = 'No'
+    elif error == 'advertisement':
+        event.update({EventFields.CAREER_CENTER: CareerCenters.HOMEWOOD,
+                      EventFields.NAME: f'{EVENT_PREFIXES[CareerCenters.HOMEWOOD]} Office Hours',
+                      EventFields.EVENT_TYPE: 'Other'})
+    elif error == 'virtual_session':
+        event[EventFields.START_DATE_TIME] = _random_date_time_str(rand, before=NOW)
+        event[EventFields.EVENT_TYPE] = 'Virtual Session'
+    return event
+
+
+def _set_appt_error(rand: random.Random, appt: dict, error: str = None):
+    """Make an appointment break only the given rule, or no rule at all"""
+    if error != 'missing_type':
+        appt[AppointmentFields.TYPE] = rand.choice([appt_type for appt_type in APPT_TYPES if appt_type])
+    else:
+        appt[AppointmentFields.TYPE] = ''
+    if error == 'status':
+        appt[AppointmentFields.START_DATE_TIME] = _random_date_time_str(rand, before=NOW)
+        appt[AppointmentFields.STATUS] = rand.choice(['approved', 'requested', 'started'])
+    elif datetime.strptime(appt[AppointmentFields.START_DATE_TIME], '%Y-%m-%d %H:%M:%S') < NOW:
+        appt[AppointmentFields.STATUS] = rand.choice(['completed', 'cancelled', 'no-show'])
+
+
+def _random_date_time_str(rand: random.Random, before: datetime = None, after: datetime = None) -> str:
+    """Get a random date time string, optionally only one before or after the given date time"""
+    start, stop = -50000, 200000
+    if before is not None:
+        stop = int((before - BASE_DATE_TIME).total_seconds() // 1800)
+    if after is not None:
+        start = int((after - BASE_DATE_TIME).total_seconds() // 1800) + 1
+    date_time = BASE_DATE_TIME + timedelta(minutes=30 * rand.randrange(start, stop))
+    return date_time.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _random_event_name(rand: random.Random, career_center: str) -> str:
+    title = rand.choice(EVENT_TITLES)
+    if career_center is None:
+        return title
+    roll = rand.random()
+    if roll < 0.1:
+        return f'University-Wide: {title}'
+    elif roll < 0.15:
+        return f'CANCELLED: {EVENT_PREFIXES[career_center]} {title}'
+    elif roll < 0.2:
+        return title
+    else:
+        return f'{EVENT_PREFIXES[career_center]} {title}'
@@ -0,0 +1,5 @@
+import sys
+
+from src.batch import main
+
+sys.exit(main())
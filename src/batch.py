@@ -0,0 +1,296 @@
+"""
+Run actions without any prompts, for example from a scheduler::
+
+    python -m src.batch daily_verification staff --output-dir D:\\reports --format parquet
+
+Options can also be given in a json config file with ``--config-file``, whose keys are the
+long option names with underscores (e.g. ``"output_dir"``, ``"actions"``). Command line
+arguments take precedence over the config file.
+
+Actions share a pool of logged-in browser sessions (``--sessions``, defaulting to the
+``session_pool_size`` config value), and run at the same time when the pool has more than
+one session. A session is only logged in again if it has expired. The Handshake password is
+read from the environment variable named by ``--password-env``, or from the machine's
+password manager if that variable is not set. Progress is printed to stdout as one json object per line:
+a ``stage`` line for each timed stage, an ``action`` line for each action as it finishes, and a final
+``summary`` line. The exit code is 0 if every action succeeded and every rule was verified,
+1 if any rule was broken, and 2 if any action failed.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Callable, List
+
+from src.data_download_functions import (download_appointment_type_settings,
+                                         download_label_settings_data,
+                                         download_major_mapping,
+                                         download_pending_student_requests,
+                                         download_rejected_student_requests,
+                                         download_staff)
+from src.download_job import MANIFEST_FILENAME, run_download_job
+from src.job_label_parser import create_job_labels_report
+from src.output_formats import OUTPUT_FORMATS
+from src.rule_sets.daily_verification import verify_daily_rules
+from src.session_pool import SessionPool
+from src.stage_timing import StageTimer
+from src.utils import BrowsingSession, config
+
+EXIT_OK = 0
+EXIT_BROKEN_RULES = 1
+EXIT_FAILED = 2
+
+DEFAULT_PASSWORD_ENV = 'HANDSHAKE_PASSWORD'
+
+
+class ActionResult:
+    """The outcome of a batch action"""
+
+    def __init__(self, output, broken_rules: List[str] = None, summary: dict = None):
+        """
+        :param output: the filepath, or tuple of filepaths, that the action created
+        :param broken_rules: the names of any rules the action found to be broken
+        :param summary: a compact summary of the action's results, to emit with its ``action`` line
+        """
+        self.output = output
+        self.broken_rules = broken_rules if broken_rules is not None else []
+        self.summary = summary
+
+
+def _run_daily_verification(browser, args: argparse.Namespace, session_factory: Callable,
+                            timer: StageTimer) -> ActionResult:
+    date_range = (args.start_date, args.end_date) if args.start_date is not None else None
+    output_dir, report = verify_daily_rules(browser, session_factory=session_factory, refresh=args.refresh,
+                                            events_date_range=date_range, timer=timer,
+                                            summary_only=args.summary_only, partition_errors=args.partition_errors)
+    return ActionResult(output_dir, report.broken_rules, report.summary() if args.summary_only else None)
+
+
+def _run_staff_download(browser, args: argparse.Namespace, session_factory: Callable,
+                        timer: StageTimer) -> ActionResult:
+    return ActionResult(download_staff(browser, refresh=args.refresh))
+
+
+def _run_download_job(browser, args: argparse.Namespace, session_factory: Callable,
+                      timer: StageTimer) -> ActionResult:
+    output_dir, manifest = run_download_job(browser, session_factory, refresh=args.refresh, timer=timer)
+    if manifest['failed_actions']:
+        raise RuntimeError(f'Failed downloads: {", ".join(manifest["failed_actions"])}. '
+                           f'See {os.path.join(output_dir, MANIFEST_FILENAME)}')
+    return ActionResult(output_dir)
+
+
+def _run_job_labels_report(browser, args: argparse.Namespace, session_factory: Callable,
+                           timer: StageTimer) -> ActionResult:
+    if args.jobs_file is None:
+        raise ValueError('The job_labels action requires a jobs file')
+    return ActionResult(create_job_labels_report(args.jobs_file))
+
+
+def _run_download(download_func: Callable, browser, args: argparse.Namespace, session_factory: Callable,
+                  timer: StageTimer) -> ActionResult:
+    return ActionResult(download_func(browser))
+
+
+# each action takes a browser, the parsed arguments, a session factory and a stage timer
+BATCH_ACTIONS = {
+    'daily_verification': _run_daily_verification,
+    'appointment_type_settings': partial(_run_download, download_appointment_type_settings),
+    'label_settings': partial(_run_download, download_label_settings_data),
+    'major_mapping': partial(_run_download, download_major_mapping),
+    'pending_student_requests': partial(_run_download, download_pending_student_requests),
+    'rejected_student_requests': partial(_run_download, download_rejected_student_requests),
+    'staff': _run_staff_download,
+    'job_labels': _run_job_labels_report,
+    'download_everything': _run_download_job,
+}
+
+# the options that can be set in a config file, and their defaults
+OPTION_DEFAULTS = {
+    'actions': [],
+    'config_file': None,
+    'start_date': None,
+    'end_date': None,
+    'output_dir': None,
+    'format': None,
+    'processes': None,
+    'download_workers': None,
+    'sessions': None,
+    'jobs_file': None,
+    'refresh': False,
+    'profile': False,
+    'trace_memory': False,
+    'time_rows': False,
+    'summary_only': False,
+    'partition_errors': None,
+    'password_env': DEFAULT_PASSWORD_ENV,
+}
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    """
+    Parse the batch arguments, filling in any options not given from the config file, if any
+
+    :param argv: the command line arguments, not including the program name
+    :return: the parsed options
+    """
+    parser = argparse.ArgumentParser(description='Run HandshakeAdministrator actions without prompts')
+    parser.add_argument('actions', nargs='*', metavar='action',
+                        help=f'the actions to run, in order: {", ".join(BATCH_ACTIONS)}')
+    parser.add_argument('--config-file', help='a json file of options')
+    parser.add_argument('--start-date', type=_parse_date, help='the first start date of events to verify (YYYY-MM-DD)')
+    parser.add_argument('--end-date', type=_parse_date, help='the last start date of events to verify (YYYY-MM-DD)')
+    parser.add_argument('--output-dir', help='the directory in which to write all results')
+    parser.add_argument('--format', choices=list(OUTPUT_FORMATS), help='the format of result files')
+    parser.add_argument('--processes', type=int, help='the number of processes to verify rules with')
+    parser.add_argument('--download-workers', type=int, help='the number of Insights reports to download at once')
+    parser.add_argument('--sessions', type=int, help='the number of logged-in browser sessions to keep open, '
+                                                     'and so the number of actions to run at once')
+    parser.add_argument('--jobs-file', help='the jobs file to use for the job_labels action')
+    parser.add_argument('--refresh', action='store_true', default=None,
+                        help='download Insights reports even if a cached copy is available')
+    parser.add_argument('--profile', action='store_true', default=None,
+                        help='save a cProfile of the daily verification next to its results')
+    parser.add_argument('--trace-memory', action='store_true', default=None,
+                        help='record the peak memory of each stage, which slows the run down')
+    parser.add_argument('--time-rows', action='store_true', default=None,
+                        help='also time the parsing of every record and each rule\'s checks')
+    parser.add_argument('--summary-only', action='store_true', default=None,
+                        help='only count the errors of each rule by career center or staff member, and write '
+                             'them as a json summary instead of error files')
+    parser.add_argument('--partition-errors', action='store_true', default=None,
+                        help='split the error files by career center or staff member, into a directory for each '
+                             '(default: the partition_error_files config value)')
+    parser.add_argument('--password-env', help=f'the environment variable holding the Handshake password '
+                                               f'(default: {DEFAULT_PASSWORD_ENV})')
+    args = parser.parse_args(argv)
+    file_options = _read_config_file(args.config_file) if args.config_file else {}
+    for option, default in OPTION_DEFAULTS.items():
+        if getattr(args, option) in (None, []):
+            setattr(args, option, file_options.get(option, default))
+    if isinstance(args.start_date, str):
+        args.start_date = _parse_date(args.start_date)
+    if isinstance(args.end_date, str):
+        args.end_date = _parse_date(args.end_date)
+    if not args.actions:
+        parser.error('no actions given')
+    unknown_actions = [action for action in args.actions if action not in BATCH_ACTIONS]
+    if unknown_actions:
+        parser.error(f'unknown actions: {", ".join(unknown_actions)}')
+    if (args.start_date is None) != (args.end_date is None):
+        parser.error('--start-date and --end-date must be given together')
+    if args.format is not None and args.format not in OUTPUT_FORMATS:
+        parser.error(f'unknown format: {args.format}')
+    return args
+
+
+def apply_options(args: argparse.Namespace):
+    """Override the config values that the batch options control"""
+    overrides = {
+        'output_dir': args.output_dir,
+        'output_format': args.format,
+        'verification_processes': args.processes,
+        'insights_download_workers': args.download_workers,
+        'session_pool_size': args.sessions,
+        'timing_profile': args.profile or None,
+        'timing_trace_memory': args.trace_memory or None,
+        'timing_detailed': args.time_rows or None,
+    }
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+
+def run_actions(args: argparse.Namespace, session_factory: Callable,
+                emit: Callable[[dict], None] = None) -> int:
+    """
+    Run every requested action on browsers borrowed from a shared pool of logged-in sessions
+
+    :param args: the parsed batch options
+    :param session_factory: a function that creates a new, not-yet-opened HandshakeSession
+    :param emit: a function called with each progress record. Defaults to printing json lines.
+                 It is only ever called by one thread at a time.
+    :return: the exit code
+    """
+    if emit is None:
+        emit = _print_json_line
+    emit_lock = threading.Lock()
+
+    def _emit(record: dict):
+        with emit_lock:
+            emit(record)
+
+    start = time.perf_counter()
+    timer = StageTimer(lambda stage: _emit({'event': 'stage', **stage}))
+    results = {}
+    errors = {}
+    pool = SessionPool(session_factory, args.sessions)
+    try:
+        with timer.stage('login'):
+            pool.warm()
+    except Exception as e:
+        errors['login'] = e
+        _emit({'event': 'action', 'action': 'login', 'ok': False, 'error': _describe_error(e)})
+    else:
+        def _run_action(index: int, action: str):
+            try:
+                with timer.stage(f'action:{action}'), pool.session() as browser:
+                    result = BATCH_ACTIONS[action](browser, args, partial(pool.session, block=False), timer)
+            except Exception as e:
+                errors[index] = e
+                _emit({'event': 'action', 'action': action, 'ok': False, 'error': _describe_error(e)})
+            else:
+                results[index] = result
+                record = {'event': 'action', 'action': action, 'ok': True, 'output': result.output,
+                          'broken_rules': result.broken_rules}
+                if result.summary is not None:
+                    record['summary'] = result.summary
+                _emit(record)
+
+        with ThreadPoolExecutor(max_workers=min(pool.max_sessions, len(args.actions))) as executor:
+            for index, action in enumerate(args.actions):
+                executor.submit(_run_action, index, action)
+    finally:
+        pool.close()
+        timer.close()
+    failed_actions = ['login'] if 'login' in errors else [action for index, action in enumerate(args.actions)
+                                                         if index in errors]
+    broken_rules = [rule for index in sorted(results) for rule in results[index].broken_rules]
+    exit_code = EXIT_FAILED if failed_actions else EXIT_BROKEN_RULES if broken_rules else EXIT_OK
+    _emit({'event': 'summary', 'exit_code': exit_code, 'broken_rules': broken_rules,
+           'failed_actions': failed_actions, 'seconds': round(time.perf_counter() - start, 6)})
+    return exit_code
+
+
+def main(argv: List[str] = None) -> int:
+    args = parse_args(argv)
+    apply_options(args)
+    session_factory = partial(BrowsingSession, os.environ.get(args.password_env))
+    return run_actions(args, session_factory)
+
+
+def _read_config_file(filepath: str) -> dict:
+    with open(filepath, encoding='utf-8') as file:
+        options = json.load(file)
+    return {option.replace('-', '_'): value for option, value in options.items()}
+
+
+def _parse_date(value: str):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _describe_error(error: Exception) -> str:
+    return f'{type(error).__name__}: {error}'
+
+
+def _print_json_line(record: dict):
+    print(json.dumps(record, default=str), flush=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
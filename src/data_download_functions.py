@@ -1,45 +1,45 @@
-from typing import List
+import os
+from typing import Iterable, Iterator, List
 
 from autohandshake import (HandshakeBrowser, MajorSettingsPage, AccessRequestPage,
                            RequestStatus, LabelSettingsPage, AppointmentTypesListPage,
-                           StaffPage, InsightsPage, FileType)
+                           StaffPage)
 
-from src.utils import to_csv, get_datestamped_filename, \
-    create_filepath_in_download_dir, config, read_and_delete_json
+from src.insights_cache import get_default_cache
+from src.insights_downloads import InsightsReport, download_insights_reports
+from src.output_formats import write_output
+from src.staff_matching import MATCH_REPORT_FIELDS, StaffNameIndex
+from src.utils import get_datestamped_filename, create_filepath_in_output_dir
 
 DESTINATION_FILEPATH = r'S:\Reporting & Data\One-Off Reports\rejected_students.csv'
+STAFF_INSIGHTS_URL = 'https://app.joinhandshake.com/analytics/explore_embed?insights_page=ZXhwbG9yZS9nZW5lcmF0ZWRfaGFuZHNoYWtlX3Byb2R1Y3Rpb24vY2FyZWVyX3NlcnZpY2Vfc3RhZmZzP3FpZD1Bc2lZUEJpWVlaczNUYTVRMGdmODNsJmVtYmVkX2RvbWFpbj1odHRwczolMkYlMkZhcHAuam9pbmhhbmRzaGFrZS5jb20mdG9nZ2xlPWZpbA=='
+STAFF_INSIGHTS_REPORT = InsightsReport('staff', STAFF_INSIGHTS_URL)
+LABEL_SETTINGS_FIELDS = ['label_name', 'usage_count', 'used_for', 'created_by_first_name',
+                         'created_by_last_name', 'label_type']
 
 
-def download_rejected_student_requests(browser: HandshakeBrowser) -> str:
-    output_filepath = _create_csv_filepath('rejected_students')
+def download_rejected_student_requests(browser: HandshakeBrowser, output_dir: str = None) -> str:
     request_page = AccessRequestPage(browser)
     rejects = request_page.get_request_data(RequestStatus.REJECTED)
-    to_csv(rejects, output_filepath)
-    return output_filepath
+    return write_output(rejects, _create_output_filepath('rejected_students', output_dir))
 
 
-def download_pending_student_requests(browser: HandshakeBrowser) -> str:
-    output_filepath = _create_csv_filepath('pending_students')
+def download_pending_student_requests(browser: HandshakeBrowser, output_dir: str = None) -> str:
     request_page = AccessRequestPage(browser)
     pending = request_page.get_request_data(RequestStatus.WAITING)
-    to_csv(pending, output_filepath)
-    return output_filepath
+    return write_output(pending, _create_output_filepath('pending_students', output_dir))
 
 
-def download_label_settings_data(browser: HandshakeBrowser) -> tuple:
+def download_label_settings_data(browser: HandshakeBrowser, output_dir: str = None) -> tuple:
     def _write_simple_file(label_data: List[dict]):
-        csv_rows = [_get_simple_row(row) for row in label_data]
-        filepath = _create_csv_filepath('simple_label_settings')
-        to_csv(csv_rows, filepath)
-        return filepath
+        return write_output((_get_simple_row(row) for row in label_data),
+                            _create_output_filepath('simple_label_settings', output_dir),
+                            fieldnames=LABEL_SETTINGS_FIELDS)
 
     def _write_detailed_file(label_data: List[dict]):
-        csv_rows = []
-        for row in label_data:
-            csv_rows = _add_complex_row_to_list(row, csv_rows)
-        filepath = _create_csv_filepath('detailed_label_settings')
-        to_csv(csv_rows, filepath)
-        return filepath
+        return write_output((complex_row for row in label_data for complex_row in _get_complex_rows(row)),
+                            _create_output_filepath('detailed_label_settings', output_dir),
+                            fieldnames=LABEL_SETTINGS_FIELDS)
 
     def _get_simple_row(row: dict) -> dict:
         return {
@@ -51,69 +51,89 @@ def download_label_settings_data(browser: HandshakeBrowser) -> tuple:
             'label_type': row['label_type']
         }
 
-    def _add_complex_row_to_list(row: dict, output_data: List[dict]) -> List[dict]:
+    def _get_complex_rows(row: dict) -> Iterator[dict]:
         for used_for_type, count in row['usage_counts'].items():
-            output_data.append({
+            yield {
                 'label_name': row['label_name'],
                 'usage_count': count,
                 'used_for': used_for_type,
                 'created_by_first_name': row['created_by_first_name'],
                 'created_by_last_name': row['created_by_last_name'],
                 'label_type': row['label_type']
-            })
-        return output_data
+            }
 
     label_page = LabelSettingsPage(browser)
     label_data = label_page.get_label_data()
     return (_write_simple_file(label_data), _write_detailed_file(label_data))
 
 
-def download_major_mapping(browser: HandshakeBrowser) -> str:
-    def _restructure_major_mapping_data(mapping_data: List[dict]) -> List[dict]:
-        mapping_rows = []
+def download_major_mapping(browser: HandshakeBrowser, output_dir: str = None) -> str:
+    def _restructure_major_mapping_data(mapping_data: List[dict]) -> Iterator[dict]:
         for mapping in mapping_data:
             for group in mapping['groups']:
-                mapping_rows.append({'major': mapping['major'],
-                                     'group': group})
-        return mapping_rows
+                yield {'major': mapping['major'],
+                       'group': group}
 
-    output_filepath = _create_csv_filepath('major_mapping')
     major_page = MajorSettingsPage(browser)
     mappings = major_page.get_major_mapping()
-    to_csv(_restructure_major_mapping_data(mappings), output_filepath)
-    return output_filepath
+    return write_output(_restructure_major_mapping_data(mappings),
+                        _create_output_filepath('major_mapping', output_dir), fieldnames=['major', 'group'])
 
 
-def download_appointment_type_settings(browser: HandshakeBrowser) -> str:
-    output_filepath = _create_csv_filepath('appt_type_settings')
+def download_appointment_type_settings(browser: HandshakeBrowser, output_dir: str = None) -> str:
     types_page = AppointmentTypesListPage(browser)
     type_settings = types_page.get_type_settings()
-    to_csv(type_settings, output_filepath)
-    return output_filepath
+    return write_output(type_settings, _create_output_filepath('appt_type_settings', output_dir))
 
 
-def download_staff(browser: HandshakeBrowser) -> str:
+def download_staff(browser: HandshakeBrowser, output_dir: str = None, refresh: bool = False) -> str:
+    """
+    Download the Insights data of every staff member listed on the Handshake staff page. A
+    handshake_staff_matches report of how each staff name was matched is written beside it.
+
+    :return: the filepath of the staff data
+    """
     def _get_staff_insights_data(browser: HandshakeBrowser):
-        STAFF_INSIGHTS_URL = 'https://app.joinhandshake.com/analytics/explore_embed?insights_page=ZXhwbG9yZS9nZW5lcmF0ZWRfaGFuZHNoYWtlX3Byb2R1Y3Rpb24vY2FyZWVyX3NlcnZpY2Vfc3RhZmZzP3FpZD1Bc2lZUEJpWVlaczNUYTVRMGdmODNsJmVtYmVkX2RvbWFpbj1odHRwczolMkYlMkZhcHAuam9pbmhhbmRzaGFrZS5jb20mdG9nZ2xlPWZpbA=='
-        insights_page = InsightsPage(STAFF_INSIGHTS_URL, browser)
-        filepath = insights_page.download_file(config['download_dir'], file_type=FileType.JSON)
-        return read_and_delete_json(filepath)
+        downloads = download_insights_reports([STAFF_INSIGHTS_REPORT], browser, cache=get_default_cache(),
+                                              refresh=refresh)
+        return (row for _, records in downloads for row in records)
 
-    output_filepath = _create_csv_filepath('handshake_staff')
     staff_page = StaffPage(browser)
-    staff_names = staff_page.get_staff_names()
+    staff_index = StaffNameIndex(staff_page.get_staff_names())
     insights_data = _get_staff_insights_data(browser)
-    to_csv(merge_staff_data(staff_names, insights_data), output_filepath)
-    return output_filepath
-
-
-def merge_staff_data(names: List[str], insights_data: List[dict]):
-    def _full_name(insights_row: dict):
-        return f"{insights_row['Career Service Staffs First Name'].strip()} {insights_row['Career Service Staffs Last Name'].strip()}"
-
-    names_set = set(names)
-    return [row for row in insights_data if _full_name(row) in names_set]
-
-
-def _create_csv_filepath(filename: str):
-    return create_filepath_in_download_dir(f'{get_datestamped_filename(filename)}.csv')
+    staff_filepath = write_output(staff_index.matching_rows(insights_data),
+                                  _create_output_filepath('handshake_staff', output_dir))
+    write_output(staff_index.report_rows(), _create_output_filepath('handshake_staff_matches', output_dir),
+                 fieldnames=MATCH_REPORT_FIELDS)
+    return staff_filepath
+
+
+def merge_staff_data(names: List[str], insights_data: Iterable[dict]) -> List[dict]:
+    return list(iter_merged_staff_data(names, insights_data))
+
+
+def iter_merged_staff_data(names: List[str], insights_data: Iterable[dict],
+                           staff_index: StaffNameIndex = None) -> Iterator[dict]:
+    """
+    Lazily yield the Insights staff rows whose names match one of the given staff names, ignoring
+    differences in case, whitespace and Unicode form (see ``normalize_name``)
+
+    :param names: the staff names
+    :param insights_data: the Insights staff rows
+    :param staff_index: an index of the staff names, on which the match of each row is counted.
+                        If given, the names are ignored.
+    :return: an iterator of the matching rows, including those that match several staff names
+    """
+    if staff_index is None:
+        staff_index = StaffNameIndex(names)
+    return staff_index.matching_rows(insights_data)
+
+
+def _create_output_filepath(filename: str, output_dir: str = None):
+    """
+    Create a filepath without an extension: a datestamped one in the output dir, or, if a
+    directory is given, an undated one in that directory
+    """
+    if output_dir is not None:
+        return os.path.join(output_dir, filename)
+    return create_filepath_in_output_dir(get_datestamped_filename(filename))
@@ -0,0 +1,149 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Callable, List, Tuple
+
+from autohandshake import HandshakeBrowser, HandshakeSession
+
+from src.data_download_functions import (download_appointment_type_settings,
+                                         download_label_settings_data,
+                                         download_major_mapping,
+                                         download_pending_student_requests,
+                                         download_rejected_student_requests,
+                                         download_staff)
+from src.output_formats import count_output_rows
+from src.session_pool import BrowserPool
+from src.stage_timing import StageTimer
+from src.utils import config, create_filepath_in_output_dir, get_datestamped_filename
+
+MANIFEST_FILENAME = 'manifest.json'
+
+# every download action, each taking a browser and the directory in which to write its output
+DOWNLOAD_ACTIONS = {
+    'rejected_student_requests': download_rejected_student_requests,
+    'pending_student_requests': download_pending_student_requests,
+    'label_settings': download_label_settings_data,
+    'major_mapping': download_major_mapping,
+    'appointment_type_settings': download_appointment_type_settings,
+    'staff': download_staff,
+}
+
+
+def download_everything(browser: HandshakeBrowser, session_factory: Callable[[], HandshakeSession] = None,
+                        refresh: bool = False) -> str:
+    """
+    Run every download action at once, writing their outputs into a single datestamped directory.
+
+    :param browser: a logged-in HandshakeBrowser
+    :param session_factory: a function that creates a new HandshakeSession. If given, the
+                            actions run concurrently in separate sessions.
+    :param refresh: whether to download Insights reports even if they are cached
+    :return: the directory containing the downloaded files and their manifest
+    """
+    output_dir, _ = run_download_job(browser, session_factory, refresh=refresh)
+    return output_dir
+
+
+def run_download_job(browser: HandshakeBrowser, session_factory: Callable[[], HandshakeSession] = None,
+                     actions: dict = None, max_workers: int = None, retries: int = None,
+                     retry_delay_seconds: float = None, output_dir: str = None, refresh: bool = False,
+                     timer: StageTimer = None, sleep: Callable[[float], None] = time.sleep) -> Tuple[str, dict]:
+    """
+    Run several download actions over a bounded pool of browsers, as in ``download_everything``.
+
+    Each action that fails is retried on its own, without affecting the others. Once every
+    action has finished, a manifest of each action's outputs, row counts, duration and errors is
+    written to the output directory.
+
+    :param actions: a dict mapping the name of each action to a function that takes a browser and
+                    an ``output_dir`` keyword argument. Defaults to ``DOWNLOAD_ACTIONS``.
+    :param max_workers: the maximum number of actions to run at once. Defaults to the
+                        ``download_job_workers`` config value.
+    :param retries: the number of times to retry a failed action. Defaults to the
+                    ``download_job_retries`` config value.
+    :param retry_delay_seconds: how long to wait before retrying a failed action. Defaults to the
+                                ``download_job_retry_delay_seconds`` config value.
+    :param output_dir: the directory in which to write the outputs. Defaults to a datestamped
+                       directory in the output directory (see ``create_filepath_in_output_dir``).
+    :param timer: a timer with which to record how long each action takes
+    :param sleep: a function that waits for the given number of seconds
+    :return: the directory containing the outputs, and the manifest
+    """
+    if actions is None:
+        actions = dict(DOWNLOAD_ACTIONS, staff=partial(download_staff, refresh=refresh))
+    if max_workers is None:
+        max_workers = config['download_job_workers']
+    if retries is None:
+        retries = config['download_job_retries']
+    if retry_delay_seconds is None:
+        retry_delay_seconds = config['download_job_retry_delay_seconds']
+    if output_dir is None:
+        output_dir = create_filepath_in_output_dir(get_datestamped_filename('reference_data'))
+    if timer is None:
+        timer = StageTimer()
+    os.makedirs(output_dir)
+    started_at = datetime.now()
+    start = time.perf_counter()
+    browser_pool = BrowserPool(browser, session_factory, max_workers)
+
+    def _run_action(name: str) -> dict:
+        action_start = time.perf_counter()
+        errors = []
+        outputs = None
+        succeeded = False
+        for attempt in range(retries + 1):
+            if attempt:
+                sleep(retry_delay_seconds)
+            worker_browser = browser_pool.acquire()
+            try:
+                with timer.stage(f'download:{name}'):
+                    outputs = actions[name](worker_browser, output_dir=output_dir)
+            except Exception as e:
+                errors.append(f'{type(e).__name__}: {e}')
+                # the error may have come from a broken session, which the retry shouldn't get again
+                browser_pool.release(worker_browser, check=True)
+            else:
+                browser_pool.release(worker_browser)
+                succeeded = True
+                break
+        return {
+            'action': name,
+            'ok': succeeded,
+            'attempts': len(errors) + succeeded,
+            'seconds': round(time.perf_counter() - action_start, 6),
+            'outputs': _describe_outputs(outputs),
+            'errors': errors,
+        }
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(actions)))) as executor:
+            action_results = list(executor.map(_run_action, actions))
+    finally:
+        browser_pool.close()
+    manifest = {
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'seconds': round(time.perf_counter() - start, 6),
+        'failed_actions': [result['action'] for result in action_results if not result['ok']],
+        'actions': action_results,
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILENAME), 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return output_dir, manifest
+
+
+def _describe_outputs(outputs) -> List[dict]:
+    """Describe each file an action created, given the filepath, tuple of filepaths, or None it returned"""
+    if outputs is None:
+        return []
+    filepaths = outputs if isinstance(outputs, (list, tuple)) else [outputs]
+    return [{'file': os.path.basename(filepath), 'rows': _count_rows(filepath)} for filepath in filepaths]
+
+
+def _count_rows(filepath: str):
+    try:
+        return count_output_rows(filepath)
+    except (OSError, ValueError):
+        return None
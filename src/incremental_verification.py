@@ -0,0 +1,366 @@
+import gzip
+import hashlib
+import os
+import pickle
+import sys
+from datetime import datetime
+from itertools import islice
+from types import CodeType, FunctionType, ModuleType
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from src.preprocessing import get_start_date_time
+from src.rule_verification import ErrorCounts, Rule, VerificationResult
+from src.stage_timing import StageTimer
+from src.utils import config
+from src.verification_report import verify_rules
+
+STATE_FORMAT_VERSION = 1
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class VerificationState:
+    """
+    The results of a verification run, saved so that the next run can reuse them.
+
+    For each rule, the state maps the fingerprint of every record the rule checked to the
+    error the rule found for that record (or None).
+    """
+
+    def __init__(self, now: datetime = None, rule_results: Dict[str, Dict[bytes, Optional[dict]]] = None):
+        """
+        :param now: the reference time of the run
+        :param rule_results: a dict mapping rule signatures to dicts of record fingerprints and errors
+        """
+        self.now = now
+        self.rule_results = rule_results if rule_results is not None else {}
+
+    @classmethod
+    def load(cls, filepath: str):
+        """
+        Load a saved state, or an empty state if there is no usable saved state, for instance
+        because it holds errors of a class that has since been renamed or moved
+        """
+        try:
+            with gzip.open(filepath, 'rb') as file:
+                version, now, rule_results = pickle.load(file)
+        except (OSError, EOFError, ValueError, TypeError, AttributeError, ImportError, pickle.UnpicklingError):
+            return cls()
+        if version != STATE_FORMAT_VERSION:
+            return cls()
+        return cls(now, rule_results)
+
+    def save(self, filepath: str):
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        temp_filepath = f'{filepath}.tmp'
+        with gzip.open(temp_filepath, 'wb') as file:
+            pickle.dump((STATE_FORMAT_VERSION, self.now, self.rule_results), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_filepath, filepath)
+
+
+class IncrementalVerification:
+    """
+    A verification run that reuses the previous run's results for records that have not changed.
+
+    A record is only re-checked against a rule if the fields the rule reads have changed since
+    the previous run, or, for time-dependent rules, if the record's start time falls between
+    the previous run's reference time and this one's (so it may have moved from the future
+    into the past). Rules that do not declare their fields are always fully re-checked.
+
+    The previous results are looked up in this process, and only the records that have to be
+    checked again are verified, so that they can still be sharded across worker processes.
+    """
+
+    def __init__(self, previous_state: VerificationState, now: datetime):
+        self._previous_state = previous_state
+        self.state = VerificationState(now)
+        if previous_state.now is None:
+            self._crossed_range = None
+        else:
+            self._crossed_range = (min(previous_state.now, now), max(previous_state.now, now))
+
+    def verify(self, rules: List[Rule], records: Iterable[dict], processes: int = None, chunk_size: int = None,
+               timer: StageTimer = None, counts_only: bool = False) -> list:
+        """
+        Verify several rules against the same records, reusing previous results and recording the
+        new results in ``state``. The results are identical to those of ``verify_rules``.
+
+        The records are read a block of ``processes`` chunks at a time, so a stream of records is
+        never all held in memory. A record that any rule has to check again is checked again by
+        every rule that declares its fields, in a single pass over the block (see ``verify_rules``).
+
+        :param rules: the rules to verify
+        :param records: the records to verify the rules against
+        :param processes: the number of processes to verify the re-checked records with (see ``verify_rules``)
+        :param chunk_size: the number of records to send to a process at a time (see ``verify_rules``)
+        :param timer: a timer on which to record the time spent in each rule
+        :param counts_only: whether to return ErrorCounts instead of VerificationResults
+        :return: a list of rule verification results, one for each rule
+        """
+        if processes is None:
+            processes = config['verification_processes']
+        if chunk_size is None:
+            chunk_size = config['verification_chunk_size']
+        full_rules = [rule for rule in rules if rule.fields is None]
+        incremental_rules = [rule for rule in rules if rule.fields is not None]
+        results = {rule: ErrorCounts(rule.rule, rule.rule_abbrev) if counts_only
+                   else VerificationResult(rule.rule, rule.rule_abbrev) for rule in rules}
+        # each rule's time on every block is added up into a single stage once all blocks are verified
+        block_timer = StageTimer(trace_memory=False, detailed=True) if timer is not None else None
+        block_verification = _BlockVerification(self._previous_state, self.state, incremental_rules,
+                                                [results[rule] for rule in incremental_rules])
+        records = iter(records)
+        block_size = chunk_size * max(processes, 1)
+        for block in iter(lambda: list(islice(records, block_size)), []):
+            if full_rules:
+                block_results = verify_rules([(rule, block) for rule in full_rules], processes, chunk_size,
+                                             block_timer, counts_only)
+                for rule, block_result in zip(full_rules, block_results):
+                    _add_result(results[rule], block_result)
+            if incremental_rules:
+                block_verification.verify(block, self._has_crossed_now, processes, chunk_size, block_timer)
+        if timer is not None:
+            _record_total_stages(timer, block_timer.stages)
+        return [results[rule] for rule in rules]
+
+    def _has_crossed_now(self, record: dict, time_field: str) -> bool:
+        if self._crossed_range is None:
+            return True
+        if record.get(time_field) is None:
+            return False
+        start_date_time = get_start_date_time(record, time_field)
+        return self._crossed_range[0] <= start_date_time < self._crossed_range[1]
+
+
+class _BlockVerification:
+    """
+    Verifies rules that declare their fields against a block of records at a time, adding each
+    rule's errors to its result in record order.
+
+    Previous errors are added as soon as their record is reached, unless a record before it in the
+    block has to be checked again. Such records wait in a plan until the re-checked records'
+    errors are known, so that the errors are still added in record order.
+    """
+
+    def __init__(self, previous_state: VerificationState, state: VerificationState, rules: List[Rule],
+                 results: list):
+        signatures = [rule_signature(rule) for rule in rules]
+        self._rules = rules
+        self._outcome_rules = [_EveryOutcomeRule(rule) for rule in rules]
+        self._results = results
+        self._previous_results = [previous_state.rule_results.get(signature, {}) for signature in signatures]
+        self._current_results = [state.rule_results.setdefault(signature, {}) for signature in signatures]
+        # rules that read the same fields share their fingerprints, and each time field is only checked once
+        self._field_sets = list(dict.fromkeys(rule.fields for rule in rules))
+        self._field_set_indices = [self._field_sets.index(rule.fields) for rule in rules]
+        self._time_fields = list(dict.fromkeys(rule.time_field for rule in rules if rule.time_field))
+
+    def verify(self, block: List[dict], has_crossed_now: Callable[[dict, str], bool], processes: int,
+               chunk_size: int, timer: Optional[StageTimer]):
+        """
+        :param block: the records to verify
+        :param has_crossed_now: a function that tells whether a record's time field has crossed the
+                                current time since the previous run
+        """
+        # for each record from the first one to check again on, its previous errors, or None if it is checked again
+        plan = []
+        to_check = []
+        to_check_fingerprints = []
+        for record in block:
+            field_set_fingerprints = [fingerprint_record(record, fields) for fields in self._field_sets]
+            fingerprints = [field_set_fingerprints[i] for i in self._field_set_indices]
+            previous_errors = self._previous_errors(record, fingerprints, has_crossed_now)
+            if previous_errors is None:
+                to_check.append(record)
+                to_check_fingerprints.append(fingerprints)
+                plan.append(None)
+                continue
+            for results, fingerprint, error in zip(self._current_results, fingerprints, previous_errors):
+                results[fingerprint] = error
+            if plan:
+                plan.append(previous_errors)
+            else:
+                self._add_errors(previous_errors)
+        if not to_check:
+            return
+        checked = verify_rules([(rule, to_check) for rule in self._outcome_rules], processes, chunk_size, timer)
+        checked_outcomes = [iter(result.errors) for result in checked]
+        checked_fingerprints = iter(to_check_fingerprints)
+        for previous_errors in plan:
+            if previous_errors is None:
+                errors = [_error_from_outcome(next(outcomes)) for outcomes in checked_outcomes]
+                for results, fingerprint, error in zip(self._current_results, next(checked_fingerprints), errors):
+                    results[fingerprint] = error
+                self._add_errors(errors)
+            else:
+                self._add_errors(previous_errors)
+
+    def _previous_errors(self, record: dict, fingerprints: list,
+                         has_crossed_now: Callable[[dict, str], bool]) -> Optional[tuple]:
+        """Look up each rule's previous error for a record, or return None if any rule has to check it again"""
+        previous_errors = tuple(map(_get_previous_error, self._previous_results, fingerprints))
+        if _MISSING in previous_errors:
+            return None
+        for time_field in self._time_fields:
+            if has_crossed_now(record, time_field):
+                return None
+        return previous_errors
+
+    def _add_errors(self, errors):
+        for result, error in zip(self._results, errors):
+            result.add_error(error)
+
+
+def _add_result(result: Union[VerificationResult, ErrorCounts], block_result: Union[VerificationResult, ErrorCounts]):
+    if isinstance(result, ErrorCounts):
+        result.add_counts(block_result.counts_by_group())
+    else:
+        result.add_errors(block_result.errors)
+
+
+def _record_total_stages(timer: StageTimer, stages: List[dict]):
+    """Record the total time and rows of each stage name among the given stages"""
+    totals = {}
+    for stage in stages:
+        seconds, rows = totals.get(stage['stage'], (0.0, 0))
+        totals[stage['stage']] = (seconds + stage['seconds'], rows + (stage['rows'] or 0))
+    for name, (seconds, rows) in totals.items():
+        timer.record(name, seconds, rows=rows)
+
+
+# the outcome of a check that found no error, which, unlike None, is kept in a rule's results
+_NO_ERROR = False
+_MISSING = object()
+
+
+class _EveryOutcomeRule(Rule):
+    """
+    A rule that has an outcome for every record it checks, so that its outcomes line up with the
+    records. It pickles as the rule it wraps, so it can be checked in worker processes.
+    """
+
+    def __init__(self, rule: Rule):
+        self.wrapped_rule = rule
+        error_func = rule.error_func
+
+        def _outcome(record: dict):
+            error = error_func(record)
+            return _NO_ERROR if error is None else error
+
+        super().__init__(rule.rule, rule.rule_abbrev, _outcome, rule.fields, rule.time_field)
+
+    def __reduce__(self):
+        return _EveryOutcomeRule, (self.wrapped_rule,)
+
+
+def _get_previous_error(results: dict, fingerprint: bytes):
+    return results.get(fingerprint, _MISSING)
+
+
+def _error_from_outcome(outcome):
+    return None if outcome is _NO_ERROR else outcome
+
+
+def fingerprint_record(record: dict, fields: tuple) -> bytes:
+    """Create a compact fingerprint of the values of the given fields of a record"""
+    values = repr(tuple(map(record.get, fields)))
+    return hashlib.blake2b(values.encode('utf-8'), digest_size=16).digest()
+
+
+def rule_signature(rule: Rule) -> str:
+    """
+    Identify a rule by its text, the fields it reads, the code of its error function and the
+    data that code uses, so that results saved by a different version of a rule are not reused.
+
+    The data is every global value that the hashed code reads, like a list of statuses or a table
+    of prefixes, and, in turn, the code and data of any function or class of this project (rather
+    than of a library) among them. The values a function closes over are hashed as data too, so
+    the error function of a declared rule is identified by the conditions compiled into it.
+    """
+    sha256 = hashlib.sha256(repr((rule.rule, rule.rule_abbrev, rule.fields, rule.time_field)).encode('utf-8'))
+    seen = set()
+    _hash_value(sha256, rule.error_func, seen)
+    return sha256.hexdigest()
+
+
+def _hash_value(sha256, value, seen: set):
+    """Hash a value by its contents, in the same way in every process"""
+    if isinstance(value, (FunctionType, type)) or _has_default_repr(value):
+        # each function, class and object is only hashed once, which also stops cycles between them
+        if id(value) in seen:
+            sha256.update(b'<seen>')
+            return
+        seen.add(id(value))
+    if isinstance(value, FunctionType) and not _is_project_module(value.__module__):
+        sha256.update(f'<function {value.__module__}.{value.__qualname__}>'.encode('utf-8'))
+    elif isinstance(value, FunctionType):
+        _hash_code(sha256, value.__code__, value.__globals__, seen)
+        for default in (value.__defaults__ or ()) + tuple(cell.cell_contents for cell in value.__closure__ or ()):
+            _hash_value(sha256, default, seen)
+    elif isinstance(value, (staticmethod, classmethod)):
+        _hash_value(sha256, value.__func__, seen)
+    elif isinstance(value, property):
+        for accessor in (value.fget, value.fset, value.fdel):
+            _hash_value(sha256, accessor, seen)
+    elif isinstance(value, type):
+        sha256.update(f'<class {value.__module__}.{value.__qualname__}>'.encode('utf-8'))
+        if _is_project_module(value.__module__):
+            for name, attr in sorted(vars(value).items()):
+                if name not in ('__dict__', '__weakref__', '__module__', '__doc__'):
+                    sha256.update(name.encode('utf-8'))
+                    _hash_value(sha256, attr, seen)
+    elif isinstance(value, ModuleType):
+        sha256.update(f'<module {value.__name__}>'.encode('utf-8'))
+    elif isinstance(value, (set, frozenset)):
+        # sets of strings are iterated in a different order in every process, so their items are sorted
+        item_digests = []
+        for item in value:
+            item_sha256 = hashlib.sha256()
+            _hash_value(item_sha256, item, seen)
+            item_digests.append(item_sha256.digest())
+        sha256.update(f'<{type(value).__name__} {len(value)}>'.encode('utf-8'))
+        for item_digest in sorted(item_digests):
+            sha256.update(item_digest)
+    elif isinstance(value, dict):
+        sha256.update(f'<dict {len(value)}>'.encode('utf-8'))
+        for key, item in value.items():
+            _hash_value(sha256, key, seen)
+            _hash_value(sha256, item, seen)
+    elif isinstance(value, (list, tuple)):
+        sha256.update(f'<{type(value).__name__} {len(value)}>'.encode('utf-8'))
+        for item in value:
+            _hash_value(sha256, item, seen)
+    elif _has_default_repr(value):
+        # an object whose repr is only its address, like a prefix matcher, is identified by its class and state
+        _hash_value(sha256, type(value), seen)
+        state = getattr(value, '__dict__', None)
+        if state is None:
+            state = {name: getattr(value, name) for name in getattr(type(value), '__slots__', ())
+                     if hasattr(value, name)}
+        _hash_value(sha256, state, seen)
+    else:
+        sha256.update(repr(value).encode('utf-8'))
+
+
+def _hash_code(sha256, code: CodeType, global_values: dict, seen: set):
+    sha256.update(code.co_code)
+    sha256.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            _hash_code(sha256, const, global_values, seen)
+        else:
+            _hash_value(sha256, const, seen)
+    for name in code.co_names:
+        if name in global_values:
+            _hash_value(sha256, global_values[name], seen)
+
+
+def _has_default_repr(value) -> bool:
+    return type(value).__repr__ is object.__repr__
+
+
+def _is_project_module(module_name: Optional[str]) -> bool:
+    module_file = getattr(sys.modules.get(module_name), '__file__', None)
+    if module_file is None:
+        return False
+    module_file = os.path.abspath(module_file)
+    return module_file.startswith(PROJECT_DIR + os.sep) and 'site-packages' not in module_file
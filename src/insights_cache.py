@@ -0,0 +1,194 @@
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import time
+from typing import Iterable, Iterator, List, Optional
+
+from src.utils import config
+
+CACHE_FORMAT_VERSION = 1
+ROWS_PER_CHUNK = 5000
+
+
+class InsightsCache:
+    """
+    An on-disk cache of downloaded Insights datasets.
+
+    Each dataset is stored as a gzipped stream of pickled chunks. The field names are written
+    once in a header and each record is stored as a tuple of values. A small json metadata file
+    next to each dataset records when it was created and last used, its size, and a sha256 hash
+    of its contents. The hash is checked before the dataset is read. Datasets older than the TTL
+    are treated as missing. When the cache grows past its size limit, the least recently used
+    datasets are evicted.
+    """
+
+    def __init__(self, cache_dir: str, ttl_seconds: float, max_bytes: int):
+        """
+        :param cache_dir: the directory in which to store cached datasets
+        :param ttl_seconds: how long a cached dataset stays valid
+        :param max_bytes: the maximum total size of all cached datasets
+        """
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(url: str, filters: list = None) -> str:
+        """
+        Create a cache key from an Insights url and the filters set on the report
+
+        :param url: the Insights url of the report
+        :param filters: a json-serializable description of the filters set on the report
+        :return: the cache key
+        """
+        description = json.dumps([url, filters or []], sort_keys=True, default=str)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Iterator[dict]]:
+        """
+        Get a cached dataset
+
+        :param key: the dataset's cache key
+        :return: an iterator over the cached records, or None if there is no valid cached dataset
+        """
+        metadata = self._read_metadata(key)
+        if metadata is None:
+            return None
+        if (time.time() - metadata['created'] > self.ttl_seconds or
+                _hash_file(self._data_path(key)) != metadata['sha256']):
+            self.remove(key)
+            return None
+        metadata['last_used'] = time.time()
+        self._write_metadata(key, metadata)
+        return _read_records(self._data_path(key))
+
+    def put(self, key: str, records: Iterable[dict]) -> Iterator[dict]:
+        """
+        Cache a dataset while it is being consumed.
+
+        Records are passed through unchanged. The dataset is only added to the cache once
+        every record has been consumed.
+
+        :param key: the dataset's cache key
+        :param records: the records to cache
+        :return: an iterator over the given records
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = f'{self._data_path(key)}.{os.getpid()}.tmp'
+        try:
+            with gzip.open(temp_path, 'wb') as file:
+                yield from _write_records(file, records)
+            os.replace(temp_path, self._data_path(key))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        now = time.time()
+        self._write_metadata(key, {
+            'created': now,
+            'last_used': now,
+            'size': os.path.getsize(self._data_path(key)),
+            'sha256': _hash_file(self._data_path(key))
+        })
+        self.evict()
+
+    def remove(self, key: str):
+        for path in [self._data_path(key), self._metadata_path(key)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self):
+        """Remove every cached dataset, so that each report is downloaded again the next time it is needed"""
+        for key in self._keys():
+            self.remove(key)
+
+    def evict(self):
+        """Remove the least recently used datasets until the cache fits within its size limit"""
+        entries = []
+        for key in self._keys():
+            metadata = self._read_metadata(key)
+            if metadata is not None:
+                entries.append((metadata['last_used'], metadata['size'], key))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            self.remove(key)
+            total_bytes -= size
+
+    def _keys(self) -> List[str]:
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return [filename[:-len('.json')] for filename in os.listdir(self.cache_dir) if filename.endswith('.json')]
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.pkl.gz')
+
+    def _metadata_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def _read_metadata(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._metadata_path(key), 'r', encoding='utf-8') as file:
+                metadata = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if metadata.get('version') != CACHE_FORMAT_VERSION or not os.path.exists(self._data_path(key)):
+            return None
+        return metadata
+
+    def _write_metadata(self, key: str, metadata: dict):
+        metadata['version'] = CACHE_FORMAT_VERSION
+        with open(self._metadata_path(key), 'w', encoding='utf-8') as file:
+            json.dump(metadata, file)
+
+
+def get_default_cache() -> Optional[InsightsCache]:
+    """Get the Insights cache described by the config, or None if caching is disabled"""
+    if config['insights_cache_ttl_seconds'] <= 0:
+        return None
+    return InsightsCache(config['insights_cache_dir'], config['insights_cache_ttl_seconds'],
+                         config['insights_cache_max_bytes'])
+
+
+def _write_records(file, records: Iterable[dict]) -> Iterator[dict]:
+    """Pickle records to a file as they pass through, storing uniform records as tuples of values"""
+    fields = None
+    chunk = []
+    for record in records:
+        if fields is None:
+            fields = list(record)
+            pickle.dump(fields, file, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(record) == len(fields) and all(field in record for field in fields):
+            chunk.append(tuple(record[field] for field in fields))
+        else:
+            chunk.append(dict(record))
+        if len(chunk) >= ROWS_PER_CHUNK:
+            pickle.dump(chunk, file, protocol=pickle.HIGHEST_PROTOCOL)
+            chunk = []
+        yield record
+    if fields is None:
+        pickle.dump([], file, protocol=pickle.HIGHEST_PROTOCOL)
+    if chunk:
+        pickle.dump(chunk, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_records(path: str) -> Iterator[dict]:
+    with gzip.open(path, 'rb') as file:
+        fields = pickle.load(file)
+        while True:
+            try:
+                chunk = pickle.load(file)
+            except EOFError:
+                return
+            for row in chunk:
+                yield row if isinstance(row, dict) else dict(zip(fields, row))
+
+
+def _hash_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
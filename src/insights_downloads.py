@@ -0,0 +1,148 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+from autohandshake import HandshakeBrowser, HandshakeSession, InsightsPage, FileType
+
+from src.insights_cache import InsightsCache
+from src.session_pool import BrowserPool
+from src.stage_timing import StageTimer
+from src.utils import config, get_datestamped_filename, stream_and_delete_json
+
+
+class DateRangeFilter:
+    """A date range filter to set on an Insights report"""
+
+    def __init__(self, field_category: str, field_title: str, start_date: date, end_date: date):
+        self.field_category = field_category
+        self.field_title = field_title
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def apply(self, insights_page: InsightsPage):
+        insights_page.set_date_range_filter(self.field_category, self.field_title, self.start_date, self.end_date)
+
+    def describe(self) -> list:
+        """Describe the filter as a json-serializable value"""
+        return ['date_range', self.field_category, self.field_title,
+                self.start_date.isoformat(), self.end_date.isoformat()]
+
+
+class InsightsReport:
+    """An Insights report to download, along with any filters to set on it before downloading"""
+
+    def __init__(self, name: str, url: str, filters: List[DateRangeFilter] = None):
+        """
+        :param name: a short name for the report, used to name its downloaded file
+        :param url: the Insights url of the report
+        :param filters: the filters to set on the report before downloading it
+        """
+        self.name = name
+        self.url = url
+        self.filters = filters if filters is not None else []
+
+    @property
+    def cache_key(self) -> str:
+        return InsightsCache.make_key(self.url, [insights_filter.describe() for insights_filter in self.filters])
+
+    def download(self, browser: HandshakeBrowser, download_dir: str,
+                 page_factory: Callable[[str, HandshakeBrowser], InsightsPage] = InsightsPage,
+                 timer: StageTimer = None) -> str:
+        """
+        Download the report as a json file
+
+        :param browser: a logged-in HandshakeBrowser
+        :param download_dir: the directory into which the browser downloads files
+        :param page_factory: a function that creates an InsightsPage from a url and a browser
+        :param timer: a timer on which to record the time spent loading the report (``navigate:<name>``)
+                      and waiting for Insights to export it (``export:<name>``)
+        :return: the filepath of the downloaded file
+        """
+        if timer is None:
+            timer = StageTimer(trace_memory=False)
+        with timer.stage(f'navigate:{self.name}'):
+            insights_page = page_factory(self.url, browser)
+            for insights_filter in self.filters:
+                insights_filter.apply(insights_page)
+        with timer.stage(f'export:{self.name}'):
+            return insights_page.download_file(download_dir, file_name=get_datestamped_filename(self.name),
+                                               file_type=FileType.JSON)
+
+
+def download_insights_reports(reports: List[InsightsReport], browser: HandshakeBrowser,
+                              session_factory: Callable[[], HandshakeSession] = None,
+                              max_workers: int = None, download_dir: str = None,
+                              page_factory: Callable[[str, HandshakeBrowser], InsightsPage] = InsightsPage,
+                              read_func: Callable[[str], Iterable[dict]] = stream_and_delete_json,
+                              cache: InsightsCache = None, refresh: bool = False, timer: StageTimer = None
+                              ) -> Iterator[Tuple[InsightsReport, Iterable[dict]]]:
+    """
+    Download several Insights reports concurrently, yielding each report's data as soon as it arrives.
+
+    Each worker downloads on its own browser: the given browser, plus additional sessions opened
+    with ``session_factory``. Without a session factory, the reports are downloaded one at a time
+    on the given browser. Any error raised while downloading a report is re-raised to the caller.
+
+    Reports found in the cache are yielded first, without being downloaded. Downloaded
+    reports are added to the cache as their data is consumed.
+
+    :param reports: the reports to download
+    :param browser: a logged-in HandshakeBrowser
+    :param session_factory: a function that creates a new, not-yet-opened HandshakeSession
+    :param max_workers: the maximum number of reports to download at once. Defaults to the
+                        ``insights_download_workers`` config value.
+    :param download_dir: the directory into which the browsers download files. Defaults to the
+                         ``download_dir`` config value.
+    :param page_factory: a function that creates an InsightsPage from a url and a browser
+    :param read_func: a function that reads the data of a downloaded file
+    :param cache: the cache of previously downloaded reports, if any
+    :param refresh: whether to download every report even if it is cached
+    :param timer: a timer on which to record each download's stages. If the timer is detailed, the
+                  time spent reading each report's records is also recorded (``parse:<name>``, or
+                  ``read_cache:<name>`` for cached reports).
+    :return: an iterator of (report, data) tuples, in the order the downloads complete
+    """
+    if max_workers is None:
+        max_workers = config['insights_download_workers']
+    if download_dir is None:
+        download_dir = config['download_dir']
+    if timer is None:
+        timer = StageTimer(trace_memory=False)
+    if cache is not None:
+        uncached_reports = []
+        for report in reports:
+            cached_records = None if refresh else cache.get(report.cache_key)
+            if cached_records is None:
+                uncached_reports.append(report)
+            else:
+                yield report, _timed_records(timer, f'read_cache:{report.name}', cached_records)
+        reports = uncached_reports
+    if not reports:
+        return
+    browser_pool = BrowserPool(browser, session_factory, max_workers)
+
+    def _download(report: InsightsReport) -> str:
+        worker_browser = browser_pool.acquire()
+        try:
+            return report.download(worker_browser, download_dir, page_factory, timer)
+        finally:
+            browser_pool.release(worker_browser)
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(reports)))
+    futures = {}
+    try:
+        futures = {executor.submit(_download, report): report for report in reports}
+        for future in as_completed(futures):
+            report = futures[future]
+            records = _timed_records(timer, f'parse:{report.name}', read_func(future.result()))
+            yield report, (cache.put(report.cache_key, records) if cache is not None else records)
+    finally:
+        # downloads that have started can't be cancelled, and their sessions are only closed once they finish
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        browser_pool.close()
+
+
+def _timed_records(timer: StageTimer, name: str, records: Iterable[dict]) -> Iterable[dict]:
+    return timer.timed_iter(name, records) if timer.detailed else records
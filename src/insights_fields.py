@@ -29,3 +29,9 @@ class EventFields:
     EVENT_TYPE = 'Event Type Name'
     LABELS_LIST = 'Institution Labels Name List'
     IS_INVITE_ONLY = 'Events Invite Only? (Yes / No)'
+
+
+class DerivedFields:
+    """Fields that are computed from raw Insights fields and added to records during preprocessing"""
+    START_DATE_TIME = 'Parsed Start Date Time'
+    IS_PAST = 'Is Past'
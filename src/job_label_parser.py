@@ -1,9 +1,20 @@
 import csv
-from typing import List
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterator, List, Tuple
 
 from autohandshake import HandshakeBrowser
 
-from src.utils import to_csv, create_filepath_in_download_dir, get_datestamped_filename
+from src.output_formats import write_output
+from src.utils import config, create_filepath_in_output_dir, get_datestamped_filename
+
+JOB_LABELS_FIELDS = ['job_id', 'job_url', 'qualification_labels']
+ID_COL_NAME = 'Job Id'
+LABELS_COL_NAME = 'Qualification Labels'
+JOB_URL = 'https://jhu.joinhandshake.com/jobs/{}'
 
 
 def run_job_labels_report(browser: HandshakeBrowser) -> str:
@@ -13,38 +24,152 @@ def run_job_labels_report(browser: HandshakeBrowser) -> str:
 
 def create_job_labels_report(input_filepath: str) -> str:
     """
-    Given a valid filepath to a downloaded jobs file, create a report csv detailing which jobs have qualification labels
+    Given a valid filepath to a downloaded jobs file, create a report detailing which jobs have qualification labels
 
     :param input_filepath: the filepath of the raw jobs data
     :return: the output filepath
     """
-    output_filepath = _create_csv_filepath('jobs_qual_labels')
-    to_csv(parse_job_file(input_filepath), output_filepath)
-    return output_filepath
+    return write_output(iter_job_file(input_filepath), _create_output_filepath('jobs_qual_labels'),
+                        fieldnames=JOB_LABELS_FIELDS)
 
 
-def parse_job_file(filepath: str) -> List[dict]:
+def parse_job_file(filepath: str, processes: int = None) -> List[dict]:
     """
     Given a valid filepath to a downloaded jobs file, parse it for qualification labels
 
     :param filepath: the filepath to the raw jobs data file
+    :param processes: the number of processes to parse the file with (see ``iter_job_file``)
     :return: a list of dicts containing job id and labels for all jobs with qualification labels
     """
-    ID_COL_NAME = 'Job Id'
-    LABELS_COL_NAME = 'Qualification Labels'
-    result = []
-    with open(filepath, encoding='utf-8') as file:
-        reader = csv.DictReader(file, delimiter=',', quotechar='"')
-        reader.fieldnames = [field.strip() for field in reader.fieldnames]
-        for row in reader:
-            if row[LABELS_COL_NAME].strip() != '':
-                result.append({
-                    'job_id': row[ID_COL_NAME],
-                    'job_url': f'https://jhu.joinhandshake.com/jobs/{row[ID_COL_NAME]}',
-                    'qualification_labels': [label.strip() for label in row[LABELS_COL_NAME].split(', ')]
-                })
-    return result
-
-
-def _create_csv_filepath(filename: str):
-    return create_filepath_in_download_dir(f'{get_datestamped_filename(filename)}.csv')
+    return list(iter_job_file(filepath, processes))
+
+
+def iter_job_file(filepath: str, processes: int = None, chunk_bytes: int = None) -> Iterator[dict]:
+    """
+    Lazily parse a downloaded jobs file for qualification labels, one row at a time.
+
+    Only the job id and qualification labels columns are read, by their position in the header.
+    Large files can be split into byte ranges that are parsed by a process pool; the rows are
+    still yielded in the order they appear in the file.
+
+    :param filepath: the filepath to the raw jobs data file
+    :param processes: the number of processes to parse the file with. Defaults to the
+                      ``job_file_processes`` config value. Files no larger than one chunk are
+                      always parsed in this process.
+    :param chunk_bytes: the approximate size of each byte range parsed by a process. Defaults to
+                        the ``job_file_chunk_bytes`` config value.
+    :return: an iterator of dicts containing job id and labels for all jobs with qualification labels
+    """
+    if processes is None:
+        processes = config['job_file_processes']
+    if chunk_bytes is None:
+        chunk_bytes = config['job_file_chunk_bytes']
+    if processes <= 1 or os.path.getsize(filepath) <= chunk_bytes:
+        jobs = _iter_labelled_jobs(filepath)
+    else:
+        jobs = _iter_labelled_jobs_in_parallel(filepath, processes, chunk_bytes)
+    for job_id, labels in jobs:
+        yield {
+            'job_id': job_id,
+            'job_url': JOB_URL.format(job_id),
+            'qualification_labels': labels
+        }
+
+
+def _iter_labelled_jobs(filepath: str) -> Iterator[Tuple[str, List[str]]]:
+    with open(filepath, encoding='utf-8', newline='') as file:
+        reader = csv.reader(file, delimiter=',', quotechar='"')
+        id_index, labels_index = _find_columns(next(reader))
+        yield from _labelled_jobs(reader, id_index, labels_index)
+
+
+def _iter_labelled_jobs_in_parallel(filepath: str, processes: int,
+                                    chunk_bytes: int) -> Iterator[Tuple[str, List[str]]]:
+    boundaries = find_record_boundaries(filepath, chunk_bytes)
+    with open(filepath, 'rb') as file:
+        header = file.read(boundaries[0]).decode('utf-8')
+    id_index, labels_index = _find_columns(next(csv.reader(io.StringIO(header, newline=''))))
+    chunks = [(filepath, start, end, id_index, labels_index) for start, end in zip(boundaries, boundaries[1:])]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        # only a few chunks per process are in flight at once, so their results are never all in memory
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_parse_chunk, chunk))
+            if len(pending) >= 2 * processes:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _parse_chunk(chunk: tuple) -> List[Tuple[str, List[str]]]:
+    filepath, start, end, id_index, labels_index = chunk
+    with open(filepath, 'rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode('utf-8')
+    return list(_labelled_jobs(csv.reader(io.StringIO(text, newline=''), delimiter=',', quotechar='"'),
+                               id_index, labels_index))
+
+
+def _labelled_jobs(reader: Iterator[List[str]], id_index: int,
+                   labels_index: int) -> Iterator[Tuple[str, List[str]]]:
+    row_length = max(id_index, labels_index) + 1
+    for row in reader:
+        if len(row) < row_length:
+            continue
+        labels = row[labels_index]
+        if labels.strip():
+            yield row[id_index], [label.strip() for label in labels.split(', ')]
+
+
+def _find_columns(header: List[str]) -> Tuple[int, int]:
+    """Find the positions of the job id and qualification labels columns in a header row"""
+    fieldnames = [field.strip() for field in header]
+    return fieldnames.index(ID_COL_NAME), fieldnames.index(LABELS_COL_NAME)
+
+
+def find_record_boundaries(filepath: str, chunk_bytes: int, block_bytes: int = 1 << 20) -> List[int]:
+    """
+    Split a csv file into byte ranges of roughly equal size that each hold whole records.
+
+    A newline only ends a record if it is not inside a quoted field, which is the case when an
+    even number of quote characters come before it (an escaped quote is a pair of quotes, so it
+    doesn't change the parity). The file is read once, counting quotes a block at a time.
+
+    :param filepath: the csv file to split
+    :param chunk_bytes: the approximate size of each range
+    :param block_bytes: the number of bytes to read at a time
+    :return: the offsets at which each range starts, beginning with the end of the header row,
+             followed by the size of the file
+    """
+    boundaries = []
+    target = 0
+    quote_parity = 0
+    block_start = 0
+    with open(filepath, 'rb') as file:
+        for block in iter(partial(file.read, block_bytes), b''):
+            counted_to = 0
+            position = max(0, target - block_start)
+            while position < len(block):
+                newline = block.find(b'\n', position)
+                if newline == -1:
+                    break
+                quote_parity = (quote_parity + block.count(b'"', counted_to, newline)) % 2
+                counted_to = newline
+                if quote_parity == 0:
+                    boundaries.append(block_start + newline + 1)
+                    target = boundaries[-1] + chunk_bytes
+                    position = max(newline + 1, target - block_start)
+                else:
+                    position = newline + 1
+            quote_parity = (quote_parity + block.count(b'"', counted_to)) % 2
+            block_start += len(block)
+    file_size = block_start
+    if not boundaries:
+        boundaries.append(file_size)
+    if boundaries[-1] != file_size:
+        boundaries.append(file_size)
+    return boundaries
+
+
+def _create_output_filepath(filename: str):
+    return create_filepath_in_output_dir(get_datestamped_filename(filename))
@@ -1,4 +1,6 @@
+import argparse
 import sys
+from functools import partial
 from getpass import getpass
 from typing import List
 
@@ -11,35 +13,65 @@ from src.data_download_functions import (download_appointment_type_settings,
                                          download_pending_student_requests,
                                          download_rejected_student_requests,
                                          download_staff)
+from src.download_job import download_everything
+from src.insights_cache import get_default_cache
 from src.job_label_parser import run_job_labels_report
 from src.rule_sets.daily_verification import daily_verification
+from src.session_pool import SessionPool
 from src.utils import BrowsingSession
 
 
-def main():
-    actions = [
-        {'name': 'Run Daily Rule Verification', 'function': daily_verification},
+def create_actions(session_factory=None, refresh: bool = False) -> List[dict]:
+    """
+    Create the list of actions the user can perform
+
+    :param session_factory: a function that opens additional Handshake sessions, for actions
+                            that can use more than one browser at a time
+    :param refresh: whether actions should download Insights reports even if they are cached
+    :return: a list of action dicts with a "name" and a "function" that takes a browser
+    """
+    return [
+        {'name': 'Run Daily Rule Verification', 'function': partial(daily_verification,
+                                                                    session_factory=session_factory,
+                                                                    refresh=refresh)},
         {'name': 'Download Appointment Type Settings', 'function': download_appointment_type_settings},
         {'name': 'Download Label Settings', 'function': download_label_settings_data},
         {'name': 'Download Major Mapping', 'function': download_major_mapping},
         {'name': 'Download Pending Student Requests', 'function': download_pending_student_requests},
         {'name': 'Download Rejected Student Requests', 'function': download_rejected_student_requests},
         {'name': 'Run Jobs Labels Report', 'function': run_job_labels_report},
-        {'name': 'Download Staff', 'function': download_staff},
+        {'name': 'Download Staff', 'function': partial(download_staff, refresh=refresh)},
+        {'name': 'Download Everything', 'function': partial(download_everything, session_factory=session_factory,
+                                                            refresh=refresh)},
+        {'name': 'Clear Cached Insights Reports', 'function': clear_insights_cache},
         {'name': 'Exit Program', 'function': exit_program}
     ]
 
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='HandshakeAdministrator')
+    parser.add_argument('--refresh', action='store_true',
+                        help='download Insights reports even if a cached copy is available')
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None):
+    args = parse_args(argv)
     print('HandshakeAdministrator')
     print('======================\n')
     program_is_running = True
     while program_is_running:
         do_not_restart_browser = True
         password = getpass(prompt='Please enter your Handshake password: ')
-        with BrowsingSession(password) as browser:
+        session_pool = SessionPool(partial(BrowsingSession, password))
+        actions = create_actions(partial(session_pool.session, block=False), args.refresh)
+        with session_pool:
+            session_pool.warm()
             while do_not_restart_browser:
                 try:
                     user_selection = get_user_selection(actions)
-                    perform_action(actions, user_selection, browser)
+                    with session_pool.session() as browser:
+                        perform_action(actions, user_selection, browser)
                     print()  # blank line for formatting
                 except SystemExit:
                     do_not_restart_browser = False
@@ -51,7 +83,11 @@ def main():
                     if not user_wants_to_try_again:
                         print_goodbye_message()
                         program_is_running = False
-                    do_not_restart_browser = False
+                        do_not_restart_browser = False
+                    elif isinstance(e, InvalidPasswordError):
+                        # the open sessions are health-checked before they are reused, so only a
+                        # wrong password needs the sessions to be restarted
+                        do_not_restart_browser = False
 
 
 def get_user_selection(actions: List[dict]) -> int:
@@ -76,7 +112,8 @@ def perform_action(actions, action_index, *args):
     action = actions[action_index]
     print(f'Performing action: "{action["name"]}"')
     filepath = action['function'](*args)
-    print(f'Results saved at {filepath}')
+    if filepath is not None:
+        print(f'Results saved at {filepath}')
 
 
 def user_selection_is_valid(user_selection: int, actions: List[dict]) -> bool:
@@ -87,6 +124,14 @@ def print_goodbye_message():
     print('Goodbye!')
 
 
+def clear_insights_cache(*args):
+    """Remove every cached Insights report, so that the next actions download fresh data"""
+    cache = get_default_cache()
+    if cache is not None:
+        cache.clear()
+    print('Cached Insights reports cleared')
+
+
 def exit_program(*args):
     print_goodbye_message()
     sys.exit(0)
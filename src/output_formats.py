@@ -0,0 +1,206 @@
+import csv
+import json
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Mapping
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; only the Parquet and Arrow formats need it
+    pa = None
+    pq = None
+
+from src.utils import config, to_csv
+
+ROWS_PER_BATCH = 10000
+OUTPUT_BUFFER_BYTES = 1 << 20
+
+
+class OutputFormat:
+    """A file format that rows of results can be written to"""
+    name = None
+    extension = None
+
+    def __init__(self, rows_per_batch: int = ROWS_PER_BATCH):
+        """
+        :param rows_per_batch: the number of rows to buffer before writing them to the file
+        """
+        self.rows_per_batch = rows_per_batch
+
+    def write(self, rows: Iterable[dict], file_path: str, fieldnames: List[str] = None) -> int:
+        """
+        Write rows to a file, consuming them lazily
+
+        :param rows: an iterable of dicts with a uniform structure
+        :param file_path: the file path at which to create the file
+        :param fieldnames: the column names. Defaults to the keys of the first row.
+        :return: the number of rows written
+        """
+        raise NotImplementedError
+
+    def count_rows(self, file_path: str) -> int:
+        """
+        Count the rows in a file written in this format
+
+        :param file_path: the file to count
+        :return: the number of rows, not including any header
+        """
+        raise NotImplementedError
+
+
+class CsvFormat(OutputFormat):
+    name = 'csv'
+    extension = '.csv'
+
+    def write(self, rows: Iterable[dict], file_path: str, fieldnames: List[str] = None) -> int:
+        return to_csv(rows, file_path, fieldnames, self.rows_per_batch)
+
+    def count_rows(self, file_path: str) -> int:
+        with open(file_path, encoding='utf-8', newline='') as csv_file:
+            return max(0, sum(1 for _ in csv.reader(csv_file)) - 1)
+
+
+class JsonLinesFormat(OutputFormat):
+    """One json object per line, which downstream tools can read a row at a time"""
+    name = 'jsonl'
+    extension = '.jsonl'
+
+    def write(self, rows: Iterable[dict], file_path: str, fieldnames: List[str] = None) -> int:
+        row_count = 0
+        with open(file_path, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_BYTES) as output_file:
+            for batch in _batches(rows, self.rows_per_batch):
+                output_file.write(''.join(f'{json.dumps(row, default=str)}\n' for row in _as_dicts(batch)))
+                row_count += len(batch)
+        return row_count
+
+    def count_rows(self, file_path: str) -> int:
+        with open(file_path, encoding='utf-8') as jsonl_file:
+            return sum(1 for line in jsonl_file if line.strip())
+
+
+class _ArrowFormat(OutputFormat):
+    """A compressed columnar format written with pyarrow, one record batch at a time"""
+    compression = 'zstd'
+
+    def __init__(self, rows_per_batch: int = ROWS_PER_BATCH):
+        if pa is None:
+            raise ImportError(f'pyarrow is required to write {self.name} files')
+        super().__init__(rows_per_batch)
+
+    def write(self, rows: Iterable[dict], file_path: str, fieldnames: List[str] = None) -> int:
+        batches = (_as_dicts(batch) for batch in _batches(rows, self.rows_per_batch))
+        first_batch = next(batches, [])
+        if fieldnames is None:
+            fieldnames = list(first_batch[0].keys()) if first_batch else []
+        schema = _infer_schema(first_batch, fieldnames)
+        row_count = 0
+        with self._open_writer(file_path, schema) as writer:
+            for batch in chain([first_batch] if first_batch else [], batches):
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                row_count += len(batch)
+        return row_count
+
+    def _open_writer(self, file_path: str, schema):
+        raise NotImplementedError
+
+
+class ParquetFormat(_ArrowFormat):
+    name = 'parquet'
+    extension = '.parquet'
+
+    def _open_writer(self, file_path: str, schema):
+        return pq.ParquetWriter(file_path, schema, compression=self.compression)
+
+    def count_rows(self, file_path: str) -> int:
+        return pq.ParquetFile(file_path).metadata.num_rows
+
+
+class ArrowFormat(_ArrowFormat):
+    """The Arrow IPC file format, also known as Feather v2"""
+    name = 'arrow'
+    extension = '.arrow'
+
+    def _open_writer(self, file_path: str, schema):
+        return pa.ipc.new_file(file_path, schema, options=pa.ipc.IpcWriteOptions(compression=self.compression))
+
+    def count_rows(self, file_path: str) -> int:
+        with pa.memory_map(file_path) as source:
+            reader = pa.ipc.open_file(source)
+            return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+
+
+OUTPUT_FORMATS: Dict[str, type] = {output_format.name: output_format
+                                   for output_format in [CsvFormat, JsonLinesFormat, ParquetFormat, ArrowFormat]}
+
+
+def get_output_format(name: str = None) -> OutputFormat:
+    """
+    Get an output format by name
+
+    :param name: the name of the format. Defaults to the ``output_format`` config value.
+    :return: the output format
+    """
+    if name is None:
+        name = config['output_format']
+    try:
+        return OUTPUT_FORMATS[name]()
+    except KeyError:
+        raise ValueError(f'Unknown output format "{name}". Expected one of: {", ".join(OUTPUT_FORMATS)}')
+
+
+def count_output_rows(file_path: str) -> int:
+    """
+    Count the rows in a file written by ``write_output``, using the format its extension names
+
+    :param file_path: the file to count
+    :return: the number of rows, not including any header
+    """
+    for output_format in OUTPUT_FORMATS.values():
+        if file_path.endswith(output_format.extension):
+            return output_format().count_rows(file_path)
+    raise ValueError(f'"{file_path}" does not have the extension of a known output format')
+
+
+def write_output(rows: Iterable[dict], file_path_without_extension: str, fieldnames: List[str] = None,
+                 output_format: OutputFormat = None) -> str:
+    """
+    Write rows to a file in the configured output format
+
+    :param rows: an iterable of dicts with a uniform structure
+    :param file_path_without_extension: the file path to write to, to which the format's extension is added
+    :param fieldnames: the column names. Defaults to the keys of the first row.
+    :param output_format: the format to write. Defaults to the ``output_format`` config value.
+    :return: the file path of the new file
+    """
+    if output_format is None:
+        output_format = get_output_format()
+    file_path = f'{file_path_without_extension}{output_format.extension}'
+    output_format.write(rows, file_path, fieldnames)
+    return file_path
+
+
+def _infer_schema(rows: List[dict], fieldnames: List[str]):
+    """Infer a schema from the first batch of rows, storing columns with no values yet as strings"""
+    inferred = pa.Table.from_pylist(rows, schema=None).schema if rows else pa.schema([])
+    return pa.schema([pa.field(name, _column_type(inferred, name)) for name in fieldnames])
+
+
+def _column_type(inferred_schema, name: str):
+    index = inferred_schema.get_field_index(name)
+    if index == -1 or pa.types.is_null(inferred_schema.field(index).type):
+        return pa.string()
+    return inferred_schema.field(index).type
+
+
+def _batches(rows: Iterable[dict], batch_size: int) -> Iterator[List[dict]]:
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _as_dicts(rows: List[Mapping]) -> List[dict]:
+    """Convert rows that are read-only mappings, like rule error records, to the dicts that encoders expect"""
+    return [row if isinstance(row, dict) else dict(row) for row in rows]
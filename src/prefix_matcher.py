@@ -0,0 +1,39 @@
+import re
+from typing import Dict, Iterable, Optional
+
+
+class PrefixMatcher:
+    """
+    Find which of a group's prefixes a string starts with.
+
+    The prefixes of each group are compiled once into a single regular expression, so checking
+    a string against every prefix of a group takes one call instead of a loop over ``startswith``.
+    """
+
+    def __init__(self, prefixes_by_group: Dict[str, Iterable[str]]):
+        """
+        :param prefixes_by_group: a dict mapping each group to its prefixes
+        """
+        self._patterns = {group: _compile_prefixes(prefixes) for group, prefixes in prefixes_by_group.items()}
+
+    def match(self, group: str, string: str) -> Optional[str]:
+        """
+        Get the longest of a group's prefixes that a string starts with
+
+        :param group: the group whose prefixes to match. Raises a KeyError if the group is unknown.
+        :param string: the string to match
+        :return: the matched prefix, or None if the string starts with none of the group's prefixes
+        """
+        match = self._patterns[group].match(string)
+        return match.group() if match else None
+
+    def __contains__(self, group: str) -> bool:
+        return group in self._patterns
+
+
+def _compile_prefixes(prefixes: Iterable[str]):
+    # alternatives are tried in order, so longer prefixes go first to match as much as possible
+    alternatives = sorted(set(prefixes), key=len, reverse=True)
+    if not alternatives:
+        return re.compile(r'(?!)')
+    return re.compile('|'.join(re.escape(prefix) for prefix in alternatives))
@@ -0,0 +1,157 @@
+from bisect import bisect_left
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List
+
+from src.insights_fields import DerivedFields
+
+INSIGHTS_DATE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_insights_date_time(date_time_str: str) -> datetime:
+    """
+    Parse a date time string in the fixed format used by Insights exports (e.g. "2019-09-04 15:30:00").
+
+    Slicing the fixed-width fields is several times faster than ``datetime.strptime``, which
+    is only used as a fallback for strings that are not in the expected fixed-width layout.
+
+    :param date_time_str: the date time string to parse
+    :return: the parsed datetime
+    """
+    if (len(date_time_str) == 19 and date_time_str[4] == '-' and date_time_str[7] == '-'
+            and date_time_str[10] == ' ' and date_time_str[13] == ':' and date_time_str[16] == ':'):
+        try:
+            return datetime(int(date_time_str[0:4]), int(date_time_str[5:7]), int(date_time_str[8:10]),
+                            int(date_time_str[11:13]), int(date_time_str[14:16]), int(date_time_str[17:19]))
+        except ValueError:
+            pass
+    return datetime.strptime(date_time_str, INSIGHTS_DATE_TIME_FORMAT)
+
+
+class DateTimeParser:
+    """
+    An Insights date time parser that caches its results.
+
+    Exports often contain many records with the same start time, so a single parser
+    should be shared by every dataset in a run.
+    """
+
+    def __init__(self):
+        self._cache = {}
+
+    def parse(self, date_time_str: str) -> datetime:
+        try:
+            return self._cache[date_time_str]
+        except KeyError:
+            parsed = parse_insights_date_time(date_time_str)
+            self._cache[date_time_str] = parsed
+            return parsed
+
+
+def prepare_records(records: List[dict], start_date_time_field: str, parser: DateTimeParser = None,
+                    now: datetime = None) -> List[dict]:
+    """
+    Prepare records in place, so that rules do not need to parse or compare their start date
+    times again: parse the start date time of each record once, storing it in the record under
+    ``DerivedFields.START_DATE_TIME``, and flag whether the record starts before ``now`` under
+    ``DerivedFields.IS_PAST``.
+
+    Records without a start date time get None as their start date time and no flag, so rules
+    that depend on whether they are past raise an error for them (see ``is_past_record``)
+    rather than treating them as future records.
+
+    :param records: the records to prepare. They are modified in place and also returned.
+    :param start_date_time_field: the raw field containing each record's start date time
+    :param parser: the date time parser to use. A new one is created if none is given.
+    :param now: the reference time that separates past records from future ones. Defaults
+                to the current time. Pass the same value for every dataset in a run so that
+                all records are classified against the same clock.
+    :return: the prepared records
+    """
+    if parser is None:
+        parser = DateTimeParser()
+    if now is None:
+        now = datetime.now()
+    for record in records:
+        date_time_str = record.get(start_date_time_field)
+        record[DerivedFields.START_DATE_TIME] = parser.parse(date_time_str) if date_time_str is not None else None
+    is_past = split_past_and_future((record[DerivedFields.START_DATE_TIME] for record in records), now)
+    for record in records:
+        start_date_time = record[DerivedFields.START_DATE_TIME]
+        if start_date_time is not None:
+            record[DerivedFields.IS_PAST] = is_past[start_date_time]
+    return records
+
+
+def prepare_record_stream(records: Iterable[dict], start_date_time_field: str, parser: DateTimeParser = None,
+                          now: datetime = None, chunk_size: int = 10000) -> Iterator[dict]:
+    """
+    Lazily prepare a stream of records (see :func:`prepare_records`), a chunk at a time.
+
+    :param records: the records to prepare. They are modified in place.
+    :param start_date_time_field: the raw field containing each record's start date time
+    :param parser: the date time parser to use. A new one is created if none is given.
+    :param now: the reference time that separates past records from future ones. Defaults
+                to the current time.
+    :param chunk_size: the number of records to prepare at a time
+    :return: an iterator over the prepared records
+    """
+    if parser is None:
+        parser = DateTimeParser()
+    if now is None:
+        now = datetime.now()
+    records = iter(records)
+    chunk = list(islice(records, chunk_size))
+    while chunk:
+        yield from prepare_records(chunk, start_date_time_field, parser, now)
+        chunk = list(islice(records, chunk_size))
+
+
+def split_past_and_future(date_times: Iterable[datetime], now: datetime) -> Dict[datetime, bool]:
+    """
+    Classify a collection of date times as past or future relative to ``now`` in one step.
+
+    The distinct date times are sorted once and split at a single bisection cutoff, rather
+    than comparing every record against the clock.
+
+    :param date_times: the date times to classify. ``None`` values are ignored.
+    :param now: the reference time
+    :return: a dict mapping each distinct date time to whether it is before ``now``
+    """
+    distinct = sorted({date_time for date_time in date_times if date_time is not None})
+    cutoff = bisect_left(distinct, now)
+    is_past = dict.fromkeys(distinct[:cutoff], True)
+    is_past.update(dict.fromkeys(distinct[cutoff:], False))
+    return is_past
+
+
+def get_start_date_time(record: dict, start_date_time_field: str) -> datetime:
+    """
+    Get a record's start date time, using the pre-parsed value if the record has been prepared.
+
+    :param record: the record whose start date time to get
+    :param start_date_time_field: the raw field containing the record's start date time
+    :return: the record's start date time
+    """
+    try:
+        return record[DerivedFields.START_DATE_TIME]
+    except KeyError:
+        return parse_insights_date_time(record[start_date_time_field])
+
+
+def is_past_record(record: dict, start_date_time_field: str) -> bool:
+    """
+    Determine whether a record starts in the past, using the precomputed flag if the record
+    has been prepared and the current time otherwise.
+
+    :param record: the record to check
+    :param start_date_time_field: the raw field containing the record's start date time
+    :return: True if the record starts in the past, False otherwise
+    :raises ValueError: if the record has no start date time
+    """
+    try:
+        return record[DerivedFields.IS_PAST]
+    except KeyError:
+        if record.get(start_date_time_field) is None:
+            raise ValueError(f'Record has no {start_date_time_field!r}, so whether it is in the past is unknown')
+        return get_start_date_time(record, start_date_time_field) < datetime.now()
@@ -0,0 +1,305 @@
+"""
+Declare rules as conditions on a record's fields instead of as hand-written error functions.
+
+A rule is declared as a list of cases, each pairing a condition with the error message to
+report when it holds, e.g.::
+
+    has_career_center = field(EventFields.CAREER_CENTER).is_truthy()
+    rule = make_declared_rule('Past events are not virtual sessions', 'past_event_virtual_session', EventError,
+                              [when(is_past(EventFields.START_DATE_TIME) &
+                                    field(EventFields.EVENT_TYPE).eq('Virtual Session') & has_career_center,
+                                    _build_virtual_session_error_message)])
+
+Values and conditions only describe a rule. When the rule is created, each of them is compiled
+once into a small function, and these are nested into the rule's error function, so checking
+a record never defines a closure.
+"""
+import operator
+from typing import Callable, Iterable, Sequence
+
+from src.insights_fields import DerivedFields
+from src.preprocessing import is_past_record
+from src.rule_verification import ErrorRecord, Rule
+
+##########################
+# VALUES
+##########################
+
+
+class Value:
+    """A value computed from a record, on which conditions can be built"""
+
+    def compile(self) -> Callable[[dict], object]:
+        """Create a function that computes the value from a record"""
+        raise NotImplementedError
+
+    def eq(self, value) -> 'Condition':
+        return _Compare(self, operator.eq, value)
+
+    def ne(self, value) -> 'Condition':
+        return _Compare(self, operator.ne, value)
+
+    def is_in(self, values: Iterable) -> 'Condition':
+        return _Compare(self, _is_in, frozenset(values))
+
+    def startswith(self, *prefixes: str) -> 'Condition':
+        return _Compare(self, str.startswith, prefixes)
+
+    def contains(self, value) -> 'Condition':
+        return _Compare(self, operator.contains, value)
+
+    def is_truthy(self) -> 'Condition':
+        return _Test(self, operator.truth)
+
+    def is_falsy(self) -> 'Condition':
+        return _Test(self, operator.not_)
+
+    def apply(self, func: Callable) -> 'Value':
+        """A value computed by calling a module-level function on this value"""
+        return _Applied(self, func)
+
+    def lower(self) -> 'Value':
+        return _Applied(self, str.lower)
+
+
+class _Field(Value):
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def compile(self) -> Callable[[dict], object]:
+        return operator.itemgetter(self.name)
+
+
+class _Applied(Value):
+
+    def __init__(self, value: Value, func: Callable):
+        self.value = value
+        self.func = func
+
+    def compile(self) -> Callable[[dict], object]:
+        get_value, func = self.value.compile(), self.func
+
+        def _applied(record: dict):
+            return func(get_value(record))
+        return _applied
+
+
+def field(name: str) -> Value:
+    """The value of one of a record's fields"""
+    return _Field(name)
+
+
+##########################
+# CONDITIONS
+##########################
+
+
+class Condition:
+    """A condition on a record, which is combined with others using ``&``, ``|`` and ``~``"""
+
+    def compile(self) -> Callable[[dict], bool]:
+        """Create a function that tests the condition on a record"""
+        raise NotImplementedError
+
+    def __and__(self, other: 'Condition') -> 'Condition':
+        return all_of(self, other)
+
+    def __or__(self, other: 'Condition') -> 'Condition':
+        return any_of(self, other)
+
+    def __invert__(self) -> 'Condition':
+        return _Not(self)
+
+
+class _Compare(Condition):
+    """Holds if ``test(value, constant)`` does"""
+
+    def __init__(self, value: Value, test: Callable[[object, object], bool], constant):
+        self.value = value
+        self.test = test
+        self.constant = constant
+
+    def compile(self) -> Callable[[dict], bool]:
+        get_value, test, constant = self.value.compile(), self.test, self.constant
+
+        def _compare(record: dict) -> bool:
+            return test(get_value(record), constant)
+        return _compare
+
+
+class _Test(Condition):
+    """Holds if ``test(value)`` does"""
+
+    def __init__(self, value: Value, test: Callable[[object], bool]):
+        self.value = value
+        self.test = test
+
+    def compile(self) -> Callable[[dict], bool]:
+        get_value, test = self.value.compile(), self.test
+
+        def _test(record: dict) -> bool:
+            return test(get_value(record))
+        return _test
+
+    def __invert__(self) -> Condition:
+        if self.test is operator.truth:
+            return _Test(self.value, operator.not_)
+        if self.test is operator.not_:
+            return _Test(self.value, operator.truth)
+        return _Not(self)
+
+
+class _IsPast(Condition):
+
+    def __init__(self, time_field: str):
+        self.time_field = time_field
+
+    def compile(self) -> Callable[[dict], bool]:
+        time_field = self.time_field
+
+        def _is_past(record: dict) -> bool:
+            # prepared records have the flag precomputed, so it is read without calling is_past_record
+            try:
+                return record[DerivedFields.IS_PAST]
+            except KeyError:
+                return is_past_record(record, time_field)
+        return _is_past
+
+
+class _All(Condition):
+
+    def __init__(self, conditions: tuple):
+        self.conditions = conditions
+
+    def compile(self) -> Callable[[dict], bool]:
+        tests = tuple(condition.compile() for condition in self.conditions)
+
+        def _all(record: dict) -> bool:
+            for test in tests:
+                if not test(record):
+                    return False
+            return True
+        return _all
+
+
+class _Any(Condition):
+
+    def __init__(self, conditions: tuple):
+        self.conditions = conditions
+
+    def compile(self) -> Callable[[dict], bool]:
+        tests = tuple(condition.compile() for condition in self.conditions)
+
+        def _any(record: dict) -> bool:
+            for test in tests:
+                if test(record):
+                    return True
+            return False
+        return _any
+
+
+class _Not(Condition):
+
+    def __init__(self, condition: Condition):
+        self.condition = condition
+
+    def compile(self) -> Callable[[dict], bool]:
+        test = self.condition.compile()
+
+        def _not(record: dict) -> bool:
+            return not test(record)
+        return _not
+
+    def __invert__(self) -> Condition:
+        return self.condition
+
+
+def all_of(*conditions: Condition) -> Condition:
+    """A condition that holds if every one of the given conditions does, tested in order"""
+    return _All(tuple(inner for condition in conditions
+                      for inner in (condition.conditions if isinstance(condition, _All) else (condition,))))
+
+
+def any_of(*conditions: Condition) -> Condition:
+    """A condition that holds if any of the given conditions does, tested in order"""
+    return _Any(tuple(inner for condition in conditions
+                      for inner in (condition.conditions if isinstance(condition, _Any) else (condition,))))
+
+
+def is_past(time_field: str) -> Condition:
+    """A condition that holds if a record starts before the current time (see ``is_past_record``)"""
+    return _IsPast(time_field)
+
+
+def _is_in(value, values: frozenset) -> bool:
+    return value in values
+
+
+##########################
+# RULES
+##########################
+
+
+class Case:
+    """A condition under which a rule is broken, and the error message to report when it is"""
+
+    def __init__(self, condition: Condition, message_func: Callable[..., str], message_args: tuple):
+        self.condition = condition
+        self.message_func = message_func
+        self.message_args = message_args
+
+
+def when(condition: Condition, message_func: Callable[..., str], *message_args) -> Case:
+    """
+    Declare that a rule is broken when a condition holds
+
+    :param condition: the condition
+    :param message_func: the function that builds the error message, as taken by the rule's error type
+    :param message_args: further arguments of the message function
+    :return: the case
+    """
+    return Case(condition, message_func, message_args)
+
+
+class DeclaredRule(Rule):
+    """
+    A rule declared as a list of cases, the first of which to hold determines the rule's error.
+
+    Declared rules are pickled as their declaration and compiled again when they are unpickled,
+    so they can be sent to worker processes.
+    """
+
+    def __init__(self, rule: str, rule_abbrev: str, error_type: Callable[..., ErrorRecord], cases: Sequence[Case],
+                 fields: Sequence[str] = None, time_field: str = None):
+        """
+        :param rule: the description of the rule
+        :param rule_abbrev: the rule's abbreviation
+        :param error_type: the type of the rule's errors, called with the record, the case's message
+                           function and the case's message arguments
+        :param cases: the cases in which the rule is broken
+        :param fields: the raw fields the rule reads (see ``Rule``)
+        :param time_field: the start date time field the rule depends on (see ``Rule``)
+        """
+        self.error_type = error_type
+        self.cases = tuple(cases)
+        super().__init__(rule, rule_abbrev, _compile_cases(error_type, self.cases), fields, time_field)
+
+    def __reduce__(self):
+        return DeclaredRule, (self.rule, self.rule_abbrev, self.error_type, self.cases, self.fields, self.time_field)
+
+
+def make_declared_rule(rule: str, rule_abbrev: str, error_type: Callable[..., ErrorRecord], cases: Sequence[Case],
+                       fields: Sequence[str] = None, time_field: str = None) -> DeclaredRule:
+    return DeclaredRule(rule, rule_abbrev, error_type, cases, fields, time_field)
+
+
+def _compile_cases(error_type: Callable[..., ErrorRecord], cases: Sequence[Case]) -> Callable[[dict], ErrorRecord]:
+    checks = tuple((case.condition.compile(), case.message_func, case.message_args) for case in cases)
+
+    def _check_cases(record: dict):
+        for test, message_func, message_args in checks:
+            if test(record):
+                return error_type(record, message_func, *message_args)
+        return None
+    return _check_cases
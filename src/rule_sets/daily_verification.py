@@ -1,9 +1,15 @@
 import os
-from datetime import datetime
-from typing import List
+import time
+from datetime import date, datetime
+from typing import Callable, Iterable, List, Tuple
 
-from autohandshake import HandshakeBrowser, InsightsPage, FileType
+from autohandshake import HandshakeBrowser, HandshakeSession, InsightsPage
 
+from src.incremental_verification import IncrementalVerification, VerificationState
+from src.insights_cache import InsightsCache, get_default_cache
+from src.insights_downloads import DateRangeFilter, InsightsReport, download_insights_reports
+from src.insights_fields import EventFields, AppointmentFields
+from src.preprocessing import DateTimeParser, prepare_record_stream
 from src.rule_verification import VerificationResult
 from src.rules.appointment_rules import (
     past_appointments_have_finalized_status,
@@ -15,54 +21,214 @@ from src.rules.event_rules import (
     advertisement_events_are_labeled,
     past_events_do_not_have_virtual_event_type
 )
-from src.utils import (write_to_file, create_filepath_in_download_dir,
-                       get_datestamped_filename, read_and_delete_json, config)
-from src.verification_report import verify_rules, create_error_csv, VerificationReport
+from src.stage_timing import StageTimer
+from src.utils import (create_filepath_in_download_dir, create_filepath_in_output_dir,
+                       get_datestamped_filename, config)
+from src.verification_report import (verify_rules, create_error_csv, create_partitioned_error_files,
+                                     VerificationReport)
 
 EVENTS_INSIGHTS_LINK = 'https://app.joinhandshake.com/analytics/reports/new?looker_explore_name=events&qid=Px5MNaPitl7UnHHxoebDUY'
 APPTS_INSIGHTS_LINK = 'https://app.joinhandshake.com/analytics/reports/new?looker_explore_name=appointments&qid=CaUfmA5D75NHxky8RrLEb1'
 
 REPORT_FILEPATH = create_filepath_in_download_dir(f'{get_datestamped_filename("daily_rule_verification_results")}.txt')
 APPT_STATUS_CSV_FILEPATH = create_filepath_in_download_dir(f'{get_datestamped_filename("appt_status_errors")}.csv')
-OUTPUT_DIR = create_filepath_in_download_dir(f'{get_datestamped_filename("daily_rule_verification_results")}')
-
-
-def daily_verification(browser: HandshakeBrowser) -> str:
-    events = _get_event_data(browser)
-    appts = _get_appointment_data(browser)
-    results = verify_rules([
-        (jhu_owned_events_are_prefixed_correctly, events),
-        (events_are_invite_only_iff_not_university_wide, events),
-        (advertisement_events_are_labeled, events),
-        (past_events_do_not_have_virtual_event_type, events),
-        (all_appointments_have_a_type, appts),
-        (past_appointments_have_finalized_status, appts)
+SUMMARY_BUFFER_BYTES = 1 << 20
+TIMING_REPORT_FILENAME = 'timing.json'
+SUMMARY_FILENAME = 'summary.json'
+PROFILE_FILENAME = 'profile.pstats'
+
+EVENTS_DATE_RANGE = (date(2019, 7, 1), date(2020, 7, 1))
+
+
+def create_events_report(start_date: date, end_date: date) -> InsightsReport:
+    """Create the events report, filtered to events starting within the given dates"""
+    return InsightsReport('events', EVENTS_INSIGHTS_LINK, [
+        DateRangeFilter('Events', 'Start Date Date', start_date, end_date)
     ])
-    os.mkdir(OUTPUT_DIR)
-    _write_error_csvs(results, OUTPUT_DIR)
-    _write_summary_text_report(VerificationReport(results), os.path.join(OUTPUT_DIR, 'all_errors.txt'))
-    return OUTPUT_DIR
 
 
-def _get_event_data(browser: HandshakeBrowser) -> List[dict]:
-    events_insights = InsightsPage(EVENTS_INSIGHTS_LINK, browser)
-    events_insights.set_date_range_filter('Events', 'Start Date Date', datetime(2019, 7, 1).date(),
-                                          datetime(2020, 7, 1).date())
-    filepath = events_insights.download_file(config['download_dir'], file_type=FileType.JSON)
-    return read_and_delete_json(filepath)
+EVENTS_REPORT = create_events_report(*EVENTS_DATE_RANGE)
+APPTS_REPORT = InsightsReport('appointments', APPTS_INSIGHTS_LINK)
+
+EVENT_RULES = [
+    jhu_owned_events_are_prefixed_correctly,
+    events_are_invite_only_iff_not_university_wide,
+    advertisement_events_are_labeled,
+    past_events_do_not_have_virtual_event_type
+]
+APPT_RULES = [
+    all_appointments_have_a_type,
+    past_appointments_have_finalized_status
+]
+
+# the rules to verify against each report, in the order their results are reported
+RULE_SETS = [
+    (EVENTS_REPORT, EventFields.START_DATE_TIME, EVENT_RULES),
+    (APPTS_REPORT, AppointmentFields.START_DATE_TIME, APPT_RULES)
+]
+
+
+def daily_verification(browser: HandshakeBrowser, now: datetime = None,
+                       session_factory: Callable[[], HandshakeSession] = None,
+                       page_factory: Callable[[str, HandshakeBrowser], InsightsPage] = InsightsPage,
+                       refresh: bool = False) -> str:
+    """
+    Download the events and appointments data and verify the daily rules against it.
+
+    :param browser: a logged-in HandshakeBrowser
+    :param now: the reference time used by every time-dependent rule. Defaults to the time
+                the verification starts.
+    :param session_factory: a function that creates a new HandshakeSession. If given, the
+                            Insights reports are downloaded concurrently in separate sessions.
+    :param page_factory: a function that creates an InsightsPage from a url and a browser
+    :param refresh: whether to download the Insights reports even if they are cached. The daily
+                    verification only uses the Insights cache if the
+                    ``verification_uses_insights_cache`` config value is set, since it is run several
+                    times a day to check the latest data.
+    :return: the directory containing the verification results
+    """
+    output_dir, _ = verify_daily_rules(browser, now, session_factory, page_factory, refresh)
+    return output_dir
+
+
+def verify_daily_rules(browser: HandshakeBrowser, now: datetime = None,
+                       session_factory: Callable[[], HandshakeSession] = None,
+                       page_factory: Callable[[str, HandshakeBrowser], InsightsPage] = InsightsPage,
+                       refresh: bool = False, output_dir: str = None, events_date_range: tuple = None,
+                       timer: StageTimer = None, summary_only: bool = False,
+                       partition_errors: bool = None) -> Tuple[str, VerificationReport]:
+    """
+    Verify the daily rules and write their results, as in ``daily_verification``.
+
+    :param output_dir: the directory in which to write the results. Defaults to a datestamped
+                       directory in the output directory (see ``create_filepath_in_output_dir``).
+    :param events_date_range: a (start date, end date) tuple of the events to verify. Defaults
+                              to ``EVENTS_DATE_RANGE``.
+    :param timer: a timer with which to record how long each stage takes. The stages of this run
+                  are also written to ``timing.json`` in the output directory, and, if the
+                  ``timing_profile`` config value is set, a cProfile of it to ``profile.pstats``.
+    :param summary_only: whether to only count each rule's errors, by career center for events
+                         and by staff member for appointments. Only a json summary of the counts
+                         is written, to ``summary.json``, instead of the error files and text report.
+    :param partition_errors: whether to split the error files by career center for events and by
+                             staff member for appointments, into a subdirectory for each (see
+                             ``create_partitioned_error_files``). Defaults to the
+                             ``partition_error_files`` config value.
+    :return: the directory containing the verification results, and the verification report
+    """
+    if now is None:
+        now = datetime.now()
+    if output_dir is None:
+        output_dir = create_filepath_in_output_dir(get_datestamped_filename('daily_rule_verification_results'))
+    if partition_errors is None:
+        partition_errors = config['partition_error_files']
+    timer = timer.child() if timer is not None else StageTimer()
+    try:
+        if config['timing_profile']:
+            with timer.profile() as profiler:
+                report = _verify_and_write_results(browser, now, session_factory, page_factory, refresh,
+                                                   output_dir, events_date_range, timer, summary_only,
+                                                   partition_errors)
+            profiler.dump_stats(os.path.join(output_dir, PROFILE_FILENAME))
+        else:
+            report = _verify_and_write_results(browser, now, session_factory, page_factory, refresh,
+                                               output_dir, events_date_range, timer, summary_only,
+                                               partition_errors)
+        timer.write_report(os.path.join(output_dir, TIMING_REPORT_FILENAME))
+    finally:
+        timer.close()
+    return output_dir, report
+
+
+def _verify_and_write_results(browser: HandshakeBrowser, now: datetime,
+                              session_factory: Callable[[], HandshakeSession],
+                              page_factory: Callable[[str, HandshakeBrowser], InsightsPage],
+                              refresh: bool, output_dir: str, events_date_range: tuple,
+                              timer: StageTimer, summary_only: bool = False,
+                              partition_errors: bool = False) -> VerificationReport:
+    rule_sets = RULE_SETS
+    if events_date_range is not None:
+        rule_sets = [(create_events_report(*events_date_range), EventFields.START_DATE_TIME, EVENT_RULES),
+                     (APPTS_REPORT, AppointmentFields.START_DATE_TIME, APPT_RULES)]
+    incremental = None
+    if config['incremental_verification']:
+        incremental = IncrementalVerification(VerificationState.load(config['verification_state_path']), now)
+    results = _verify_rule_sets(rule_sets, browser, now, session_factory, page_factory,
+                                cache=get_default_cache() if config['verification_uses_insights_cache'] else None,
+                                refresh=refresh, incremental=incremental, timer=timer,
+                                counts_only=summary_only)
+    if incremental is not None:
+        incremental.state.save(config['verification_state_path'])
+    report = VerificationReport(results)
+    os.makedirs(output_dir)
+    if summary_only:
+        with timer.stage('write_summary_json'):
+            with open(os.path.join(output_dir, SUMMARY_FILENAME), 'w', encoding='utf-8') as summary_file:
+                report.write_summary(summary_file)
+        return report
+    with timer.stage('write_error_files'):
+        _write_error_csvs(results, output_dir, timer, partition_errors)
+    with timer.stage('write_summary_report') as stage:
+        _write_summary_text_report(report, os.path.join(output_dir, 'all_errors.txt'))
+        stage.add_rows(sum(len(result.errors) for result in results))
+    return report
 
 
-def _get_appointment_data(browser: HandshakeBrowser) -> List[dict]:
-    appts_insights = InsightsPage(APPTS_INSIGHTS_LINK, browser)
-    filepath = appts_insights.download_file(config['download_dir'], file_type=FileType.JSON)
-    return read_and_delete_json(filepath)
+def _verify_rule_sets(rule_sets: list, browser: HandshakeBrowser, now: datetime,
+                      session_factory: Callable[[], HandshakeSession],
+                      page_factory: Callable[[str, HandshakeBrowser], InsightsPage],
+                      download_dir: str = None, cache: InsightsCache = None,
+                      refresh: bool = False, incremental: IncrementalVerification = None,
+                      timer: StageTimer = None, counts_only: bool = False) -> List[VerificationResult]:
+    """
+    Verify each rule set as soon as its report has downloaded, returning the results in rule set
+    order. If ``counts_only`` is set, the results are ErrorCounts (see ``verify_rules``).
+    """
+    if timer is None:
+        timer = StageTimer()
+    date_time_parser = DateTimeParser()
+    rule_sets_by_report = {report.name: (start_date_time_field, rules)
+                           for report, start_date_time_field, rules in rule_sets}
+    results_by_report = {}
+    download_start = time.perf_counter()
+    for report, records in download_insights_reports([report for report, _, _ in rule_sets], browser,
+                                                     session_factory, download_dir=download_dir,
+                                                     page_factory=page_factory, cache=cache, refresh=refresh,
+                                                     timer=timer):
+        timer.record(f'download:{report.name}', time.perf_counter() - download_start)
+        with timer.stage(f'verify:{report.name}'):
+            start_date_time_field, rules = rule_sets_by_report[report.name]
+            dataset = prepare_record_stream(records, start_date_time_field, date_time_parser, now)
+            rule_timer = timer if timer.detailed else None
+            if incremental is not None:
+                results_by_report[report.name] = incremental.verify(rules, dataset, timer=rule_timer,
+                                                                    counts_only=counts_only)
+            else:
+                results_by_report[report.name] = verify_rules([(rule, dataset) for rule in rules], timer=rule_timer,
+                                                              counts_only=counts_only)
+        download_start = time.perf_counter()
+    return [result for report, _, _ in rule_sets for result in results_by_report[report.name]]
 
 
 def _write_summary_text_report(report: VerificationReport, filepath: str):
-    write_to_file(str(report), filepath)
+    try:
+        with open(filepath, 'w', encoding='utf-8', buffering=SUMMARY_BUFFER_BYTES) as file:
+            report.write(file)
+    except FileNotFoundError as e:
+        print(f'Unable to write results to file. {str(e)}')
 
 
-def _write_error_csvs(verification_results: List[VerificationResult], output_dir: str):
+def _write_error_csvs(verification_results: Iterable[VerificationResult], output_dir: str,
+                      timer: StageTimer = None, partitioned: bool = False):
+    if timer is None:
+        timer = StageTimer()
+    if partitioned:
+        with timer.stage('write:partitioned') as stage:
+            create_partitioned_error_files(verification_results, output_dir)
+            stage.add_rows(sum(len(result.errors) for result in verification_results))
+        return
     for result in verification_results:
         if not result.is_verified:
-            create_error_csv(result, output_dir)
+            with timer.stage(f'write:{result.rule_abbrev}') as stage:
+                create_error_csv(result, output_dir)
+                stage.add_rows(len(result.errors))
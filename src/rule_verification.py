@@ -1,57 +1,388 @@
-from typing import Callable, List
+import pickle
+from collections import Counter, deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from operator import itemgetter
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+from src.insights_fields import DerivedFields
+
+# the number of records check_records reads at a time
+RECORDS_PER_BLOCK = 1024
+
+
+class ErrorRecord(Mapping):
+    """
+    An error found by a rule, stored compactly.
+
+    An error record behaves like a read-only dict whose keys are given by ``keys_in_order``,
+    and compares equal to a dict with the same items. Subclasses store only the values their
+    fields are built from in ``__slots__``, and compute any other fields, like ``error_msg``,
+    only when they are read.
+
+    An error's ``group``, like the career center of an event, is what its errors are counted by
+    in summaries (see ``ErrorCounts``). It is not one of the record's keys.
+    """
+    __slots__ = ()
+    keys_in_order = ()
+    group = None
+
+    def __getitem__(self, key: str):
+        if key not in self.keys_in_order:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys_in_order)
+
+    def __len__(self):
+        return len(self.keys_in_order)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class DeferredMessageError(ErrorRecord):
+    """
+    An error record whose message is rendered from a template only when it is first read.
+
+    The record stores a message function, which acts as the template, and the structured
+    arguments to render it with. Errors are often only counted or written without their message,
+    so the text is rendered only when ``error_msg`` is read, and is cached on the record so that
+    later reads, like those of the report and the error CSV, share one copy of it.
+
+    Subclasses store the fields the message is built from, and return them from ``message_fields``.
+    """
+    __slots__ = ('_error_msg_func', '_error_msg_args', '_error_msg')
+
+    def __init__(self, error_msg_func: Callable[..., str], *error_msg_args):
+        """
+        :param error_msg_func: a function that builds the error message from the dict returned by
+                               ``message_fields``, followed by ``error_msg_args``
+        """
+        self._error_msg_func = error_msg_func
+        self._error_msg_args = error_msg_args
+        self._error_msg = None
+
+    def message_fields(self) -> dict:
+        """The fields of the original record that the message is built from"""
+        raise NotImplementedError
+
+    @property
+    def error_msg(self) -> str:
+        if self._error_msg is None:
+            self._error_msg = self._error_msg_func(self.message_fields(), *self._error_msg_args)
+        return self._error_msg
 
 
 class VerificationResult:
     """The result of a single rule verification"""
+    __slots__ = ('_rule', '_rule_abbrev', '_errors')
 
-    def __init__(self, rule: str, rule_abbrev: str, errors: List[dict] = None):
+    def __init__(self, rule: str, rule_abbrev: str, errors: List[Mapping] = None):
         if not errors:
             errors = []
-        self._data = {
-            'rule': rule,
-            'rule_abbrev': rule_abbrev,
-            'errors': errors
-        }
+        self._rule = rule
+        self._rule_abbrev = rule_abbrev
+        self._errors = errors
 
     def parse_errors(self, error_parser: callable) -> List[dict]:
-        return [error_parser(error) for error in self._data['errors']]
+        return [error_parser(error) for error in self._errors]
 
     @property
     def rule(self):
-        return self._data['rule']
+        return self._rule
 
     @property
     def rule_abbrev(self):
-        return self._data['rule_abbrev']
+        return self._rule_abbrev
 
     @property
     def is_verified(self):
-        return not self._data['errors']
+        return not self._errors
 
     @property
     def errors(self):
-        return self._data['errors']
+        return self._errors
+
+    @property
+    def error_count(self) -> int:
+        return len(self._errors)
+
+    def counts_by_group(self) -> Dict[Optional[str], int]:
+        """Count the errors by their group (see ``ErrorRecord``)"""
+        return dict(Counter(getattr(error, 'group', None) for error in self._errors))
 
     def add_error(self, error):
         if error is not None:
-            self._data['errors'].append(error)
+            self._errors.append(error)
+
+    def add_errors(self, errors: Iterable):
+        """Add several errors at once, none of which may be None"""
+        self._errors.extend(errors)
 
     def __eq__(self, other):
-        return self._data == other._data
+        if not isinstance(other, VerificationResult):
+            return NotImplemented
+        return (self._rule == other._rule and self._rule_abbrev == other._rule_abbrev and
+                self._errors == other._errors)
 
     def __str__(self):
-        return str(self._data)
+        return str({
+            'rule': self._rule,
+            'rule_abbrev': self._rule_abbrev,
+            'errors': self._errors
+        })
+
+
+class ErrorCounts:
+    """
+    The result of a rule verification that only counts the errors found, by their group.
+
+    Counting keeps memory proportional to the number of groups rather than the number of errors,
+    and error messages are never rendered. It has the same ``add_error`` as a VerificationResult,
+    so either can collect a rule's errors.
+    """
+    __slots__ = ('rule', 'rule_abbrev', '_counts')
+
+    def __init__(self, rule: str, rule_abbrev: str, counts: Dict[Optional[str], int] = None):
+        self.rule = rule
+        self.rule_abbrev = rule_abbrev
+        self._counts = Counter(counts)
+
+    @classmethod
+    def from_result(cls, result: VerificationResult) -> 'ErrorCounts':
+        return cls(result.rule, result.rule_abbrev, result.counts_by_group())
+
+    @property
+    def is_verified(self) -> bool:
+        return not self._counts
+
+    @property
+    def error_count(self) -> int:
+        return sum(self._counts.values())
+
+    def counts_by_group(self) -> Dict[Optional[str], int]:
+        return dict(self._counts)
+
+    def add_error(self, error):
+        if error is not None:
+            self._counts[getattr(error, 'group', None)] += 1
+
+    def add_errors(self, errors: Iterable):
+        """Count several errors at once, none of which may be None"""
+        self._counts.update(getattr(error, 'group', None) for error in errors)
+
+    def add_counts(self, counts: Dict[Optional[str], int]):
+        self._counts.update(counts)
+
+    def __eq__(self, other):
+        if not isinstance(other, ErrorCounts):
+            return NotImplemented
+        return (self.rule == other.rule and self.rule_abbrev == other.rule_abbrev and
+                self.counts_by_group() == other.counts_by_group())
+
+    def __repr__(self):
+        return repr({'rule': self.rule, 'rule_abbrev': self.rule_abbrev, 'counts': self.counts_by_group()})
+
+
+def _new_result(rule: 'Rule', counts_only: bool) -> Union[VerificationResult, ErrorCounts]:
+    if counts_only:
+        return ErrorCounts(rule.rule, rule.rule_abbrev)
+    return VerificationResult(rule=rule.rule, rule_abbrev=rule.rule_abbrev, errors=[])
+
+
+class Rule:
+    """
+    A rule that is verified by applying a single error function to every record in a dataset.
+
+    Calling a rule on a list of records verifies it against those records. Because the error
+    function is exposed, several rules that share a dataset can also be checked together in a
+    single pass over the records (see :func:`check_records`).
+
+    Rules may declare the raw fields their error function reads, and the start date time field
+    whose relation to the current time they depend on, so that their results can be reused
+    for records that have not changed (see :mod:`src.incremental_verification`).
+    """
+
+    def __init__(self, rule: str, rule_abbrev: str, error_func: Callable[[dict], Union[dict, None]],
+                 fields: Sequence[str] = None, time_field: str = None):
+        self.rule = rule
+        self.rule_abbrev = rule_abbrev
+        self.error_func = error_func
+        self.fields = tuple(fields) if fields is not None else None
+        self.time_field = time_field
+
+    def __call__(self, records: Iterable[dict]) -> VerificationResult:
+        return check_records([self], records)[0]
+
+
+def make_rule(rule: str, rule_abbrev: str, error_func: Callable[[dict], dict],
+              fields: Sequence[str] = None, time_field: str = None) -> Rule:
+    return Rule(rule, rule_abbrev, error_func, fields, time_field)
+
+
+def check_records(rules: List[Rule], records: Iterable[dict], timer=None,
+                  counts_only: bool = False) -> List[VerificationResult]:
+    """
+    Verify several rules against the same records in a single pass over those records.
+
+    The records are read a block at a time, and each rule is checked against the whole block
+    before the next block is read. This keeps the per-record overhead of checking several rules
+    below that of checking each rule in its own pass, while streamed records are still only read
+    once and never all held in memory.
+
+    :param rules: the rules to verify
+    :param records: the records to verify the rules against
+    :param timer: a StageTimer on which to record the time spent in each rule, as a ``rule:<abbrev>``
+                  stage. Timing adds a small cost to every check, so it is off unless a timer is given.
+    :param counts_only: whether to only count each rule's errors, returning ErrorCounts instead
+                        of VerificationResults
+    :return: a list of verification results, in the same order as the given rules
+    """
+    results = [_new_result(rule, counts_only) for rule in rules]
+    if timer is None:
+        checks = [(rule.error_func, result.add_errors) for rule, result in zip(rules, results)]
+    else:
+        rule_timers = [_RuleTimer(rule.error_func) for rule in rules]
+        checks = [(rule_timer, result.add_errors) for rule_timer, result in zip(rule_timers, results)]
+    for block in _chunk(iter(records), RECORDS_PER_BLOCK):
+        for error_func, add_errors in checks:
+            add_errors([error for error in map(error_func, block) if error is not None])
+    if timer is not None:
+        for rule, rule_timer in zip(rules, rule_timers):
+            timer.record(f'rule:{rule.rule_abbrev}', rule_timer.seconds, rows=rule_timer.calls)
+    return results
+
+
+class _RuleTimer:
+    """Wraps an error function to add up the time spent in it"""
+    __slots__ = ('error_func', 'seconds', 'calls')
+
+    def __init__(self, error_func: Callable[[dict], Union[dict, None]]):
+        self.error_func = error_func
+        self.seconds = 0.0
+        self.calls = 0
+
+    def __call__(self, record: dict):
+        start = perf_counter()
+        try:
+            return self.error_func(record)
+        finally:
+            self.seconds += perf_counter() - start
+            self.calls += 1
+
+
+def check_records_in_parallel(rules: List[Rule], records: Iterable[dict], processes: int,
+                              chunk_size: int, timer=None, counts_only: bool = False) -> List[VerificationResult]:
+    """
+    Verify several rules against the same records by sharding the records across a process pool.
+
+    The records are split into chunks of ``chunk_size`` records, and each worker checks every
+    rule against one chunk at a time. Each rule's errors are merged back in record order, so the
+    results are identical to those of :func:`check_records`. If every rule declares the fields
+    it reads, only those fields are sent to the workers.
+
+    The rules are checked serially instead if the records fit in a single chunk, if only one
+    process is requested, or if the rules cannot be pickled (for instance because their error
+    functions are closures).
+
+    :param rules: the rules to verify
+    :param records: the records to verify the rules against
+    :param processes: the number of worker processes to use
+    :param chunk_size: the number of records to send to a worker at a time
+    :param timer: a StageTimer on which to record the time spent in each rule. Rules checked in
+                  worker processes are not timed.
+    :param counts_only: whether to only count each rule's errors (see ``check_records``). Workers
+                        then send back counts instead of errors.
+    :return: a list of verification results, in the same order as the given rules
+    """
+    if processes <= 1 or not _can_pickle(rules):
+        return check_records(rules, records, timer, counts_only)
+    records = iter(records)
+    first_chunk = list(islice(records, chunk_size))
+    if len(first_chunk) < chunk_size:
+        return check_records(rules, first_chunk, timer, counts_only)
+    fields = _fields_read_by(rules)
+    results = [_new_result(rule, counts_only) for rule in rules]
+    with ProcessPoolExecutor(max_workers=processes, initializer=_set_worker_rules, initargs=(rules,)) as executor:
+        # only a few chunks per worker are in flight at once, so streamed records are never all in memory
+        pending = deque()
+        for chunk in chain([first_chunk], _chunk(records, chunk_size)):
+            pending.append(executor.submit(_check_chunk, _pack_chunk(chunk, fields), counts_only))
+            if len(pending) >= 2 * processes:
+                _merge_chunk_errors(results, pending.popleft().result())
+        while pending:
+            _merge_chunk_errors(results, pending.popleft().result())
+    return results
+
+
+_worker_rules = None
+
+
+def _set_worker_rules(rules: List[Rule]):
+    global _worker_rules
+    _worker_rules = rules
+
+
+def _check_chunk(packed_chunk: tuple, counts_only: bool = False) -> list:
+    fields, rows = packed_chunk
+    if fields is not None:
+        rows = [row if isinstance(row, dict) else dict(zip(fields, row)) for row in rows]
+    results = check_records(_worker_rules, rows, counts_only=counts_only)
+    if counts_only:
+        return [result.counts_by_group() for result in results]
+    return [result.errors for result in results]
+
+
+def _merge_chunk_errors(results: List[Union[VerificationResult, ErrorCounts]], chunk_errors: list):
+    for result, errors in zip(results, chunk_errors):
+        if isinstance(result, ErrorCounts):
+            result.add_counts(errors)
+        else:
+            result.errors.extend(errors)
+
+
+def _can_pickle(rules: List[Rule]) -> bool:
+    try:
+        pickle.dumps(rules)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
+
+def _fields_read_by(rules: List[Rule]) -> Union[tuple, None]:
+    """Get every field read by the rules, or None if any rule does not declare its fields"""
+    if any(rule.fields is None for rule in rules):
+        return None
+    fields = {field for rule in rules for field in rule.fields}
+    return tuple(fields) + (DerivedFields.START_DATE_TIME, DerivedFields.IS_PAST)
+
+
+def _chunk(records: Iterator[dict], chunk_size: int) -> Iterator[List[dict]]:
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
 
 
-def make_rule(rule: str, rule_abbrev: str, error_func: Callable[[dict], dict]) -> Callable[[List[dict]], VerificationResult]:
-    def rule_function(records: List[dict]) -> VerificationResult:
-        result = VerificationResult(
-            rule=rule,
-            rule_abbrev=rule_abbrev,
-            errors=[]
-        )
-        for record in records:
-            result.add_error(error_func(record))
-        return result
+def _pack_chunk(chunk: List[dict], fields: Union[tuple, None]) -> tuple:
+    """
+    Pack a chunk of records to send to a worker.
 
-    return rule_function
+    If fields are given, only those fields are sent, and records that have all of them are sent
+    as tuples of values, which are much cheaper to pickle than dicts.
+    """
+    if fields is None:
+        return None, chunk
+    get_values = itemgetter(*fields)
+    rows = []
+    for record in chunk:
+        try:
+            rows.append(get_values(record))
+        except KeyError:
+            rows.append({field: record[field] for field in fields if field in record})
+    return fields, rows
@@ -1,8 +1,14 @@
-from datetime import datetime
-from typing import Union, Callable
+from typing import Callable
 
 from src.insights_fields import AppointmentFields
-from src.rule_verification import make_rule
+from src.preprocessing import get_start_date_time
+from src.rule_dsl import field, is_past, make_declared_rule, when
+from src.rule_verification import DeferredMessageError
+
+INCOMPLETE_STATUSES = ['approved', 'requested', 'started']
+# the fields read when building an appointment's error data
+APPT_ERROR_FIELDS = [AppointmentFields.ID, AppointmentFields.START_DATE_TIME,
+                     AppointmentFields.STAFF_MEMBER_FIRST_NAME, AppointmentFields.STAFF_MEMBER_LAST_NAME]
 
 
 def _build_appt_status_error_message(appt: dict) -> str:
@@ -10,40 +16,40 @@ def _build_appt_status_error_message(appt: dict) -> str:
             f'{appt[AppointmentFields.START_DATE_TIME]}) status should be one of "completed", "cancelled", or "no-show"')
 
 
-def _get_appt_status_error(appt: dict) -> Union[dict, None]:
-    incomplete_statuses = ['approved', 'requested', 'started']
-    start_date_time = _parse_date_time(appt[AppointmentFields.START_DATE_TIME])
-    if appt[AppointmentFields.STATUS] in incomplete_statuses and start_date_time < datetime.now():
-        return _extract_error_data_from_appt(appt, _build_appt_status_error_message)
-    else:
-        return None
-
-
-def _parse_date_time(date_time_str: str) -> datetime:
-    return datetime.strptime(date_time_str, '%Y-%m-%d %H:%M:%S')
-
-
 def _build_appt_type_error_message(appt) -> str:
     return (f'Appointment {appt[AppointmentFields.ID]} ({_get_staff_name(appt)}, '
             f'{appt[AppointmentFields.START_DATE_TIME]}) does not have an appointment type')
 
 
-def _get_appt_type_missing_error(appt: dict) -> Union[dict, None]:
-    if not appt[AppointmentFields.TYPE]:
-        return _extract_error_data_from_appt(appt, _build_appt_type_error_message)
-    else:
-        return None
-
-
-def _extract_error_data_from_appt(appt: dict, error_msg_func: Callable[[dict], str]) -> dict:
-    return {
-        'id': appt[AppointmentFields.ID],
-        'start_date_time': _parse_date_time(appt[AppointmentFields.START_DATE_TIME]),
-        'staff_last_name': appt[AppointmentFields.STAFF_MEMBER_LAST_NAME],
-        'staff_first_name': appt[AppointmentFields.STAFF_MEMBER_FIRST_NAME],
-        'url': f'https://app.joinhandshake.com/appointments/{appt[AppointmentFields.ID]}',
-        'error_msg': error_msg_func(appt)
-    }
+class AppointmentError(DeferredMessageError):
+    """An appointment error whose url and message are only formatted when they are read"""
+    __slots__ = ('id', 'start_date_time', 'staff_last_name', 'staff_first_name', '_raw_start_date_time')
+    keys_in_order = ('id', 'start_date_time', 'staff_last_name', 'staff_first_name', 'url', 'error_msg')
+
+    def __init__(self, appt: dict, error_msg_func: Callable[[dict], str]):
+        super().__init__(error_msg_func)
+        self.id = appt[AppointmentFields.ID]
+        self.start_date_time = get_start_date_time(appt, AppointmentFields.START_DATE_TIME)
+        self.staff_last_name = appt[AppointmentFields.STAFF_MEMBER_LAST_NAME]
+        self.staff_first_name = appt[AppointmentFields.STAFF_MEMBER_FIRST_NAME]
+        self._raw_start_date_time = appt[AppointmentFields.START_DATE_TIME]
+
+    @property
+    def url(self) -> str:
+        return f'https://app.joinhandshake.com/appointments/{self.id}'
+
+    @property
+    def group(self) -> str:
+        """The appointment's staff member"""
+        return f'{(self.staff_first_name or "").strip()} {(self.staff_last_name or "").strip()}'.strip()
+
+    def message_fields(self) -> dict:
+        return {
+            AppointmentFields.ID: self.id,
+            AppointmentFields.START_DATE_TIME: self._raw_start_date_time,
+            AppointmentFields.STAFF_MEMBER_FIRST_NAME: self.staff_first_name,
+            AppointmentFields.STAFF_MEMBER_LAST_NAME: self.staff_last_name
+        }
 
 ##########################
 # HELPER/SUB-FUNCTIONS
@@ -58,14 +64,20 @@ def _get_staff_name(appt: dict) -> str:
 # RULES
 ######################
 
-past_appointments_have_finalized_status = make_rule(
+past_appointments_have_finalized_status = make_declared_rule(
     'No past appointments are marked as "approved", "requested", or "started"',
     'appt_wrong_status',
-    _get_appt_status_error
+    AppointmentError,
+    [when(field(AppointmentFields.STATUS).is_in(INCOMPLETE_STATUSES) & is_past(AppointmentFields.START_DATE_TIME),
+          _build_appt_status_error_message)],
+    fields=APPT_ERROR_FIELDS + [AppointmentFields.STATUS],
+    time_field=AppointmentFields.START_DATE_TIME
 )
 
-all_appointments_have_a_type = make_rule(
+all_appointments_have_a_type = make_declared_rule(
     'All appointments have an associated appointment type',
     'appt_missing_type',
-    _get_appt_type_missing_error
+    AppointmentError,
+    [when(field(AppointmentFields.TYPE).is_falsy(), _build_appt_type_error_message)],
+    fields=APPT_ERROR_FIELDS + [AppointmentFields.TYPE]
 )
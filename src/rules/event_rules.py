@@ -1,9 +1,10 @@
-from datetime import datetime
-from typing import List, Union
+from typing import Callable, List, Union
 
 from src.constants import CareerCenters
 from src.insights_fields import EventFields
-from src.rule_verification import make_rule
+from src.prefix_matcher import PrefixMatcher
+from src.rule_dsl import field, is_past, make_declared_rule, when
+from src.rule_verification import DeferredMessageError, make_rule
 from src.utils import create_or_list_from
 
 #############
@@ -13,6 +14,51 @@ from src.utils import create_or_list_from
 UNIVERSITY_WIDE_PREFIX = 'University-Wide:'
 CANCELLED_PREFIX = 'CANCELLED:'
 TEST_PREFIX = 'Test:'
+CAREER_CENTER_PREFIXES = {
+    CareerCenters.HOMEWOOD: ['Homewood:'],
+    CareerCenters.CAREY: ['Carey:'],
+    CareerCenters.SAIS: ['SAIS:', 'SAIS DC:', 'SAIS Europe:', 'HNC:', 'SAIS ALL:'],
+    CareerCenters.PDCO: ['PDCO:'],
+    CareerCenters.NURSING: ['Nursing:'],
+    CareerCenters.BSPH: ['BSPH:'],
+    CareerCenters.PEABODY: ['Peabody:'],
+    CareerCenters.AAP: ['AAP:']
+}
+
+
+def _add_cancelled_to_prefixes(prefixes: List[str]) -> List[str]:
+    return [f'{CANCELLED_PREFIX} {prefix}' for prefix in prefixes]
+
+
+# Matches each career center's prefixes, and their cancelled variants, in a single call
+EVENT_PREFIX_MATCHER = PrefixMatcher({
+    career_center: prefixes + _add_cancelled_to_prefixes(prefixes)
+    for career_center, prefixes in CAREER_CENTER_PREFIXES.items()
+})
+
+
+##########################
+# ERROR RECORDS
+##########################
+
+class EventError(DeferredMessageError):
+    """An event error whose message is only formatted when it is first read"""
+    __slots__ = ('id', '_name', 'group')
+    keys_in_order = ('id', 'error_msg')
+
+    def __init__(self, event: dict, error_msg_func: Callable[..., str], *error_msg_args):
+        """
+        :param event: the event that broke the rule
+        :param error_msg_func: a function that builds the error message from a dict of the event's
+                               id and name, followed by ``error_msg_args``
+        """
+        super().__init__(error_msg_func, *error_msg_args)
+        self.id = event[EventFields.ID]
+        self._name = event[EventFields.NAME]
+        self.group = event.get(EventFields.CAREER_CENTER)
+
+    def message_fields(self) -> dict:
+        return {EventFields.ID: self.id, EventFields.NAME: self._name}
 
 
 ##########################
@@ -24,63 +70,8 @@ def _build_event_prefix_error_message(event: dict, valid_prefixes: List[str]) ->
             f'prefix {create_or_list_from(valid_prefixes)}')
 
 
-def _get_event_prefix_error(event: dict) -> Union[dict, None]:
-    def _event_is_a_test_event(event_name: str) -> bool:
-        return event_name.startswith(TEST_PREFIX)
-
-    def _event_was_intended_to_be_cancelled(event_name: str) -> bool:
-        return (
-                event_name.startswith(CANCELLED_PREFIX) or
-                _event_has_malformed_cancelled_prefix(event_name)
-        )
-
-    def _event_has_malformed_cancelled_prefix(event_name: str) -> bool:
-        return (
-                not event_name.startswith(CANCELLED_PREFIX) and (
-                event_name.lower().startswith('cancelled') or
-                event_name.lower().startswith('canceled')
-        ))
-
-    def _add_cancelled_to_prefixes(prefixes: List[str]) -> List[str]:
-        return [f'{CANCELLED_PREFIX} {prefix}' for prefix in prefixes]
-
-    def _get_error_dict(event: dict) -> Union[dict, None]:
-        valid_prefixes = _determine_valid_prefixes_for_event(event)
-        if _event_has_valid_prefix(event, valid_prefixes):
-            return None
-        else:
-            return {
-                'id': event[EventFields.ID],
-                'error_msg': _build_event_prefix_error_message(event, valid_prefixes)
-            }
-
-    def _determine_valid_prefixes_for_event(event: dict) -> List[str]:
-        CAREER_CENTER_PREFIXES = {
-            CareerCenters.HOMEWOOD: ['Homewood:'],
-            CareerCenters.CAREY: ['Carey:'],
-            CareerCenters.SAIS: ['SAIS:', 'SAIS DC:', 'SAIS Europe:', 'HNC:', 'SAIS ALL:'],
-            CareerCenters.PDCO: ['PDCO:'],
-            CareerCenters.NURSING: ['Nursing:'],
-            CareerCenters.BSPH: ['BSPH:'],
-            CareerCenters.PEABODY: ['Peabody:'],
-            CareerCenters.AAP: ['AAP:']
-        }
-        valid_prefixes = CAREER_CENTER_PREFIXES[event[EventFields.CAREER_CENTER]]
-        if _event_was_intended_to_be_cancelled(event[EventFields.NAME]):
-            valid_prefixes = _add_cancelled_to_prefixes(valid_prefixes)
-        return valid_prefixes
-
-    def _event_has_valid_prefix(event: dict, valid_prefixes: List[str]) -> bool:
-        return any(event[EventFields.NAME].startswith(prefix) for prefix in valid_prefixes)
-
-    if not event[EventFields.CAREER_CENTER]:
-        return None
-    else:
-        cleaned_event_name = _strip_cancelled_prefix_from_event_name(event[EventFields.NAME])
-        if _event_is_university_wide(cleaned_event_name) or _event_is_a_test_event(cleaned_event_name):
-            return None
-        else:
-            return _get_error_dict(event)
+def _build_wrong_prefix_error_message(event: dict, career_center: str) -> str:
+    return _build_event_prefix_error_message(event, _determine_valid_prefixes(career_center, event[EventFields.NAME]))
 
 
 def _build_invite_only_error_message(event: dict, should_be_invite_only: bool) -> str:
@@ -91,101 +82,44 @@ def _build_invite_only_error_message(event: dict, should_be_invite_only: bool) -
     return (f'Event {event[EventFields.ID]} ({event[EventFields.NAME]}) {imperative} be invite-only')
 
 
-def _get_invite_error(event: dict) -> Union[dict, None]:
-
-    def _event_is_invite_only(event: dict) -> bool:
-        return event[EventFields.IS_INVITE_ONLY] == 'Yes'
+def _build_ad_error_message(event: dict, has_ad_label: bool, has_wrong_type: bool) -> str:
+    base_error_str = f'Event {event[EventFields.ID]} ({event[EventFields.NAME]}) should'
+    label_error_substr = 'be labeled "shared: advertisement"'
+    type_error_substr = 'have event type "Other"'
+    if (not has_ad_label) and has_wrong_type:
+        return f'{base_error_str} {label_error_substr} and {type_error_substr}'
+    elif has_wrong_type:
+        return f'{base_error_str} {type_error_substr}'
+    else:
+        return f'{base_error_str} {label_error_substr}'
 
-    def _get_error_dict(event: dict) -> Union[dict, None]:
-        cleaned_event_name = _strip_cancelled_prefix_from_event_name(event[EventFields.NAME])
-        if is_past_event(event):
-            return None
-        else:
-            if _event_is_university_wide(cleaned_event_name) and _event_is_invite_only(event):
-                return _build_invite_only_error_dict(event, should_be_invite_only=False)
-            elif not (_event_is_university_wide(cleaned_event_name) or _event_is_invite_only(event)):
-                return _build_invite_only_error_dict(event, should_be_invite_only=True)
-            else:
-                return None
 
-    def _build_invite_only_error_dict(event: dict, should_be_invite_only: bool) -> dict:
-        return {
-            'id': event[EventFields.ID],
-            'error_msg': _build_invite_only_error_message(event, should_be_invite_only)
-        }
+def _build_virtual_session_error_message(event: dict) -> str:
+    return f'Event {event[EventFields.ID]} ({event[EventFields.NAME]}) should not have the "Virtual Session" event type'
 
-    if not event[EventFields.CAREER_CENTER]:
-        return None
-    else:
-        return _get_error_dict(event)
-
-def _get_ad_error(event: dict) -> Union[dict, None]:
-    def _event_is_office_hours(event: dict) -> bool:
-        return 'office hours' in event[EventFields.NAME].lower()
-
-    def _event_is_homewood(event: dict) -> bool:
-        return event[EventFields.CAREER_CENTER] == 'Life Design Lab (Homewood)'
-
-    def _event_is_ad(event: dict) -> bool:
-        return _event_is_homewood(event) and _event_is_office_hours(event)
-
-    def _event_has_ad_label(event: dict) -> bool:
-        return 'shared: advertisement' in event[EventFields.LABELS_LIST]
-
-    def _event_has_wrong_type(event: dict) -> bool:
-        if event[EventFields.EVENT_TYPE] != 'Other':
-            return is_past_event(event) or event[EventFields.EVENT_TYPE] != 'Virtual Session'
-        else:
-            return False
-
-    def _build_ad_error_message(event: dict) -> str:
-        base_error_str = f'Event {event[EventFields.ID]} ({event[EventFields.NAME]}) should'
-        label_error_substr = 'be labeled "shared: advertisement"'
-        type_error_substr = 'have event type "Other"'
-        if (not _event_has_ad_label(event)) and _event_has_wrong_type(event):
-            return f'{base_error_str} {label_error_substr} and {type_error_substr}'
-        elif _event_has_wrong_type(event):
-            return f'{base_error_str} {type_error_substr}'
-        else:
-            return f'{base_error_str} {label_error_substr}'
-
-    def _build_error_dict(event: dict) -> dict:
-        return {
-            'id': event[EventFields.ID],
-            'error_msg': _build_ad_error_message(event)
-        }
-
-    if _event_is_ad(event) and (not _event_has_ad_label(event) or (_event_has_wrong_type(event))):
-        return _build_error_dict(event)
-    else:
-        return None
 
+###########################
+# GENERAL HELPER FUNCTIONS
+###########################
 
-def _get_virtual_session_error(event: dict) -> Union[dict, None]:
-    def is_virtual_session(event: dict) -> bool:
-        return event[EventFields.EVENT_TYPE] == 'Virtual Session'
+def _event_has_wrong_career_center_prefix(career_center: str, event_name: str) -> bool:
+    """Whether an event's name lacks its career center's prefix, or whether it was cancelled disagrees with it"""
+    matched_prefix = EVENT_PREFIX_MATCHER.match(career_center, event_name)
+    return (matched_prefix is None or
+            matched_prefix.startswith(CANCELLED_PREFIX) != _event_was_intended_to_be_cancelled(event_name))
 
-    def is_external_event(event: dict) -> bool:
-        return not event[EventFields.CAREER_CENTER]
 
-    def build_error_msg(event: dict) -> str:
-        return f'Event {event[EventFields.ID]} ({event[EventFields.NAME]}) should not have the "Virtual Session" event type'
+def _determine_valid_prefixes(career_center: str, event_name: str) -> List[str]:
+    valid_prefixes = CAREER_CENTER_PREFIXES[career_center]
+    if _event_was_intended_to_be_cancelled(event_name):
+        valid_prefixes = _add_cancelled_to_prefixes(valid_prefixes)
+    return valid_prefixes
 
-    if is_past_event(event) and is_virtual_session(event) and not is_external_event(event):
-        return {
-            'id': event[EventFields.ID],
-            'error_msg': build_error_msg(event)
-        }
-    else:
-        return None
 
+def _event_was_intended_to_be_cancelled(event_name: str) -> bool:
+    """Whether an event name starts with "CANCELLED:" or a malformed variant of it, like "Canceled -" """
+    return event_name.lower().startswith(('cancelled', 'canceled'))
 
-def is_past_event(event: dict) -> bool:
-    return datetime.strptime(event[EventFields.START_DATE_TIME], '%Y-%m-%d %H:%M:%S') < datetime.now()
-
-###########################
-# GENERAL HELPER FUNCTIONS
-###########################
 
 def _strip_cancelled_prefix_from_event_name(event_name: str) -> str:
     if event_name.startswith(CANCELLED_PREFIX):
@@ -193,9 +127,36 @@ def _strip_cancelled_prefix_from_event_name(event_name: str) -> str:
     else:
         return event_name
 
+############################
+# CONDITIONS
+############################
+
+_has_career_center = field(EventFields.CAREER_CENTER).is_truthy()
+_is_past = is_past(EventFields.START_DATE_TIME)
+_cleaned_event_name = field(EventFields.NAME).apply(_strip_cancelled_prefix_from_event_name)
+_is_university_wide = _cleaned_event_name.startswith(UNIVERSITY_WIDE_PREFIX)
+_is_invite_only = field(EventFields.IS_INVITE_ONLY).eq('Yes')
+_is_virtual_session = field(EventFields.EVENT_TYPE).eq('Virtual Session')
+_is_advertisement = (field(EventFields.CAREER_CENTER).eq('Life Design Lab (Homewood)') &
+                    field(EventFields.NAME).lower().contains('office hours'))
+_has_ad_label = field(EventFields.LABELS_LIST).contains('shared: advertisement')
+_has_wrong_ad_type = field(EventFields.EVENT_TYPE).ne('Other') & (_is_past | ~_is_virtual_session)
 
-def _event_is_university_wide(event_name: str) -> bool:
-    return event_name.startswith(UNIVERSITY_WIDE_PREFIX)
+
+############################
+# ERROR FUNCTIONS
+############################
+
+def _get_event_prefix_error(event: dict) -> Union[EventError, None]:
+    career_center = event[EventFields.CAREER_CENTER]
+    if not career_center:
+        return None
+    event_name = event[EventFields.NAME]
+    if _strip_cancelled_prefix_from_event_name(event_name).startswith((UNIVERSITY_WIDE_PREFIX, TEST_PREFIX)):
+        return None
+    if _event_has_wrong_career_center_prefix(career_center, event_name):
+        return EventError(event, _build_wrong_prefix_error_message, career_center)
+    return None
 
 
 ############################
@@ -205,23 +166,41 @@ def _event_is_university_wide(event_name: str) -> bool:
 jhu_owned_events_are_prefixed_correctly = make_rule(
     'Events are prefixed correctly if they are owned by a career center',
     'event_wrong_prefix',
-    _get_event_prefix_error
+    _get_event_prefix_error,
+    fields=[EventFields.ID, EventFields.NAME, EventFields.CAREER_CENTER]
 )
 
-events_are_invite_only_iff_not_university_wide = make_rule(
+events_are_invite_only_iff_not_university_wide = make_declared_rule(
     'Events are invite-only if and only if they are not University-Wide or external',
     'event_invite_only',
-    _get_invite_error
+    EventError,
+    [when(_has_career_center & ~_is_past & _is_university_wide & _is_invite_only,
+          _build_invite_only_error_message, False),
+     when(_has_career_center & ~_is_past & ~_is_university_wide & ~_is_invite_only,
+          _build_invite_only_error_message, True)],
+    fields=[EventFields.ID, EventFields.NAME, EventFields.CAREER_CENTER, EventFields.IS_INVITE_ONLY,
+            EventFields.START_DATE_TIME],
+    time_field=EventFields.START_DATE_TIME
 )
 
-advertisement_events_are_labeled = make_rule(
+advertisement_events_are_labeled = make_declared_rule(
     '"Advertisement" events are labeled properly and have event type "Other"',
     'event_advertisements',
-    _get_ad_error
+    EventError,
+    [when(_is_advertisement & ~_has_ad_label & _has_wrong_ad_type, _build_ad_error_message, False, True),
+     when(_is_advertisement & ~_has_ad_label, _build_ad_error_message, False, False),
+     when(_is_advertisement & _has_wrong_ad_type, _build_ad_error_message, True, True)],
+    fields=[EventFields.ID, EventFields.NAME, EventFields.CAREER_CENTER, EventFields.LABELS_LIST,
+            EventFields.EVENT_TYPE, EventFields.START_DATE_TIME],
+    time_field=EventFields.START_DATE_TIME
 )
 
-past_events_do_not_have_virtual_event_type = make_rule(
+past_events_do_not_have_virtual_event_type = make_declared_rule(
     'Non-external past events do not have the "Virtual Session" event type',
     'past_event_virtual_session',
-    _get_virtual_session_error
+    EventError,
+    [when(_is_past & _is_virtual_session & _has_career_center, _build_virtual_session_error_message)],
+    fields=[EventFields.ID, EventFields.NAME, EventFields.CAREER_CENTER, EventFields.EVENT_TYPE,
+            EventFields.START_DATE_TIME],
+    time_field=EventFields.START_DATE_TIME
 )
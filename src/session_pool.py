@@ -0,0 +1,319 @@
+import threading
+import time
+from queue import Queue, Empty
+from typing import Callable, List
+
+from autohandshake import HandshakeBrowser, HandshakeSession
+
+from src.utils import config
+
+LOGGED_IN_USER_XPATH = '//meta[@name="logged_in_user_id"]'
+
+
+class NoSessionAvailable(Exception):
+    """Raised when a browser is requested without waiting while every session in the pool is in use"""
+
+
+def browser_is_logged_in(browser: HandshakeBrowser) -> bool:
+    """
+    Determine whether a browser is still logged into Handshake
+
+    :param browser: the browser to check
+    :return: True if the browser can load the Handshake homepage as a logged-in user, False
+             if its login has expired or the browser itself has stopped responding
+    """
+    try:
+        browser.get(config['handshake_url'])
+        return browser.element_exists_by_xpath(LOGGED_IN_USER_XPATH)
+    except Exception:
+        return False
+
+
+class _PoolEntry:
+    __slots__ = ('session', 'browser', 'last_used', 'needs_check')
+
+    def __init__(self, session: HandshakeSession, browser: HandshakeBrowser, last_used: float):
+        self.session = session
+        self.browser = browser
+        self.last_used = last_used
+        self.needs_check = False
+
+
+class SessionPool:
+    """
+    A set of logged-in Handshake sessions that are kept open and handed out to actions.
+
+    Sessions are opened from the session factory as they are needed, up to ``max_sessions``, and
+    are kept open between uses so that later actions don't pay for starting a browser and logging
+    in again. A session that has been idle for a while, or whose last user ran into an error, is
+    health-checked before it is handed out, and is replaced with a freshly logged-in session only
+    if the check fails.
+
+    ``pool.session()`` can be used anywhere a session factory is expected: it returns an object
+    that, like a HandshakeSession, gives a browser when entered and is closed afterwards, except
+    that closing it returns the browser to the pool instead of quitting it.
+    """
+
+    def __init__(self, session_factory: Callable[[], HandshakeSession], max_sessions: int = None,
+                 health_check: Callable[[HandshakeBrowser], bool] = browser_is_logged_in,
+                 check_after_seconds: float = None, clock: Callable[[], float] = time.monotonic):
+        """
+        :param session_factory: a function that creates a new, not-yet-opened HandshakeSession
+        :param max_sessions: the maximum number of sessions to keep open. Defaults to the
+                             ``session_pool_size`` config value.
+        :param health_check: a function that determines whether a browser is still usable
+        :param check_after_seconds: how long a session can be idle before it is health-checked
+                                    again. Defaults to the ``session_health_check_seconds`` config value.
+        :param clock: a function returning the current time in seconds
+        """
+        self._session_factory = session_factory
+        self.max_sessions = max(1, max_sessions if max_sessions is not None else config['session_pool_size'])
+        self._health_check = health_check
+        self._check_after_seconds = (check_after_seconds if check_after_seconds is not None
+                                     else config['session_health_check_seconds'])
+        self._clock = clock
+        self._idle: List[_PoolEntry] = []
+        self._in_use = {}
+        self._session_count = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self.login_count = 0
+
+    def acquire(self, block: bool = True) -> HandshakeBrowser:
+        """
+        Take a logged-in browser from the pool, logging in a new session if needed
+
+        :param block: whether to wait for a browser to be released if every session is in use.
+                      If False, a NoSessionAvailable error is raised instead.
+        :return: a logged-in browser, which must be given back with ``release``
+        """
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError('The session pool is closed')
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._session_count < self.max_sessions:
+                    self._session_count += 1
+                    entry = None
+                    break
+                if not block:
+                    raise NoSessionAvailable(f'All {self.max_sessions} sessions are in use')
+                self._condition.wait()
+        try:
+            if entry is None:
+                entry = self._open()
+            elif self._should_check(entry) and not self._health_check(entry.browser):
+                _close_quietly(entry.session)
+                entry = self._open()
+        except Exception:
+            with self._condition:
+                self._session_count -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._in_use[id(entry.browser)] = entry
+        return entry.browser
+
+    def release(self, browser: HandshakeBrowser, check: bool = False):
+        """
+        Give a browser back to the pool
+
+        :param browser: a browser taken from the pool
+        :param check: whether to health-check the browser before it is next used, e.g. because
+                      an error was raised while using it
+        """
+        with self._condition:
+            entry = self._in_use.pop(id(browser))
+            entry.last_used = self._clock()
+            entry.needs_check = check
+            closed = self._closed
+            if closed:
+                self._session_count -= 1
+            else:
+                self._idle.append(entry)
+                self._condition.notify()
+        if closed:
+            _close_quietly(entry.session)
+
+    def session(self, block: bool = True) -> '_PooledSession':
+        """
+        Create a session-like object that borrows a browser from the pool
+
+        :param block: whether entering the session waits for a browser if every session is in use
+        :return: an object that gives a logged-in browser when entered and returns it when closed
+        """
+        return _PooledSession(self, block)
+
+    def warm(self, session_count: int = 1):
+        """
+        Log in sessions ahead of time so that they are ready when they are first needed
+
+        :param session_count: the number of sessions the pool should have open, at most ``max_sessions``
+        """
+        browsers = []
+        try:
+            for _ in range(min(session_count, self.max_sessions)):
+                browsers.append(self.acquire(block=False))
+        except NoSessionAvailable:
+            pass
+        finally:
+            for browser in browsers:
+                self.release(browser)
+
+    def close(self):
+        """Close every idle session. Sessions in use are closed as soon as they are released."""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._session_count -= len(idle)
+            self._condition.notify_all()
+        for entry in idle:
+            _close_quietly(entry.session)
+
+    def __enter__(self) -> 'SessionPool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _open(self) -> _PoolEntry:
+        session = self._session_factory()
+        try:
+            browser = session.__enter__()
+        except Exception:
+            _close_quietly(session)
+            raise
+        with self._condition:
+            self.login_count += 1
+        return _PoolEntry(session, browser, self._clock())
+
+    def _should_check(self, entry: _PoolEntry) -> bool:
+        return entry.needs_check or self._clock() - entry.last_used >= self._check_after_seconds
+
+
+class _PooledSession:
+    """A stand-in for a HandshakeSession that borrows its browser from a SessionPool"""
+
+    def __init__(self, pool: SessionPool, block: bool):
+        self._pool = pool
+        self._block = block
+        self._browser = None
+
+    def __enter__(self) -> HandshakeBrowser:
+        self._browser = self._pool.acquire(self._block)
+        return self._browser
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._release(check=exc_type is not None)
+
+    def close(self):
+        self._release(check=False)
+
+    def _release(self, check: bool):
+        browser, self._browser = self._browser, None
+        if browser is not None:
+            self._pool.release(browser, check)
+
+
+class BrowserPool:
+    """
+    A set of logged-in browsers that worker threads take turns using.
+
+    The pool starts with the given browser and opens up to ``max_browsers - 1`` additional
+    sessions from the session factory as they are needed. Only the sessions opened by the pool
+    are closed by it. If the session factory borrows from a shared SessionPool that has no
+    session to spare, the worker waits for one of the browsers it already has instead.
+
+    Like a SessionPool, a browser whose user ran into an error can be health-checked when it is
+    released, and is then replaced with a new session if the check fails.
+    """
+
+    def __init__(self, browser: HandshakeBrowser, session_factory: Callable[[], HandshakeSession],
+                 max_browsers: int, health_check: Callable[[HandshakeBrowser], bool] = browser_is_logged_in):
+        """
+        :param browser: a logged-in browser, which the pool uses but never closes
+        :param session_factory: a function that creates a new, not-yet-opened HandshakeSession, or
+                                None to only use the given browser
+        :param max_browsers: the maximum number of browsers to use at once
+        :param health_check: a function that determines whether a browser is still usable
+        """
+        self._idle = Queue()
+        self._idle.put(browser)
+        self._session_factory = session_factory
+        self._max_browsers = max_browsers if session_factory is not None else 1
+        self._health_check = health_check
+        self._browser_count = 1
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def acquire(self) -> HandshakeBrowser:
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+        with self._lock:
+            can_open_session = self._browser_count < self._max_browsers
+            if can_open_session:
+                self._browser_count += 1
+        if not can_open_session:
+            return self._idle.get()
+        try:
+            return self._open()
+        except NoSessionAvailable:
+            with self._lock:
+                self._browser_count -= 1
+                self._max_browsers = self._browser_count
+            return self._idle.get()
+        except Exception:
+            with self._lock:
+                self._browser_count -= 1
+            raise
+
+    def release(self, browser: HandshakeBrowser, check: bool = False):
+        """
+        Give a browser back to the pool
+
+        :param browser: a browser taken from the pool
+        :param check: whether to health-check the browser first, e.g. because an error was raised
+                      while using it. A browser that fails the check is replaced with a new session,
+                      unless no new session can be opened, and a session the pool opened for it is closed.
+        """
+        if check and self._session_factory is not None and not self._health_check(browser):
+            try:
+                replacement = self._open()
+            except Exception:
+                pass
+            else:
+                with self._lock:
+                    session = self._sessions.pop(id(browser), None)
+                if session is not None:
+                    _close_quietly(session)
+                browser = replacement
+        self._idle.put(browser)
+
+    def close(self):
+        """Close every session opened by the pool, even if closing one of them fails"""
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            _close_quietly(session)
+
+    def _open(self) -> HandshakeBrowser:
+        session = self._session_factory()
+        try:
+            browser = session.__enter__()
+        except Exception:
+            _close_quietly(session)
+            raise
+        with self._lock:
+            self._sessions[id(browser)] = session
+        return browser
+
+
+def _close_quietly(session: HandshakeSession):
+    try:
+        session.close()
+    except Exception:
+        pass
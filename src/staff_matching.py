@@ -0,0 +1,108 @@
+import unicodedata
+from collections import Counter
+from typing import Iterable, Iterator, List
+
+FIRST_NAME_FIELD = 'Career Service Staffs First Name'
+LAST_NAME_FIELD = 'Career Service Staffs Last Name'
+
+MATCHED = 'matched'
+AMBIGUOUS = 'ambiguous'
+UNMATCHED = 'unmatched'
+MATCH_REPORT_FIELDS = ['name', 'status', 'staff_page_count', 'insights_row_count']
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalize a name so that names differing only in case, whitespace or Unicode form compare equal
+
+    :param name: the name to normalize
+    :return: the name in Unicode NFKC form, case-folded, with runs of whitespace collapsed into single spaces
+    """
+    return ' '.join(unicodedata.normalize('NFKC', name).casefold().split())
+
+
+class StaffNameIndex:
+    """
+    An index of staff names, keyed by their normalized form, against which Insights staff rows are matched.
+
+    A row matches if the normalized form of its first and last name is that of a staff name. If
+    several staff names share a normalized form, e.g. two staff members with the same name, the
+    row still belongs to a staff member but it is ambiguous which one. The number of rows that
+    matched, were ambiguous or matched nobody is counted as rows are matched.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        """
+        :param names: the staff names, as listed on the Handshake staff page
+        """
+        self._staff_names = {}
+        self._staff_counts = Counter()
+        for name in names:
+            key = normalize_name(name)
+            self._staff_names.setdefault(key, name)
+            self._staff_counts[key] += 1
+        # each distinct spelling of a name in the Insights rows, with its normalized form and match status
+        self._raw_names = {}
+        self._raw_name_counts = Counter()
+
+    @property
+    def counts(self) -> Counter:
+        """The number of rows matched so far with each status"""
+        counts = Counter({MATCHED: 0, AMBIGUOUS: 0, UNMATCHED: 0})
+        for raw_name, row_count in self._raw_name_counts.items():
+            counts[self._raw_names[raw_name][1]] += row_count
+        return counts
+
+    def match(self, insights_row: dict) -> str:
+        """
+        Match an Insights staff row against the staff names, counting the result
+
+        :param insights_row: a row of the Insights staff report
+        :return: ``MATCHED``, ``AMBIGUOUS`` or ``UNMATCHED``
+        """
+        raw_name = (insights_row[FIRST_NAME_FIELD], insights_row[LAST_NAME_FIELD])
+        self._raw_name_counts[raw_name] += 1
+        # the same staff member usually has many rows, so each distinct spelling is only normalized once
+        known = self._raw_names.get(raw_name)
+        if known is None:
+            known = self._add_raw_name(raw_name)
+        return known[1]
+
+    def matching_rows(self, insights_data: Iterable[dict]) -> Iterator[dict]:
+        """Lazily yield the Insights staff rows that belong to a staff member, including ambiguous ones"""
+        return (row for row in insights_data if self.match(row) != UNMATCHED)
+
+    def report_rows(self) -> List[dict]:
+        """
+        Describe how each distinct name was matched by the rows matched so far
+
+        :return: a row for each staff name and each Insights name that matched no staff name, with
+                 the number of times the name appears on the staff page and in the Insights rows
+        """
+        row_counts = Counter()
+        row_names = {}
+        for raw_name, row_count in self._raw_name_counts.items():
+            key = self._raw_names[raw_name][0]
+            row_counts[key] += row_count
+            row_names.setdefault(key, ' '.join(f'{raw_name[0]} {raw_name[1]}'.split()))
+        rows = []
+        for key, name in self._staff_names.items():
+            staff_count = self._staff_counts[key]
+            row_count = row_counts.get(key, 0)
+            status = UNMATCHED if row_count == 0 else MATCHED if staff_count == 1 else AMBIGUOUS
+            rows.append(_report_row(name, status, staff_count, row_count))
+        for key, name in row_names.items():
+            if key not in self._staff_counts:
+                rows.append(_report_row(name, UNMATCHED, 0, row_counts[key]))
+        return rows
+
+    def _add_raw_name(self, raw_name: tuple) -> tuple:
+        key = normalize_name(f'{raw_name[0]} {raw_name[1]}')
+        staff_count = self._staff_counts.get(key, 0)
+        status = UNMATCHED if staff_count == 0 else MATCHED if staff_count == 1 else AMBIGUOUS
+        self._raw_names[raw_name] = (key, status)
+        return key, status
+
+
+def _report_row(name: str, status: str, staff_count: int, row_count: int) -> dict:
+    return {'name': name, 'status': status, 'staff_page_count': staff_count, 'insights_row_count': row_count}
@@ -0,0 +1,195 @@
+import cProfile
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List
+
+from src.utils import config
+
+# tracemalloc's peak is shared by the whole process, so the stages it is measured for are too
+_open_memory_stages = []
+_memory_lock = threading.Lock()
+
+
+class Stage:
+    """A stage that is being timed, to which the rows it processes can be added"""
+    __slots__ = ('name', 'rows', 'peak_memory')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rows = None
+        self.peak_memory = 0
+
+    def add_rows(self, row_count: int):
+        self.rows = row_count if self.rows is None else self.rows + row_count
+
+
+class StageTimer:
+    """
+    Records how long each stage of a run takes.
+
+    Each finished stage is recorded as a dict with the stage's name, its wall time and CPU time in
+    seconds, the number of rows it processed (or None if it doesn't process rows), and whether
+    it completed without raising an error. CPU time is that of the thread that ran the stage.
+
+    Stages that time every row, like each rule's checks or the parsing of each record, add a small
+    cost to every row, so callers only record them if ``detailed`` is set.
+
+    If memory tracing is on, each stage also records the peak memory allocated by Python while it
+    ran, in bytes. The peak is measured with ``tracemalloc``, which slows the whole process
+    down, so tracing is off by default.
+
+    Stages can be nested, and can run at the same time on different threads.
+    """
+
+    def __init__(self, on_stage: Callable[[dict], None] = None, trace_memory: bool = None,
+                 detailed: bool = None):
+        """
+        :param on_stage: a function called with each stage's record as soon as the stage ends
+        :param trace_memory: whether to record each stage's peak memory. Defaults to the
+                             ``timing_trace_memory`` config value.
+        :param detailed: whether to record stages that time every row. Defaults to the
+                         ``timing_detailed`` config value.
+        """
+        self.stages: List[dict] = []
+        self._on_stage = on_stage
+        self._parent = None
+        self.trace_memory = trace_memory if trace_memory is not None else config['timing_trace_memory']
+        self.detailed = detailed if detailed is not None else config['timing_detailed']
+        self._started_tracing = False
+
+    def child(self) -> 'StageTimer':
+        """
+        Create a timer for part of a run, whose stages are also recorded by this timer
+
+        :return: a timer that only has the stages recorded on it, not those of the rest of the run
+        """
+        child = StageTimer(trace_memory=self.trace_memory, detailed=self.detailed)
+        child._parent = self
+        return child
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Stage]:
+        """Time the body of a ``with`` block as a stage with the given name"""
+        stage = Stage(name)
+        self._start_memory_tracing(stage)
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        ok = False
+        try:
+            yield stage
+            ok = True
+        finally:
+            cpu_seconds = time.thread_time() - cpu_start
+            seconds = time.perf_counter() - start
+            self._stop_memory_tracing(stage)
+            self.record(name, seconds, ok, cpu_seconds, stage.rows,
+                        stage.peak_memory if self.trace_memory else None)
+
+    def timed_iter(self, name: str, iterable: Iterable) -> Iterator:
+        """
+        Time how long it takes to produce each item of an iterable, as a stage with the given name.
+
+        Only the time spent producing the items is recorded, not the time spent by the consumer
+        between items, so this can measure one step of a streaming pipeline, like parsing a file
+        whose records are verified as they are read. The stage is recorded once the iterable is
+        exhausted, with the number of items produced as its row count.
+
+        :param name: the name of the stage
+        :param iterable: the iterable to time
+        :return: an iterator over the iterable's items
+        """
+        iterator = iter(iterable)
+        seconds = cpu_seconds = 0.0
+        rows = 0
+        ok = False
+        try:
+            while True:
+                start = time.perf_counter()
+                cpu_start = time.thread_time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    ok = True
+                    return
+                finally:
+                    cpu_seconds += time.thread_time() - cpu_start
+                    seconds += time.perf_counter() - start
+                rows += 1
+                yield item
+        finally:
+            self.record(name, seconds, ok, cpu_seconds, rows)
+
+    def record(self, name: str, seconds: float, ok: bool = True, cpu_seconds: float = None, rows: int = None,
+               peak_memory: int = None):
+        """Record a stage that was timed elsewhere"""
+        stage = {'stage': name, 'seconds': round(seconds, 6),
+                 'cpu_seconds': round(cpu_seconds, 6) if cpu_seconds is not None else None,
+                 'rows': rows, 'ok': ok}
+        if peak_memory is not None:
+            stage['peak_memory_bytes'] = peak_memory
+        self._add(stage)
+
+    @contextmanager
+    def profile(self) -> Iterator[cProfile.Profile]:
+        """
+        Profile the body of a ``with`` block with cProfile.
+
+        Only code run on the calling thread is profiled. Call ``dump_stats`` on the returned
+        profile to save its statistics for ``pstats`` or another viewer.
+        """
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+
+    def write_report(self, filepath: str):
+        """
+        Write every recorded stage to a json file
+
+        :param filepath: the filepath of the timing report to create
+        """
+        with open(filepath, 'w', encoding='utf-8') as report_file:
+            json.dump({'stages': self.stages}, report_file, indent=2)
+
+    def close(self):
+        """Stop tracing memory, if this timer started it"""
+        if self._started_tracing:
+            self._started_tracing = False
+            tracemalloc.stop()
+
+    def _add(self, stage: dict):
+        self.stages.append(stage)
+        if self._on_stage is not None:
+            self._on_stage(stage)
+        if self._parent is not None:
+            self._parent._add(stage)
+
+    def _start_memory_tracing(self, stage: Stage):
+        if not self.trace_memory:
+            return
+        with _memory_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            # the peak is about to be reset, so every enclosing or concurrent stage keeps the peak so far
+            _fold_peak_into_open_stages()
+            tracemalloc.reset_peak()
+            _open_memory_stages.append(stage)
+
+    def _stop_memory_tracing(self, stage: Stage):
+        if not self.trace_memory:
+            return
+        with _memory_lock:
+            _fold_peak_into_open_stages()
+            _open_memory_stages.remove(stage)
+
+
+def _fold_peak_into_open_stages():
+    _, peak = tracemalloc.get_traced_memory()
+    for open_stage in _open_memory_stages:
+        open_stage.peak_memory = max(open_stage.peak_memory, peak)
@@ -1,9 +1,10 @@
 import json
 import os
+import re
 from csv import DictWriter
 from datetime import datetime
 from getpass import getuser
-from typing import List
+from typing import Iterable, Iterator, List
 
 from autohandshake import HandshakeSession
 
@@ -23,11 +24,41 @@ def load_config():
         "handshake_email": f"{username}@jhu.edu",
         "download_dir": f"C:\\Users\\{username}\\Downloads"
         , "chromedriver_path": "./src/chromedriver.exe"
+        , "insights_download_workers": 2
+        , "session_pool_size": 2
+        , "session_health_check_seconds": 5 * 60
+        , "download_job_workers": 3
+        , "download_job_retries": 2
+        , "download_job_retry_delay_seconds": 10
+        , "insights_cache_dir": f"{CONFIG_DIR}\\insights_cache"
+        , "insights_cache_ttl_seconds": 4 * 60 * 60
+        , "insights_cache_max_bytes": 1024 ** 3
+        , "verification_uses_insights_cache": False
+        , "incremental_verification": False
+        , "verification_state_path": f"{CONFIG_DIR}\\verification_state.pkl.gz"
+        , "verification_processes": 1
+        , "verification_chunk_size": 50000
+        , "job_file_processes": 1
+        , "job_file_chunk_bytes": 64 * 1024 ** 2
+        , "output_format": "csv"
+        , "partition_error_files": False
+        , "error_file_write_workers": 4
+        , "output_dir": None
+        , "timing_trace_memory": False
+        , "timing_profile": False
+        , "timing_detailed": False
     }
 
 
 config = load_config()
 
+CSV_ROWS_PER_WRITE = 1000
+CSV_BUFFER_BYTES = 1 << 20
+JSON_CHUNK_CHARS = 1 << 20
+
+_JSON_WHITESPACE = ' \t\r\n'
+_skip_whitespace = re.compile(r'[ \t\r\n]*').match
+
 
 class BrowsingSession(HandshakeSession):
     """
@@ -40,24 +71,58 @@ class BrowsingSession(HandshakeSession):
                          max_wait_time=max_wait_time, chromedriver_path=config['chromedriver_path'])
 
 
-def to_csv(list_of_dicts: List[dict], file_path: str):
+def to_csv(rows: Iterable[dict], file_path: str, fieldnames: List[str] = None,
+           rows_per_write: int = CSV_ROWS_PER_WRITE) -> int:
     """
-    Write the given list of dicts to a csv at the given file path.
+    Write the given dicts to a csv at the given file path.
 
     The dictionaries should have a uniform structure, i.e. they should be parsable
     into the rows of the csv, with the keys equivalent to column names.
 
-    :param list_of_dicts: the list to write to a file
-    :type list_of_dicts: list
+    Rows are consumed lazily and written in batches, so a generator of rows is never held
+    in memory all at once.
+
+    :param rows: an iterable of the dicts to write to the file
     :param file_path: the file path at which to create the file
-    :type file_path: str
+    :param fieldnames: the column names. Defaults to the keys of the first row. If there are no
+                       rows and no field names, an empty file is created.
+    :param rows_per_write: the number of rows to buffer before writing them to the file
+    :return: the number of rows written
     """
-
-    keys = list_of_dicts[0].keys()
-    with open(file_path, 'w', encoding='utf-8') as output_file:
-        dict_writer = DictWriter(output_file, keys, lineterminator='\n')
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if fieldnames is None:
+        fieldnames = [] if first_row is None else list(first_row.keys())
+    row_count = 0
+    with open(file_path, 'w', encoding='utf-8', buffering=CSV_BUFFER_BYTES) as output_file:
+        if not fieldnames:
+            return row_count
+        dict_writer = DictWriter(output_file, fieldnames, lineterminator='\n')
         dict_writer.writeheader()
-        dict_writer.writerows(list_of_dicts)
+        if first_row is None:
+            return row_count
+        batch = [first_row]
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= rows_per_write:
+                dict_writer.writerows(batch)
+                row_count += len(batch)
+                batch = []
+        dict_writer.writerows(batch)
+        row_count += len(batch)
+    return row_count
+
+
+def create_filepath_in_output_dir(filename: str) -> str:
+    """
+    Given a filename, append it to the output dir to create a full file path.
+
+    The output dir is the ``output_dir`` config value, or the download dir if that is not set.
+
+    :param filename: the filename to concatenate with the output dir
+    :return: the full filepath
+    """
+    return os.path.join(config['output_dir'] or config['download_dir'], filename)
 
 
 def create_filepath_in_download_dir(filename: str) -> str:
@@ -114,6 +179,117 @@ def read_and_delete_json(filepath: str) -> List[dict]:
     return data
 
 
+def stream_and_delete_json(filepath: str) -> Iterator[dict]:
+    """
+    Lazily read the records of the given json file, deleting the file once every record has been read.
+
+    The file is only deleted after the stream is fully consumed, so abandoning the stream part of
+    the way through leaves the file in place.
+
+    :param filepath: the filepath of the json file to read. The file should contain a json array.
+    :return: an iterator over the records of the json array
+    """
+    yield from iter_json_array(filepath)
+    os.remove(filepath)
+
+
+def iter_json_array(filepath: str, chunk_size: int = JSON_CHUNK_CHARS) -> Iterator[dict]:
+    """
+    Incrementally parse a file containing a json array, yielding each element as soon as it is parsed.
+
+    Only a window of the file is held in memory at a time, rather than the whole document and
+    its fully parsed contents. Every complete element in the window is decoded in one go before
+    the next part of the file is read, which keeps the cost per element close to that of
+    ``json.load``.
+
+    :param filepath: the filepath of the json file to read
+    :param chunk_size: the number of characters to read from the file at a time
+    :return: an iterator over the elements of the array
+    """
+    with open(filepath, 'r', encoding='utf-8') as file:
+        reader = _JsonArrayReader(file, chunk_size)
+        if reader.next_char() != '[':
+            raise ValueError(f'Expected a json array in {filepath}')
+        reader.pos += 1
+        if reader.next_char() == ']':
+            return
+        while True:
+            elements, array_ended = reader.decode_elements()
+            yield from elements
+            if array_ended:
+                return
+
+
+class _JsonArrayReader:
+    """A sliding window over a json file that decodes the array elements in it"""
+
+    def __init__(self, file, chunk_size: int):
+        self._file = file
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._at_eof = False
+        self.buffer = ''
+        self.pos = 0
+
+    def next_char(self) -> str:
+        """Skip whitespace and return the next character without consuming it ('' at the end of the file)"""
+        while True:
+            self.pos = _skip_whitespace(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read_more():
+                return ''
+
+    def decode_elements(self) -> tuple:
+        """
+        Decode every complete element from the start of an element to the end of the window,
+        reading more of the file if not even one element is complete
+
+        :return: the decoded elements, and whether the end of the array was reached
+        """
+        buffer = self.buffer
+        buffer_end = len(buffer)
+        decode = self._decoder.raw_decode
+        pos = _skip_whitespace(buffer, self.pos).end()
+        elements = []
+        while True:
+            try:
+                element, end = decode(buffer, pos)
+            except json.JSONDecodeError:
+                if self._at_eof:
+                    raise
+                break
+            # an element that ends at the end of the window may be truncated (e.g. a number), so it is
+            # only kept once the separator after it has been read
+            if end < buffer_end and buffer[end] in _JSON_WHITESPACE:
+                end = _skip_whitespace(buffer, end).end()
+            if end == buffer_end:
+                if self._at_eof:
+                    raise ValueError('Unterminated json array')
+                break
+            elements.append(element)
+            separator = buffer[end]
+            if separator == ']':
+                self.pos = end + 1
+                return elements, True
+            if separator != ',':
+                raise ValueError('Malformed json array')
+            pos = end + 1
+            # json.dump separates elements with ", " by default
+            if pos < buffer_end and buffer[pos] in _JSON_WHITESPACE:
+                pos = _skip_whitespace(buffer, pos).end()
+        self.pos = pos
+        self._read_more()
+        return elements, False
+
+    def _read_more(self) -> bool:
+        chunk = self._file.read(self._chunk_size)
+        self._at_eof = not chunk
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return not self._at_eof
+
+
 def create_or_list_from(items: list) -> str:
     """
     Create a string like '"item1", "item2", or "item3"' from a list of items.
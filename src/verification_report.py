@@ -1,21 +1,37 @@
+import json
 import os
-from typing import List
+import re
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from typing import Dict, Iterable, List, TextIO, Union
 
-from src.rule_verification import VerificationResult
-from src.utils import to_csv
+from src.rule_verification import ErrorCounts, VerificationResult, Rule, check_records_in_parallel
+from src.output_formats import OutputFormat, get_output_format, write_output
+from src.stage_timing import StageTimer
+from src.utils import config
+
+NO_GROUP_DIRNAME = 'none'
+_UNSAFE_DIRNAME_CHARS = re.compile(r'[^\w .,&()-]+')
 
 
 class VerificationReport:
-    """A report detailing the results of multiple rule verifications"""
+    """
+    A report detailing the results of multiple rule verifications.
 
-    def __init__(self, verification_results: List[VerificationResult]):
+    A report built from ErrorCounts, as returned by ``verify_rules`` in counts-only mode, has
+    no error messages, so only its ``summary`` and ``broken_rules`` are available.
+    """
+
+    def __init__(self, verification_results: List[Union[VerificationResult, ErrorCounts]]):
         self._verified = []
         self._broken = {}
+        self._results = list(verification_results)
+        self.counts_only = any(isinstance(rule_result, ErrorCounts) for rule_result in self._results)
         for rule_result in verification_results:
             if rule_result.is_verified:
                 self._verified.append(rule_result.rule)
             else:
-                self._broken[rule_result.rule] = [error['error_msg'] for error in rule_result.errors]
+                self._broken[rule_result.rule] = rule_result
 
     @property
     def verified(self):
@@ -23,8 +39,40 @@ class VerificationReport:
 
     @property
     def broken(self):
-        return {rule: [rule_breaker for rule_breaker in rule_breakers]
-                for rule, rule_breakers in self._broken.items()}
+        if self.counts_only:
+            raise ValueError('A counts-only report has no error messages')
+        return {rule: [error['error_msg'] for error in rule_result.errors]
+                for rule, rule_result in self._broken.items()}
+
+    @property
+    def broken_rules(self) -> List[str]:
+        """The names of the broken rules, without their error messages"""
+        return list(self._broken)
+
+    def summary(self) -> dict:
+        """
+        Summarize the report as pass/fail statuses and error counts, without any error messages
+
+        :return: a dict listing the abbreviations of the verified rules, and, for each broken
+                 rule, its description, its number of errors and its number of errors by group
+                 (see ``ErrorRecord``). Errors without a group, or with an empty one, are
+                 counted together under "none", as their files are when partitioned.
+        """
+        return {
+            'verified': [rule_result.rule_abbrev for rule_result in self._results if rule_result.is_verified],
+            'broken': {
+                rule_result.rule_abbrev: {
+                    'rule': rule_result.rule,
+                    'error_count': rule_result.error_count,
+                    'by_group': dict(sorted(_counts_by_named_group(rule_result).items(), key=_by_count_and_group))
+                }
+                for rule_result in self._broken.values()
+            }
+        }
+
+    def write_summary(self, writer: TextIO):
+        """Write the report's summary (see ``summary``) as json to a file-like writer"""
+        json.dump(self.summary(), writer, indent=2)
 
     def has_verified(self):
         """Return whether the report contains any verified rules"""
@@ -41,47 +89,181 @@ class VerificationReport:
             'broken': self.broken
         }
 
+    def write(self, writer: TextIO):
+        """
+        Render the report to a file-like writer, one line at a time
+
+        :param writer: a text stream, like an open file, to write the report to
+        """
+        if self.counts_only:
+            raise ValueError('A counts-only report has no error messages')
+        write = writer.write
+        write('================== Verification Report ===================\n')
+        if self.has_verified():
+            write('\nRules verified:\n\n')
+            for verified_rule in self._verified:
+                write(f'    {verified_rule}\n')
+        if self.has_broken():
+            write('\nRules broken:\n\n')
+            for broken_rule, rule_result in self._broken.items():
+                write(f'    {broken_rule}\n')
+                for error in rule_result.errors:
+                    write(f'        {error["error_msg"]}\n')
+        write(f'\n================== {len(self._verified)} verified, {len(self._broken)} broken ==================')
+
     def __eq__(self, other):
+        if not isinstance(other, VerificationReport):
+            return NotImplemented
+        if self.counts_only or other.counts_only:
+            # counts-only reports have no error messages to compare, so their counts are compared instead
+            return self.counts_only == other.counts_only and self._results == other._results
         return self.as_dict() == other.as_dict()
 
     def __str__(self):
-        result = '================== Verification Report ===================\n'
-        if self.has_verified():
-            result += '\nRules verified:\n\n'
-            for verified_rule in self.verified:
-                result += f'    {verified_rule}\n'
-        if self.has_broken():
-            result += '\nRules broken:\n\n'
-            for broken_rule, errors in self.broken.items():
-                result += f'    {broken_rule}\n'
-                for error in errors:
-                    result += f'        {error}\n'
-        result += f'\n================== {len(self.verified)} verified, {len(self.broken)} broken =================='
-        return result
+        writer = StringIO()
+        self.write(writer)
+        return writer.getvalue()
+
+
+def create_error_csv(verification_result: VerificationResult, dir_path: str,
+                     output_format: OutputFormat = None) -> str:
+    """
+    Given a rule verification result, create a file detailing any rule-breaking records.
+
+    :param verification_result: the result of the rule verification
+    :param dir_path: the directory in which to create the file
+    :param output_format: the format of the file. Defaults to the ``output_format`` config value,
+                          which is CSV unless configured otherwise.
+    :return: the resulting filepath of the new file
+    """
+    return write_output(verification_result.errors, os.path.join(dir_path, verification_result.rule_abbrev),
+                        output_format=output_format)
+
+
+def partition_errors(verification_result: VerificationResult) -> Dict[str, list]:
+    """
+    Split a rule verification result's errors by group (see ``ErrorRecord``) in a single pass
+
+    :param verification_result: the result of the rule verification
+    :return: the errors of each group, in the order the groups first appear. Errors without a
+             group are under None.
+    """
+    partitions = {}
+    for error in verification_result.errors:
+        group = getattr(error, 'group', None)
+        errors = partitions.get(group)
+        if errors is None:
+            errors = partitions[group] = []
+        errors.append(error)
+    return partitions
 
 
-def create_error_csv(verification_result: VerificationResult, dir_path: str) -> str:
+def create_partitioned_error_files(verification_results: Iterable[VerificationResult], dir_path: str,
+                                   output_format: OutputFormat = None, max_workers: int = None) -> List[str]:
     """
-    Given a rule to verify and some data to verify against, create a CSV file
-    detailing any rule-breaking records.
+    Given rule verification results, create a file of each broken rule's errors for each group
+    of errors, like a career center or a staff member, in a subdirectory named after the group.
+
+    Each group then only has to read its own errors. The files are written concurrently.
 
-    :param verification_func: the rule verification function
-    :param data: data to use in verifying the rule
-    :param filepath: the filepath where the CSV should be written
-    :return: the resulting filepath of the new CSV
+    :param verification_results: the results of the rule verifications
+    :param dir_path: the directory in which to create the group subdirectories
+    :param output_format: the format of the files. Defaults to the ``output_format`` config value.
+    :param max_workers: the number of files to write at once. Defaults to the
+                        ``error_file_write_workers`` config value.
+    :return: the filepaths of the new files
     """
-    filepath = os.path.join(dir_path, f'{verification_result.rule_abbrev}.csv')
-    to_csv(verification_result.errors, filepath)
-    return filepath
+    if output_format is None:
+        output_format = get_output_format()
+    if max_workers is None:
+        max_workers = config['error_file_write_workers']
+    dirnames = {}
+    taken_dirnames = set()
+    files = []
+    for verification_result in verification_results:
+        for group, errors in partition_errors(verification_result).items():
+            if group not in dirnames:
+                dirnames[group] = _unique_dirname(group, taken_dirnames)
+                os.makedirs(os.path.join(dir_path, dirnames[group]), exist_ok=True)
+            files.append((errors, os.path.join(dir_path, dirnames[group], verification_result.rule_abbrev)))
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files)))) as executor:
+        futures = [executor.submit(write_output, errors, file_path_without_extension, output_format=output_format)
+                   for errors, file_path_without_extension in files]
+        return [future.result() for future in futures]
 
 
-def verify_rules(rules: List[tuple] = None) -> List[VerificationResult]:
+def verify_rules(rules: List[tuple] = None, processes: int = None, chunk_size: int = None,
+                 timer: StageTimer = None, counts_only: bool = False) -> List[VerificationResult]:
     """Given a list of rules to check and their associated data, verify the rules.
 
+    Rules built with ``make_rule`` that share the same data object are verified together in a
+    single pass over that data, rather than one full pass per rule.
+
+    Large datasets can also be sharded across a process pool (see ``check_records_in_parallel``).
+
     :param rules: a list of tuples of the form: (verification_func, data)
+    :param processes: the number of processes to verify each dataset with. Defaults to the
+                      ``verification_processes`` config value.
+    :param chunk_size: the number of records to send to a process at a time. Defaults to the
+                       ``verification_chunk_size`` config value.
+    :param timer: a timer on which to record the time spent in each fused rule
+    :param counts_only: whether to only count each rule's errors by group, returning ErrorCounts
+                        instead of VerificationResults. No errors are kept and no messages are rendered.
     :returns: a list of rule verification results, one for each rule that was tested
     """
-    if rules is not None:
-        return [rule[0](rule[1]) for rule in rules]
-    else:
+    if rules is None:
         return []
+    if processes is None:
+        processes = config['verification_processes']
+    if chunk_size is None:
+        chunk_size = config['verification_chunk_size']
+    results = [None] * len(rules)
+    for data, rule_indices in _group_rules_by_data(rules):
+        fused_rules = [rules[i][0] for i in rule_indices]
+        fused_results = check_records_in_parallel(fused_rules, data, processes, chunk_size, timer, counts_only)
+        for i, result in zip(rule_indices, fused_results):
+            results[i] = result
+    for i, (verification_func, data) in enumerate(rules):
+        if results[i] is None:
+            results[i] = verification_func(data)
+            if counts_only:
+                results[i] = ErrorCounts.from_result(results[i])
+    return results
+
+
+def _group_rules_by_data(rules: List[tuple]) -> List[tuple]:
+    """Group the indices of all fusable rules by the identity of the data they are verified against"""
+    groups = {}
+    for i, (verification_func, data) in enumerate(rules):
+        if isinstance(verification_func, Rule):
+            groups.setdefault(id(data), (data, []))[1].append(i)
+    return list(groups.values())
+
+
+def _counts_by_named_group(rule_result: Union[VerificationResult, ErrorCounts]) -> Dict[str, int]:
+    counts = {}
+    for group, count in rule_result.counts_by_group().items():
+        group = group or NO_GROUP_DIRNAME
+        counts[group] = counts.get(group, 0) + count
+    return counts
+
+
+def _by_count_and_group(group_count: tuple) -> tuple:
+    group, count = group_count
+    return -count, group or ''
+
+
+def _unique_dirname(group: str, taken: set) -> str:
+    """
+    Name a group's subdirectory after the group, without path separators, and add the name to the
+    names taken. Names are compared ignoring case, as they are on a Windows filesystem.
+    """
+    dirname = _UNSAFE_DIRNAME_CHARS.sub('_', group).strip(' .') if group else ''
+    dirname = dirname or NO_GROUP_DIRNAME
+    unique_dirname = dirname
+    suffix = 2
+    while unique_dirname.casefold() in taken:
+        unique_dirname = f'{dirname} ({suffix})'
+        suffix += 1
+    taken.add(unique_dirname.casefold())
+    return unique_dirname
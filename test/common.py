@@ -1,8 +1,15 @@
 import unittest
+from datetime import datetime, timedelta
 from typing import List
 
+from src.insights_fields import AppointmentFields, EventFields
 from src.rule_verification import VerificationResult
 
+# reference times for records that start before and after the current time of a verification
+NOW = datetime(2020, 3, 1, 12, 0, 0)
+PAST = NOW - timedelta(days=1)
+FUTURE = NOW + timedelta(days=1)
+
 
 def assertContainsErrorIDs(test_class: unittest.TestCase, ids: List[str], verification_result: VerificationResult):
     for id in ids:
@@ -11,3 +18,28 @@ def assertContainsErrorIDs(test_class: unittest.TestCase, ids: List[str], verifi
 
 def assertIsVerified(test_class: unittest.TestCase, verification_result: VerificationResult):
     test_class.assertTrue(verification_result.is_verified)
+
+
+def format_datetime(date_time: datetime) -> str:
+    return date_time.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def make_event(event_id: str, name: str, start_date_time: datetime = PAST, career_center: str = 'Homewood') -> dict:
+    return {
+        EventFields.ID: event_id,
+        EventFields.NAME: name,
+        EventFields.START_DATE_TIME: format_datetime(start_date_time),
+        EventFields.CAREER_CENTER: career_center
+    }
+
+
+def make_appt(appt_id: str, start_date_time: datetime = PAST, status: str = 'completed',
+              appt_type: str = 'Resume Review', staff_first_name: str = 'Alex') -> dict:
+    return {
+        AppointmentFields.ID: appt_id,
+        AppointmentFields.START_DATE_TIME: format_datetime(start_date_time),
+        AppointmentFields.STATUS: status,
+        AppointmentFields.TYPE: appt_type,
+        AppointmentFields.STAFF_MEMBER_FIRST_NAME: staff_first_name,
+        AppointmentFields.STAFF_MEMBER_LAST_NAME: 'Vanderbildt'
+    }
@@ -2,12 +2,13 @@ import unittest
 from datetime import datetime, timedelta
 
 from src.insights_fields import AppointmentFields
+from src.preprocessing import prepare_records
 from src.rules.appointment_rules import (
     past_appointments_have_finalized_status,
     all_appointments_have_a_type,
     _build_appt_type_error_message,
     _build_appt_status_error_message,
-    _extract_error_data_from_appt,
+    AppointmentError,
 )
 from test.common import assertIsVerified, assertContainsErrorIDs
 
@@ -109,6 +110,18 @@ class TestAppointmentStatusCompleted(unittest.TestCase):
         ]
         assertContainsErrorIDs(self, ['6352432', '290392059'], past_appointments_have_finalized_status(appt_data))
 
+    def test_status_rule_uses_the_prepared_reference_time(self):
+        appt_data = prepare_records([
+            {
+                AppointmentFields.ID: "6352432",
+                AppointmentFields.START_DATE_TIME: "2018-05-28 15:30:00",
+                AppointmentFields.STATUS: "approved",
+                AppointmentFields.STAFF_MEMBER_FIRST_NAME: "Alex",
+                AppointmentFields.STAFF_MEMBER_LAST_NAME: "Vanderbildt"
+            }
+        ], AppointmentFields.START_DATE_TIME, now=datetime(2018, 5, 28, 15, 0))
+        assertIsVerified(self, past_appointments_have_finalized_status(appt_data))
+
     def test_type_error_message(self):
         appt = {
             AppointmentFields.ID: "6352432",
@@ -197,7 +210,7 @@ class TestAppointmentHasType(unittest.TestCase):
             AppointmentFields.STAFF_MEMBER_LAST_NAME: "Vanderbildt",
             AppointmentFields.TYPE: ""
         }
-        error = _extract_error_data_from_appt(appt, lambda x: 'error!')
+        error = AppointmentError(appt, lambda x: 'error!')
         self.assertEqual('6352432', error['id'])
         self.assertEqual(datetime(2018, 5, 28, 15, 30), error['start_date_time'])
         self.assertEqual('Vanderbildt', error['staff_last_name'])
@@ -205,5 +218,24 @@ class TestAppointmentHasType(unittest.TestCase):
         self.assertEqual('https://app.joinhandshake.com/appointments/6352432', error['url'])
         self.assertEqual('error!', error['error_msg'])
 
+    def test_error_message_is_rendered_once_and_only_when_read(self):
+        appt = {
+            AppointmentFields.ID: "6352432",
+            AppointmentFields.START_DATE_TIME: "2018-05-28 15:30:00",
+            AppointmentFields.STAFF_MEMBER_FIRST_NAME: "Alex",
+            AppointmentFields.STAFF_MEMBER_LAST_NAME: "Vanderbildt",
+        }
+        rendered = []
+
+        def _build_message(fields: dict) -> str:
+            rendered.append(fields)
+            return f'Appointment {fields[AppointmentFields.ID]}'
+
+        error = AppointmentError(appt, _build_message)
+        self.assertEqual('6352432', error['id'])
+        self.assertEqual([], rendered)
+        self.assertIs(error['error_msg'], error['error_msg'])
+        self.assertEqual(1, len(rendered))
+
 def format_datetime(date_time):
     return date_time.strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,156 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import date
+
+from src import batch
+from src.batch import ActionResult, EXIT_OK, EXIT_BROKEN_RULES, EXIT_FAILED, parse_args, run_actions
+
+
+class FakeSession:
+
+    def __init__(self, fail_login: bool = False):
+        self.fail_login = fail_login
+        self.closed = False
+
+    def __enter__(self):
+        if self.fail_login:
+            raise RuntimeError('invalid password')
+        return f'browser {id(self)}'
+
+    def close(self):
+        self.closed = True
+
+
+class TestBatchArguments(unittest.TestCase):
+
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.config_dir, 'batch.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.config_dir)
+
+    def _write_config(self, options: dict):
+        with open(self.config_file, 'w', encoding='utf-8') as file:
+            json.dump(options, file)
+
+    def test_arguments(self):
+        args = parse_args(['daily_verification', 'staff', '--start-date', '2020-01-01', '--end-date', '2020-06-30',
+                           '--format', 'jsonl', '--processes', '4', '--refresh'])
+        self.assertEqual(['daily_verification', 'staff'], args.actions)
+        self.assertEqual(date(2020, 1, 1), args.start_date)
+        self.assertEqual(date(2020, 6, 30), args.end_date)
+        self.assertEqual('jsonl', args.format)
+        self.assertEqual(4, args.processes)
+        self.assertTrue(args.refresh)
+        self.assertFalse(args.summary_only)
+        self.assertIsNone(args.output_dir)
+        self.assertTrue(parse_args(['daily_verification', '--summary-only']).summary_only)
+        self.assertIsNone(args.partition_errors)
+        self.assertTrue(parse_args(['daily_verification', '--partition-errors']).partition_errors)
+
+    def test_config_file_fills_in_options_not_given_as_arguments(self):
+        self._write_config({'actions': ['major_mapping'], 'output_dir': 'reports', 'format': 'parquet',
+                            'start-date': '2020-01-01', 'end_date': '2020-06-30', 'refresh': True})
+        args = parse_args(['--config-file', self.config_file, '--format', 'csv'])
+        self.assertEqual(['major_mapping'], args.actions)
+        self.assertEqual('reports', args.output_dir)
+        self.assertEqual('csv', args.format)
+        self.assertEqual(date(2020, 1, 1), args.start_date)
+        self.assertTrue(args.refresh)
+
+    def test_invalid_arguments_exit(self):
+        self._write_config({'actions': ['staff'], 'format': 'xlsx'})
+        for argv in [[], ['not_an_action'], ['staff', '--start-date', '2020-01-01'],
+                     ['--config-file', self.config_file]]:
+            with self.assertRaises(SystemExit):
+                parse_args(argv)
+
+
+class TestRunActions(unittest.TestCase):
+
+    def setUp(self):
+        self.original_actions = dict(batch.BATCH_ACTIONS)
+        self.calls = []
+        batch.BATCH_ACTIONS.update({
+            'verified': lambda *args: self._record('verified', ActionResult('verified.txt')),
+            'broken': lambda *args: self._record('broken', ActionResult('broken_dir', ['All dogs should be cute'])),
+            'failing': lambda *args: self._record('failing', None, RuntimeError('timed out')),
+        })
+        self.records = []
+        self.sessions = []
+
+    def tearDown(self):
+        batch.BATCH_ACTIONS.clear()
+        batch.BATCH_ACTIONS.update(self.original_actions)
+
+    def _record(self, name: str, result: ActionResult, error: Exception = None):
+        self.calls.append(name)
+        if error is not None:
+            raise error
+        return result
+
+    def _session_factory(self, fail_login: bool = False):
+        def _create_session():
+            session = FakeSession(fail_login)
+            self.sessions.append(session)
+            return session
+        return _create_session
+
+    def _run(self, actions: list, fail_login: bool = False, sessions: int = 1) -> int:
+        args = parse_args(actions + ['--sessions', str(sessions)])
+        return run_actions(args, self._session_factory(fail_login), self.records.append)
+
+    def _records_of(self, event: str) -> list:
+        return [record for record in self.records if record['event'] == event]
+
+    def test_all_actions_run_in_one_session(self):
+        self.assertEqual(EXIT_OK, self._run(['verified', 'verified']))
+        self.assertEqual(['verified', 'verified'], self.calls)
+        self.assertEqual(1, len(self.sessions))
+        self.assertTrue(self.sessions[0].closed)
+        self.assertEqual(['login', 'action:verified', 'action:verified'],
+                         [record['stage'] for record in self._records_of('stage')])
+        self.assertTrue(all(isinstance(record['seconds'], float) for record in self._records_of('stage')))
+        self.assertEqual('verified.txt', self._records_of('action')[0]['output'])
+
+    def test_actions_run_at_once_on_separate_sessions(self):
+        barrier = threading.Barrier(2, timeout=5)
+        browsers = []
+
+        def _wait_for_other_action(browser, *args):
+            browsers.append(browser)
+            barrier.wait()
+            return ActionResult('waited.txt')
+
+        batch.BATCH_ACTIONS['waiting'] = _wait_for_other_action
+        self.assertEqual(EXIT_OK, self._run(['waiting', 'waiting'], sessions=2))
+        self.assertEqual(2, len(set(browsers)))
+        self.assertEqual(2, len(self.sessions))
+        self.assertTrue(all(session.closed for session in self.sessions))
+
+    def test_broken_rules_set_the_exit_code(self):
+        self.assertEqual(EXIT_BROKEN_RULES, self._run(['verified', 'broken']))
+        self.assertEqual(['All dogs should be cute'], self._records_of('summary')[0]['broken_rules'])
+
+    def test_failed_actions_set_the_exit_code_without_stopping_later_actions(self):
+        self.assertEqual(EXIT_FAILED, self._run(['failing', 'broken']))
+        self.assertEqual(['failing', 'broken'], self.calls)
+        summary = self._records_of('summary')[0]
+        self.assertEqual(['failing'], summary['failed_actions'])
+        self.assertEqual('RuntimeError: timed out', self._records_of('action')[0]['error'])
+        self.assertFalse(self._records_of('stage')[1]['ok'])
+
+    def test_failed_login_skips_every_action(self):
+        self.assertEqual(EXIT_FAILED, self._run(['verified'], fail_login=True))
+        self.assertEqual([], self.calls)
+        self.assertEqual(['login'], self._records_of('summary')[0]['failed_actions'])
+
+    def test_records_are_json_serializable(self):
+        self._run(['verified', 'broken', 'failing'])
+        for record in self.records:
+            json.dumps(record)
@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from src.download_job import MANIFEST_FILENAME, run_download_job
+from src.output_formats import CsvFormat, write_output
+
+
+class FakeSession:
+    opened = []
+
+    def __init__(self):
+        self.closed = False
+        FakeSession.opened.append(self)
+
+    def __enter__(self):
+        return f'browser {len(FakeSession.opened)}'
+
+    def close(self):
+        self.closed = True
+
+
+class TestDownloadJob(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.temp_dir, 'reference_data')
+        self.attempts = {}
+        self.browsers = []
+        self.sleeps = []
+        FakeSession.opened = []
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _download(self, name: str, rows: list, failures: int = 0):
+        def _download_action(browser, output_dir):
+            self.browsers.append(browser)
+            self.attempts[name] = self.attempts.get(name, 0) + 1
+            if self.attempts[name] <= failures:
+                raise RuntimeError(f'{name} timed out')
+            return write_output(rows, os.path.join(output_dir, name), fieldnames=['a'], output_format=CsvFormat())
+        return _download_action
+
+    def _run(self, actions: dict, **kwargs) -> dict:
+        output_dir, manifest = run_download_job('main browser', actions=actions, retries=2, retry_delay_seconds=1,
+                                                output_dir=self.output_dir, sleep=self.sleeps.append, **kwargs)
+        self.assertEqual(self.output_dir, output_dir)
+        with open(os.path.join(output_dir, MANIFEST_FILENAME), encoding='utf-8') as manifest_file:
+            self.assertEqual(manifest, json.load(manifest_file))
+        return manifest
+
+    def test_outputs_are_written_to_one_directory_with_a_manifest(self):
+        manifest = self._run({'first': self._download('first', [{'a': 1}, {'a': 2}]),
+                              'second': self._download('second', [])}, max_workers=1)
+        self.assertEqual({'first.csv', 'second.csv', MANIFEST_FILENAME}, set(os.listdir(self.output_dir)))
+        self.assertEqual([], manifest['failed_actions'])
+        self.assertEqual(['first', 'second'], [action['action'] for action in manifest['actions']])
+        self.assertEqual([[{'file': 'first.csv', 'rows': 2}], [{'file': 'second.csv', 'rows': 0}]],
+                         [action['outputs'] for action in manifest['actions']])
+        self.assertTrue(all(action['ok'] and action['attempts'] == 1 for action in manifest['actions']))
+
+    def test_failed_actions_are_retried_on_their_own(self):
+        manifest = self._run({'flaky': self._download('flaky', [{'a': 1}], failures=1),
+                              'broken': self._download('broken', [{'a': 1}], failures=10),
+                              'fine': self._download('fine', [{'a': 1}])}, max_workers=1)
+        self.assertEqual(['broken'], manifest['failed_actions'])
+        flaky, broken, fine = manifest['actions']
+        self.assertEqual((True, 2, ['RuntimeError: flaky timed out']),
+                         (flaky['ok'], flaky['attempts'], flaky['errors']))
+        self.assertEqual((False, 3, []), (broken['ok'], broken['attempts'], broken['outputs']))
+        self.assertEqual(1, fine['attempts'])
+        self.assertEqual([1, 1, 1], self.sleeps)
+
+    def test_actions_that_return_nothing_succeed(self):
+        manifest = self._run({'nothing': lambda browser, output_dir: None}, max_workers=1)
+        self.assertEqual([], manifest['failed_actions'])
+        self.assertEqual((True, 1, []), (manifest['actions'][0]['ok'], manifest['actions'][0]['attempts'],
+                                         manifest['actions'][0]['outputs']))
+
+    def test_retries_do_not_reuse_a_broken_session(self):
+        manifest = self._run({'flaky': self._download('flaky', [{'a': 1}], failures=1)},
+                             session_factory=FakeSession, max_workers=1)
+        self.assertEqual([], manifest['failed_actions'])
+        # the fake browsers can't load Handshake, so the failed one never passes its health check
+        self.assertEqual(['main browser', 'browser 1'], self.browsers)
+
+    def test_actions_run_at_once_in_separate_sessions(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def _wait_for_other_action(browser, output_dir):
+            self.browsers.append(browser)
+            barrier.wait()
+            return write_output([], os.path.join(output_dir, browser), fieldnames=['a'], output_format=CsvFormat())
+
+        manifest = self._run({'first': _wait_for_other_action, 'second': _wait_for_other_action},
+                             session_factory=FakeSession, max_workers=2)
+        self.assertEqual([], manifest['failed_actions'])
+        self.assertEqual({'main browser', 'browser 1'}, set(self.browsers))
+        self.assertTrue(FakeSession.opened[0].closed)
@@ -1,6 +1,10 @@
+import json
+import os
+import tempfile
 import unittest
 
-from src.job_label_parser import parse_job_file
+from src.job_label_parser import find_record_boundaries, iter_job_file, parse_job_file
+from src.utils import iter_json_array, stream_and_delete_json, to_csv
 
 
 class TestJobFileParser(unittest.TestCase):
@@ -25,3 +29,111 @@ class TestJobFileParser(unittest.TestCase):
             }
         ]
         self.assertEqual(expected, parse_job_file(self.TEST_FILEPATH))
+
+    def test_parsing_in_parallel_matches_parsing_serially(self):
+        serial = parse_job_file(self.TEST_FILEPATH, processes=1)
+        self.assertEqual(serial, list(iter_job_file(self.TEST_FILEPATH, processes=2, chunk_bytes=64)))
+
+
+class TestJobFileChunking(unittest.TestCase):
+
+    def setUp(self):
+        file_descriptor, self.filepath = tempfile.mkstemp(suffix='.csv')
+        os.close(file_descriptor)
+        rows = [' Job Id ,Description,Qualification Labels']
+        for job_id in range(200):
+            description = f'"a ""quoted"", multi-line\ndescription, for job {job_id}"'
+            labels = f'"label {job_id % 3}, label 9"' if job_id % 2 else ''
+            rows.append(f'{job_id},{description},{labels}')
+        with open(self.filepath, 'w', encoding='utf-8', newline='') as file:
+            file.write('\r\n'.join(rows) + '\r\n')
+
+    def tearDown(self):
+        os.remove(self.filepath)
+
+    def test_ranges_never_split_a_quoted_field(self):
+        boundaries = find_record_boundaries(self.filepath, chunk_bytes=100, block_bytes=37)
+        with open(self.filepath, 'rb') as file:
+            content = file.read()
+        self.assertEqual(content.index(b'\n') + 1, boundaries[0])
+        self.assertEqual(len(content), boundaries[-1])
+        self.assertGreater(len(boundaries), 10)
+        for boundary in boundaries[:-1]:
+            self.assertEqual(0, content[:boundary].count(b'"') % 2)
+            self.assertRegex(content[boundary:boundary + 8].decode(), r'^\d+,"a')
+
+    def test_quoted_newlines_commas_and_quotes_are_parsed_in_parallel(self):
+        serial = parse_job_file(self.filepath, processes=1)
+        self.assertEqual(100, len(serial))
+        self.assertEqual({'job_id': '1', 'job_url': 'https://jhu.joinhandshake.com/jobs/1',
+                          'qualification_labels': ['label 1', 'label 9']}, serial[0])
+        self.assertEqual(serial, list(iter_job_file(self.filepath, processes=2, chunk_bytes=200)))
+
+
+class TestJsonStreaming(unittest.TestCase):
+
+    def setUp(self):
+        file_descriptor, self.filepath = tempfile.mkstemp(suffix='.json')
+        os.close(file_descriptor)
+
+    def tearDown(self):
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+    def _write(self, text: str):
+        with open(self.filepath, 'w', encoding='utf-8') as file:
+            file.write(text)
+
+    def test_elements_spanning_chunk_boundaries(self):
+        data = [{'Events ID': '1', 'Events Name': 'Homewood: [Resume], "Review"'},
+                {'Events ID': '2', 'Events Name': 'é'},
+                12345678,
+                None]
+        self._write(json.dumps(data, indent=2))
+        for chunk_size in [1, 3, 16, 1 << 16]:
+            self.assertEqual(data, list(iter_json_array(self.filepath, chunk_size)))
+
+    def test_empty_array(self):
+        self._write(' [ ] ')
+        self.assertEqual([], list(iter_json_array(self.filepath)))
+
+    def test_non_array_raises_value_error(self):
+        self._write('{"Events ID": "1"}')
+        with self.assertRaises(ValueError):
+            list(iter_json_array(self.filepath))
+
+    def test_file_is_only_deleted_once_fully_consumed(self):
+        self._write('[{"Events ID": "1"}, {"Events ID": "2"}]')
+        stream = stream_and_delete_json(self.filepath)
+        self.assertEqual({'Events ID': '1'}, next(stream))
+        self.assertTrue(os.path.exists(self.filepath))
+        self.assertEqual([{'Events ID': '2'}], list(stream))
+        self.assertFalse(os.path.exists(self.filepath))
+
+
+class TestCsvWriting(unittest.TestCase):
+
+    def setUp(self):
+        file_descriptor, self.filepath = tempfile.mkstemp(suffix='.csv')
+        os.close(file_descriptor)
+
+    def tearDown(self):
+        os.remove(self.filepath)
+
+    def _read(self) -> str:
+        with open(self.filepath, encoding='utf-8') as file:
+            return file.read()
+
+    def test_rows_from_a_generator_are_written_in_batches(self):
+        rows = ({'id': str(i), 'error_msg': f'Event {i}, "quoted"'} for i in range(5))
+        self.assertEqual(5, to_csv(rows, self.filepath, rows_per_write=2))
+        expected = 'id,error_msg\n' + ''.join(f'{i},"Event {i}, ""quoted"""\n' for i in range(5))
+        self.assertEqual(expected, self._read())
+
+    def test_empty_input_without_fieldnames_creates_an_empty_file(self):
+        self.assertEqual(0, to_csv([], self.filepath))
+        self.assertEqual('', self._read())
+
+    def test_empty_input_with_fieldnames_writes_the_header(self):
+        self.assertEqual(0, to_csv(iter([]), self.filepath, fieldnames=['id', 'error_msg']))
+        self.assertEqual('id,error_msg\n', self._read())
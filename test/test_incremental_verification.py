@@ -0,0 +1,225 @@
+import gzip
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from src.incremental_verification import (STATE_FORMAT_VERSION, IncrementalVerification, VerificationState,
+                                          _EveryOutcomeRule, rule_signature)
+from src.insights_fields import AppointmentFields
+from src.preprocessing import prepare_records
+from src.rule_dsl import field, make_declared_rule, when
+from src.rule_verification import ErrorCounts, _can_pickle, make_rule
+from src.verification_report import verify_rules
+from src.rules.appointment_rules import (AppointmentError, _build_appt_status_error_message,
+                                         past_appointments_have_finalized_status, all_appointments_have_a_type)
+from test.common import NOW, make_appt
+
+LONG_APPOINTMENT_MINUTES = 60
+
+
+def _get_long_appt_error(appt: dict):
+    return {'id': appt[AppointmentFields.ID]} if int(appt['Minutes']) > LONG_APPOINTMENT_MINUTES else None
+
+
+def _get_type_error(appt: dict):
+    return None if appt[AppointmentFields.TYPE] else {'id': appt[AppointmentFields.ID]}
+
+
+def _status_rule(statuses: list):
+    return make_declared_rule('rule', 'rule', AppointmentError,
+                              [when(field(AppointmentFields.STATUS).is_in(statuses), _build_appt_status_error_message)],
+                              fields=[AppointmentFields.ID, AppointmentFields.STATUS])
+
+
+class StateError(dict):
+    pass
+
+
+class CountingRule:
+    """Wraps a rule's error function to count how many records it checks"""
+
+    def __init__(self, rule):
+        self.calls = 0
+        error_func = rule.error_func
+
+        def _counting_error_func(record):
+            self.calls += 1
+            return error_func(record)
+
+        self.rule = make_rule(rule.rule, rule.rule_abbrev, _counting_error_func, rule.fields, rule.time_field)
+
+
+class TestIncrementalVerification(unittest.TestCase):
+
+    def setUp(self):
+        self.now = NOW
+        self.appts = [
+            make_appt('1', self.now - timedelta(days=1), status='approved'),
+            make_appt('2', self.now - timedelta(days=2)),
+            make_appt('3', self.now + timedelta(days=1), status='approved', appt_type=None),
+            make_appt('4', self.now + timedelta(hours=1), status='approved'),
+        ]
+
+    def _run(self, rule, appts, state, now):
+        incremental = IncrementalVerification(state, now)
+        [result] = incremental.verify([rule], prepare_records([dict(appt) for appt in appts],
+                                                        AppointmentFields.START_DATE_TIME, now=now))
+        return result, incremental.state
+
+    def test_first_run_matches_full_run(self):
+        for rule in [past_appointments_have_finalized_status, all_appointments_have_a_type]:
+            result, _ = self._run(rule, self.appts, VerificationState(), self.now)
+            expected = rule(prepare_records([dict(appt) for appt in self.appts],
+                                            AppointmentFields.START_DATE_TIME, now=self.now))
+            self.assertEqual(expected, result)
+
+    def test_unchanged_records_are_not_rechecked(self):
+        counting = CountingRule(all_appointments_have_a_type)
+        first_result, state = self._run(counting.rule, self.appts, VerificationState(), self.now)
+        self.assertEqual(4, counting.calls)
+        counting.calls = 0
+        second_result, _ = self._run(counting.rule, self.appts, state, self.now + timedelta(minutes=5))
+        self.assertEqual(0, counting.calls)
+        self.assertEqual(first_result, second_result)
+
+    def test_changed_records_are_rechecked(self):
+        counting = CountingRule(all_appointments_have_a_type)
+        _, state = self._run(counting.rule, self.appts, VerificationState(), self.now)
+        counting.calls = 0
+        changed_appts = [dict(appt) for appt in self.appts]
+        changed_appts[2][AppointmentFields.TYPE] = 'Resume Review'
+        result, _ = self._run(counting.rule, changed_appts, state, self.now)
+        self.assertEqual(1, counting.calls)
+        self.assertTrue(result.is_verified)
+
+    def test_records_that_moved_into_the_past_are_rechecked(self):
+        counting = CountingRule(past_appointments_have_finalized_status)
+        first_result, state = self._run(counting.rule, self.appts, VerificationState(), self.now)
+        self.assertEqual(['1'], [error['id'] for error in first_result.errors])
+        counting.calls = 0
+        later = self.now + timedelta(hours=2)
+        second_result, _ = self._run(counting.rule, self.appts, state, later)
+        self.assertEqual(1, counting.calls)
+        expected = past_appointments_have_finalized_status(
+            prepare_records([dict(appt) for appt in self.appts], AppointmentFields.START_DATE_TIME, now=later))
+        self.assertEqual(expected, second_result)
+        self.assertEqual(['1', '4'], [error['id'] for error in second_result.errors])
+
+    def test_removed_records_are_dropped_from_the_state(self):
+        _, state = self._run(all_appointments_have_a_type, self.appts, VerificationState(), self.now)
+        _, state = self._run(all_appointments_have_a_type, self.appts[:1], state, self.now)
+        self.assertEqual(1, len(state.rule_results[rule_signature(all_appointments_have_a_type)]))
+
+    def test_rules_without_fields_are_fully_verified_alongside_incremental_rules(self):
+        counting = CountingRule(make_rule('rule', 'rule', _get_type_error))
+        rules = [counting.rule, all_appointments_have_a_type]
+        expected = verify_rules([(rule, list(self.appts)) for rule in rules])
+        counting.calls = 0
+        incremental = IncrementalVerification(VerificationState(), self.now)
+        self.assertEqual(expected, incremental.verify(rules, iter([dict(appt) for appt in self.appts])))
+        self.assertEqual(4, counting.calls)
+        self.assertEqual([rule_signature(all_appointments_have_a_type)], list(incremental.state.rule_results))
+
+    def test_rechecked_records_can_be_verified_in_parallel(self):
+        appts = [make_appt(str(i), self.now + timedelta(hours=i - 50), status='approved') for i in range(100)]
+        rules = [past_appointments_have_finalized_status, all_appointments_have_a_type]
+        serial = IncrementalVerification(VerificationState(), self.now)
+        expected = serial.verify(rules, prepare_records(appts, AppointmentFields.START_DATE_TIME, now=self.now))
+        parallel = IncrementalVerification(VerificationState(), self.now)
+        self.assertEqual(expected, parallel.verify(rules, prepare_records(appts, AppointmentFields.START_DATE_TIME,
+                                                                          now=self.now),
+                                                   processes=2, chunk_size=10))
+        self.assertEqual(serial.state.rule_results, parallel.state.rule_results)
+        self.assertTrue(_can_pickle([_EveryOutcomeRule(rule) for rule in rules]))
+
+    def test_records_are_verified_a_block_at_a_time_in_record_order(self):
+        appts = [make_appt(str(i), self.now + timedelta(hours=i - 10), status='approved', appt_type=None)
+                 for i in range(20)]
+        rules = [past_appointments_have_finalized_status, all_appointments_have_a_type]
+        # only every third record has previous results, so reused and re-checked records alternate in each block
+        previous = IncrementalVerification(VerificationState(), self.now)
+        previous.verify(rules, prepare_records([dict(appt) for appt in appts[::3]], AppointmentFields.START_DATE_TIME,
+                                               now=self.now))
+        prepared = prepare_records([dict(appt) for appt in appts], AppointmentFields.START_DATE_TIME, now=self.now)
+        expected = verify_rules([(rule, prepared) for rule in rules])
+        for counts_only in [False, True]:
+            incremental = IncrementalVerification(previous.state, self.now)
+            results = incremental.verify(rules, iter([dict(appt) for appt in prepared]), processes=1, chunk_size=3,
+                                         counts_only=counts_only)
+            if counts_only:
+                self.assertEqual([ErrorCounts.from_result(result) for result in expected], results)
+            else:
+                self.assertEqual(expected, results)
+
+
+
+class TestRuleSignature(unittest.TestCase):
+
+    def test_rules_with_different_data_have_different_signatures(self):
+        self.assertEqual(rule_signature(_status_rule(['approved', 'requested'])),
+                         rule_signature(_status_rule(['requested', 'approved'])))
+        self.assertNotEqual(rule_signature(_status_rule(['approved', 'requested'])),
+                            rule_signature(_status_rule(['approved'])))
+
+    def test_globals_read_by_error_functions_are_part_of_the_signature(self):
+        global LONG_APPOINTMENT_MINUTES
+        rule = make_rule('rule', 'rule', _get_long_appt_error, fields=[AppointmentFields.ID, 'Minutes'])
+        signature = rule_signature(rule)
+        try:
+            LONG_APPOINTMENT_MINUTES = 30
+            self.assertNotEqual(signature, rule_signature(rule))
+        finally:
+            LONG_APPOINTMENT_MINUTES = 60
+        self.assertEqual(signature, rule_signature(rule))
+
+    def test_signatures_are_the_same_in_every_process(self):
+        code = ('from src.incremental_verification import rule_signature\n'
+                'from src.rule_sets.daily_verification import EVENT_RULES, APPT_RULES\n'
+                'print([rule_signature(rule) for rule in EVENT_RULES + APPT_RULES])')
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        signatures = {subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                     cwd=root_dir, env=dict(os.environ, PYTHONHASHSEED=seed)).stdout
+                      for seed in ['1', '2']}
+        self.assertEqual(1, len(signatures))
+
+
+class TestVerificationState(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.state_dir, 'state', 'verification_state.pkl.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def test_state_round_trips(self):
+        now = datetime(2020, 3, 1)
+        VerificationState(now, {'signature': {b'fingerprint': {'id': '1'}, b'other': None}}).save(self.state_path)
+        state = VerificationState.load(self.state_path)
+        self.assertEqual(now, state.now)
+        self.assertEqual({'signature': {b'fingerprint': {'id': '1'}, b'other': None}}, state.rule_results)
+
+    def test_missing_state_loads_empty(self):
+        state = VerificationState.load(self.state_path)
+        self.assertIsNone(state.now)
+        self.assertEqual({}, state.rule_results)
+
+    def test_state_with_errors_of_renamed_or_moved_classes_loads_empty(self):
+        os.makedirs(os.path.dirname(self.state_path))
+        # protocol 0 names classes as plain text, so their module and name can be replaced
+        state = pickle.dumps((STATE_FORMAT_VERSION, datetime(2020, 3, 1), {'signature': {b'fp': StateError()}}), 0)
+        for old, new in [(b'StateError', b'RenamedError'), (__name__.encode('utf-8'), b'no_such_module')]:
+            with gzip.open(self.state_path, 'wb') as file:
+                file.write(state.replace(old, new))
+            self.assertEqual({}, VerificationState.load(self.state_path).rule_results)
+
+    def test_corrupt_state_loads_empty(self):
+        os.makedirs(os.path.dirname(self.state_path))
+        with open(self.state_path, 'wb') as file:
+            file.write(b'not a state file')
+        self.assertEqual({}, VerificationState.load(self.state_path).rule_results)
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import date
+
+from src.insights_cache import InsightsCache
+from src.insights_downloads import DateRangeFilter, InsightsReport
+
+
+class TestInsightsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = InsightsCache(self.cache_dir, ttl_seconds=60, max_bytes=10 ** 9)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_records_round_trip(self):
+        records = [{'Events ID': '1', 'Events Name': 'Homewood: Resume Review'},
+                   {'Events ID': '2', 'Events Name': None},
+                   {'Events ID': '3', 'Extra Field': 'different shape'}]
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(records, list(self.cache.put('key', [dict(record) for record in records])))
+        self.assertEqual(records, list(self.cache.get('key')))
+
+    def test_empty_dataset_round_trips(self):
+        self.assertEqual([], list(self.cache.put('key', [])))
+        self.assertEqual([], list(self.cache.get('key')))
+
+    def test_records_are_cached_as_they_were_when_yielded(self):
+        for record in self.cache.put('key', [{'Events ID': '1'}]):
+            record['Is Past'] = True
+        self.assertEqual([{'Events ID': '1'}], list(self.cache.get('key')))
+
+    def test_partially_consumed_datasets_are_not_cached(self):
+        stream = self.cache.put('key', [{'Events ID': '1'}, {'Events ID': '2'}])
+        next(stream)
+        stream.close()
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_expired_datasets_are_missing(self):
+        list(self.cache.put('key', [{'Events ID': '1'}]))
+        self.cache.ttl_seconds = 0
+        time.sleep(0.01)
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_corrupted_datasets_are_missing(self):
+        list(self.cache.put('key', [{'Events ID': '1'}]))
+        with open(os.path.join(self.cache_dir, 'key.pkl.gz'), 'ab') as file:
+            file.write(b'garbage')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_least_recently_used_datasets_are_evicted(self):
+        list(self.cache.put('first', [{'Events ID': '1'}]))
+        list(self.cache.put('second', [{'Events ID': '2'}]))
+        self.cache.get('first')
+        self.cache.max_bytes = os.path.getsize(os.path.join(self.cache_dir, 'first.pkl.gz')) + 1
+        list(self.cache.put('third', [{'Events ID': '3'}]))
+        self.assertIsNone(self.cache.get('first'))
+        self.assertIsNone(self.cache.get('second'))
+        self.assertIsNotNone(self.cache.get('third'))
+
+    def test_clearing_removes_every_dataset(self):
+        for key in ['a', 'b']:
+            list(self.cache.put(key, [{'Events ID': key}]))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_report_keys_depend_on_url_and_filters(self):
+        def _report(url, end_date):
+            return InsightsReport('events', url, [DateRangeFilter('Events', 'Start Date Date',
+                                                                  date(2019, 7, 1), end_date)])
+
+        self.assertEqual(_report('url', date(2020, 7, 1)).cache_key, _report('url', date(2020, 7, 1)).cache_key)
+        self.assertNotEqual(_report('url', date(2020, 7, 1)).cache_key, _report('url', date(2020, 8, 1)).cache_key)
+        self.assertNotEqual(_report('url', date(2020, 7, 1)).cache_key, _report('other', date(2020, 7, 1)).cache_key)
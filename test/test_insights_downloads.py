@@ -0,0 +1,197 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+from functools import partial
+
+from autohandshake.src.exceptions import BrowserTimeoutError
+
+from src.insights_cache import InsightsCache
+from src.insights_downloads import InsightsReport, download_insights_reports
+from src.insights_fields import EventFields, AppointmentFields
+from src.rule_sets.daily_verification import RULE_SETS, EVENTS_REPORT, APPTS_REPORT, _verify_rule_sets
+from src.session_pool import SessionPool
+from src.stage_timing import StageTimer
+
+
+class FakeInsightsPage:
+    """A stand-in for InsightsPage that "downloads" canned data into the download directory"""
+    data = {}
+    before_download = None
+    used_browsers = []
+
+    def __init__(self, url: str, browser):
+        self.url = url
+        self.browser = browser
+
+    def set_date_range_filter(self, *args):
+        pass
+
+    def download_file(self, download_dir, file_name=None, file_type=None):
+        FakeInsightsPage.used_browsers.append(self.browser)
+        if FakeInsightsPage.before_download is not None:
+            FakeInsightsPage.before_download(self.url)
+        filepath = os.path.join(download_dir, f'{file_name}.json')
+        with open(filepath, 'w', encoding='utf-8') as file:
+            json.dump(FakeInsightsPage.data[self.url], file)
+        return filepath
+
+
+class FakeSession:
+    opened = []
+
+    def __init__(self):
+        self.closed = False
+        FakeSession.opened.append(self)
+
+    def __enter__(self):
+        return f'browser {len(FakeSession.opened)}'
+
+    def close(self):
+        self.closed = True
+
+
+class TestDownloadInsightsReports(unittest.TestCase):
+
+    def setUp(self):
+        self.download_dir = tempfile.mkdtemp()
+        FakeInsightsPage.data = {'url 1': [{'a': 1}], 'url 2': [{'b': 2}, {'b': 3}]}
+        FakeInsightsPage.before_download = None
+        FakeInsightsPage.used_browsers = []
+        FakeSession.opened = []
+        self.reports = [InsightsReport('report_1', 'url 1'), InsightsReport('report_2', 'url 2')]
+
+    def tearDown(self):
+        shutil.rmtree(self.download_dir)
+
+    def _download(self, **kwargs) -> dict:
+        downloads = download_insights_reports(self.reports, 'main browser', max_workers=2,
+                                              download_dir=self.download_dir, page_factory=FakeInsightsPage,
+                                              **kwargs)
+        return {report.name: list(records) for report, records in downloads}
+
+    def test_reports_download_concurrently_in_separate_sessions(self):
+        barrier = threading.Barrier(2, timeout=5)
+        FakeInsightsPage.before_download = lambda url: barrier.wait()
+        self.assertEqual({'report_1': [{'a': 1}], 'report_2': [{'b': 2}, {'b': 3}]},
+                         self._download(session_factory=FakeSession))
+        self.assertEqual({'main browser', 'browser 1'}, set(FakeInsightsPage.used_browsers))
+        self.assertEqual(1, len(FakeSession.opened))
+        self.assertTrue(FakeSession.opened[0].closed)
+        self.assertEqual([], os.listdir(self.download_dir))
+
+    def test_reports_download_on_the_given_browser_without_a_session_factory(self):
+        self.assertEqual({'report_1': [{'a': 1}], 'report_2': [{'b': 2}, {'b': 3}]}, self._download())
+        self.assertEqual(['main browser', 'main browser'], FakeInsightsPage.used_browsers)
+
+    def test_reports_download_on_the_given_browser_when_a_shared_pool_has_none_to_spare(self):
+        pool = SessionPool(FakeSession, max_sessions=1, health_check=lambda browser: True)
+        with pool.session() as browser:
+            downloads = download_insights_reports(self.reports, browser, partial(pool.session, block=False),
+                                                  max_workers=2, download_dir=self.download_dir,
+                                                  page_factory=FakeInsightsPage)
+            self.assertEqual({'report_1', 'report_2'}, {report.name for report, records in downloads})
+        self.assertEqual(['browser 1', 'browser 1'], FakeInsightsPage.used_browsers)
+        self.assertEqual(1, len(FakeSession.opened))
+
+    def test_cached_reports_are_not_downloaded_again_unless_refreshed(self):
+        cache = InsightsCache(os.path.join(self.download_dir, 'cache'), ttl_seconds=60, max_bytes=10 ** 9)
+        expected = {'report_1': [{'a': 1}], 'report_2': [{'b': 2}, {'b': 3}]}
+        self.assertEqual(expected, self._download(cache=cache))
+        self.assertEqual(2, len(FakeInsightsPage.used_browsers))
+        self.assertEqual(expected, self._download(cache=cache))
+        self.assertEqual(2, len(FakeInsightsPage.used_browsers))
+        self.assertEqual(expected, self._download(cache=cache, refresh=True))
+        self.assertEqual(4, len(FakeInsightsPage.used_browsers))
+
+    def test_sessions_are_only_closed_once_running_downloads_finish(self):
+        consumer_stopped = threading.Event()
+        sessions_closed_during_download = []
+
+        def _finish_second_report_after_consumer_stops(url):
+            if url == 'url 2':
+                consumer_stopped.wait(5)
+                time.sleep(0.05)
+                sessions_closed_during_download.append(any(session.closed for session in FakeSession.opened))
+
+        FakeInsightsPage.before_download = _finish_second_report_after_consumer_stops
+        downloads = download_insights_reports(self.reports, 'main browser', FakeSession, max_workers=2,
+                                              download_dir=self.download_dir, page_factory=FakeInsightsPage)
+        report, _ = next(downloads)
+        self.assertEqual('report_1', report.name)
+        consumer_stopped.set()
+        downloads.close()
+        self.assertEqual([False], sessions_closed_during_download)
+        self.assertTrue(all(session.closed for session in FakeSession.opened))
+
+    def test_download_errors_are_reraised(self):
+        def _fail_on_second_report(url):
+            if url == 'url 2':
+                raise BrowserTimeoutError('timed out')
+
+        FakeInsightsPage.before_download = _fail_on_second_report
+        with self.assertRaises(BrowserTimeoutError):
+            self._download(session_factory=FakeSession)
+        self.assertTrue(all(session.closed for session in FakeSession.opened))
+
+
+class TestDailyVerificationRuleSets(unittest.TestCase):
+
+    def setUp(self):
+        self.download_dir = tempfile.mkdtemp()
+        FakeInsightsPage.data = {
+            EVENTS_REPORT.url: [{
+                EventFields.ID: '1',
+                EventFields.START_DATE_TIME: '2020-01-02 10:00:00',
+                EventFields.NAME: 'Resume Review',
+                EventFields.CAREER_CENTER: 'Life Design Lab (Homewood)',
+                EventFields.EVENT_TYPE: 'Workshop',
+                EventFields.LABELS_LIST: '',
+                EventFields.IS_INVITE_ONLY: 'No'
+            }],
+            APPTS_REPORT.url: [{
+                AppointmentFields.ID: '2',
+                AppointmentFields.START_DATE_TIME: '2019-12-01 10:00:00',
+                AppointmentFields.STATUS: 'approved',
+                AppointmentFields.TYPE: '',
+                AppointmentFields.STAFF_MEMBER_FIRST_NAME: 'Alex',
+                AppointmentFields.STAFF_MEMBER_LAST_NAME: 'Vanderbildt'
+            }]
+        }
+        appts_downloaded = threading.Event()
+
+        def _download_appointments_first(url):
+            if url == EVENTS_REPORT.url:
+                appts_downloaded.wait(timeout=5)
+            else:
+                appts_downloaded.set()
+
+        FakeInsightsPage.before_download = _download_appointments_first
+        FakeSession.opened = []
+
+    def tearDown(self):
+        shutil.rmtree(self.download_dir)
+
+    def test_results_are_in_rule_set_order(self):
+        results = _verify_rule_sets(RULE_SETS, 'main browser', datetime(2020, 1, 1), FakeSession,
+                                    FakeInsightsPage, download_dir=self.download_dir)
+        self.assertEqual(['event_wrong_prefix', 'event_invite_only', 'event_advertisements',
+                          'past_event_virtual_session', 'appt_missing_type', 'appt_wrong_status'],
+                         [result.rule_abbrev for result in results])
+        self.assertEqual([1, 1, 0, 0, 1, 1], [len(result.errors) for result in results])
+
+    def test_each_step_of_the_pipeline_is_timed(self):
+        timer = StageTimer(trace_memory=False, detailed=True)
+        _verify_rule_sets(RULE_SETS, 'main browser', datetime(2020, 1, 1), FakeSession, FakeInsightsPage,
+                          download_dir=self.download_dir, timer=timer)
+        stages = {stage['stage']: stage for stage in timer.stages}
+        for report in ['events', 'appointments']:
+            for step in ['navigate', 'export', 'download', 'verify']:
+                self.assertIn(f'{step}:{report}', stages)
+            self.assertEqual(1, stages[f'parse:{report}']['rows'])
+        self.assertEqual(1, stages['rule:event_wrong_prefix']['rows'])
+        self.assertEqual(1, stages['rule:appt_wrong_status']['rows'])
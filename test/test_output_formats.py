@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.output_formats import (
+    pa, CsvFormat, JsonLinesFormat, ParquetFormat, ArrowFormat, get_output_format, write_output,
+    count_output_rows
+)
+from src.insights_fields import EventFields
+from src.rule_verification import VerificationResult
+from src.rules.event_rules import EventError, _build_event_prefix_error_message
+from src.verification_report import create_error_csv
+
+ROWS = [
+    {'id': '1', 'error_msg': 'Event 1 should have prefix "Homewood:"', 'labels': ['a', 'b']},
+    {'id': '2', 'error_msg': None, 'labels': []},
+    {'id': '3', 'error_msg': 'Event 3, with a comma', 'labels': ['c']},
+]
+
+
+def read_arrow_rows(file_path: str) -> list:
+    import pyarrow.parquet as pq
+    if file_path.endswith('.parquet'):
+        return pq.read_table(file_path).to_pylist()
+    with pa.ipc.open_file(file_path) as reader:
+        return reader.read_all().to_pylist()
+
+
+class TestOutputFormats(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.output_dir, name)
+
+    def test_csv_matches_to_csv_output(self):
+        file_path = write_output(iter(ROWS), self._path('errors'), output_format=CsvFormat())
+        self.assertEqual(self._path('errors.csv'), file_path)
+        with open(file_path, encoding='utf-8') as file:
+            self.assertEqual('id,error_msg,labels\n', file.readline())
+
+    def test_jsonl_writes_one_object_per_line(self):
+        file_path = write_output(iter(ROWS), self._path('errors'), output_format=JsonLinesFormat())
+        with open(file_path, encoding='utf-8') as file:
+            self.assertEqual(ROWS, [json.loads(line) for line in file])
+
+    def test_empty_jsonl_file(self):
+        file_path = write_output([], self._path('errors'), output_format=JsonLinesFormat())
+        self.assertEqual(0, os.path.getsize(file_path))
+
+    @unittest.skipIf(pa is None, 'pyarrow is not installed')
+    def test_columnar_formats_round_trip(self):
+        for output_format in [ParquetFormat(), ArrowFormat()]:
+            file_path = write_output(iter(ROWS), self._path('errors'), output_format=output_format)
+            self.assertTrue(file_path.endswith(output_format.extension))
+            self.assertEqual(ROWS, read_arrow_rows(file_path))
+
+    @unittest.skipIf(pa is None, 'pyarrow is not installed')
+    def test_columnar_formats_handle_columns_with_no_values_in_the_first_batch(self):
+        rows = [{'id': str(i), 'error_msg': None} for i in range(3)] + [{'id': '3', 'error_msg': 'late value'}]
+        for output_format in [ParquetFormat(rows_per_batch=2), ArrowFormat(rows_per_batch=2)]:
+            file_path = write_output(iter(rows), self._path('errors'), output_format=output_format)
+            self.assertEqual(rows, read_arrow_rows(file_path))
+
+    @unittest.skipIf(pa is None, 'pyarrow is not installed')
+    def test_empty_columnar_files_keep_their_fieldnames(self):
+        for output_format in [ParquetFormat(), ArrowFormat()]:
+            file_path = write_output([], self._path('errors'), fieldnames=['id', 'error_msg'],
+                                     output_format=output_format)
+            self.assertEqual([], read_arrow_rows(file_path))
+
+    def test_rows_are_counted_in_every_format(self):
+        output_formats = [CsvFormat(), JsonLinesFormat()] + ([ParquetFormat(), ArrowFormat()] if pa else [])
+        for output_format in output_formats:
+            file_path = write_output(iter(ROWS), self._path('errors'), output_format=output_format)
+            self.assertEqual(3, count_output_rows(file_path))
+            file_path = write_output([], self._path('empty'), fieldnames=['id'], output_format=output_format)
+            self.assertEqual(0, count_output_rows(file_path))
+
+    def test_unknown_format_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            get_output_format('xlsx')
+
+    def test_error_files_use_the_given_format(self):
+        result = VerificationResult('rule', 'rule_abbrev', [{'id': '1', 'error_msg': 'broken'}])
+        file_path = create_error_csv(result, self.output_dir, JsonLinesFormat())
+        self.assertEqual(self._path('rule_abbrev.jsonl'), file_path)
+        with open(file_path, encoding='utf-8') as file:
+            self.assertEqual([{'id': '1', 'error_msg': 'broken'}], [json.loads(line) for line in file])
+
+    def test_error_records_can_be_written_in_every_format(self):
+        error = EventError({EventFields.ID: '1', EventFields.NAME: 'Resume Review'},
+                           _build_event_prefix_error_message, ['Homewood:'])
+        output_formats = [CsvFormat(), JsonLinesFormat()]
+        if pa is not None:
+            output_formats += [ParquetFormat(), ArrowFormat()]
+        for output_format in output_formats:
+            file_path = write_output([error], self._path('errors'), output_format=output_format)
+            if output_format.extension == '.jsonl':
+                with open(file_path, encoding='utf-8') as file:
+                    self.assertEqual([dict(error)], [json.loads(line) for line in file])
+            elif output_format.extension != '.csv':
+                self.assertEqual([dict(error)], read_arrow_rows(file_path))
@@ -0,0 +1,42 @@
+import unittest
+
+from src.constants import CareerCenters
+from src.prefix_matcher import PrefixMatcher
+from src.rules.event_rules import EVENT_PREFIX_MATCHER
+
+
+class TestPrefixMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = PrefixMatcher({
+            'sais': ['SAIS:', 'SAIS DC:', 'SAIS Europe:'],
+            'special': ['a.b*', 'a.'],
+            'empty': []
+        })
+
+    def test_returns_matched_prefix(self):
+        self.assertEqual('SAIS DC:', self.matcher.match('sais', 'SAIS DC: Career Trek'))
+        self.assertEqual('SAIS:', self.matcher.match('sais', 'SAIS: Career Trek'))
+
+    def test_returns_none_without_a_match(self):
+        self.assertIsNone(self.matcher.match('sais', 'Career Trek SAIS:'))
+        self.assertIsNone(self.matcher.match('sais', 'sais: Career Trek'))
+        self.assertIsNone(self.matcher.match('empty', 'anything'))
+
+    def test_prefers_longest_prefix(self):
+        self.assertEqual('a.b*', self.matcher.match('special', 'a.b* event'))
+        self.assertEqual('a.', self.matcher.match('special', 'a.bb event'))
+
+    def test_prefixes_are_matched_literally(self):
+        self.assertIsNone(self.matcher.match('special', 'ab event'))
+
+    def test_unknown_group_raises_key_error(self):
+        self.assertNotIn('unknown', self.matcher)
+        with self.assertRaises(KeyError):
+            self.matcher.match('unknown', 'SAIS: Career Trek')
+
+    def test_event_prefix_matcher_includes_cancelled_variants(self):
+        self.assertEqual('Homewood:', EVENT_PREFIX_MATCHER.match(CareerCenters.HOMEWOOD, 'Homewood: Resume Review'))
+        self.assertEqual('CANCELLED: Homewood:',
+                         EVENT_PREFIX_MATCHER.match(CareerCenters.HOMEWOOD, 'CANCELLED: Homewood: Resume Review'))
+        self.assertIsNone(EVENT_PREFIX_MATCHER.match(CareerCenters.HOMEWOOD, 'Carey: Resume Review'))
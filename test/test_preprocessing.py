@@ -0,0 +1,79 @@
+import unittest
+from datetime import datetime
+
+from src.insights_fields import DerivedFields, EventFields
+from src.preprocessing import (parse_insights_date_time, DateTimeParser, prepare_records,
+                               get_start_date_time, split_past_and_future, is_past_record)
+
+
+class TestParseInsightsDateTime(unittest.TestCase):
+
+    def test_fixed_format(self):
+        self.assertEqual(datetime(2019, 9, 4, 15, 30, 0), parse_insights_date_time('2019-09-04 15:30:00'))
+
+    def test_falls_back_to_strptime_for_non_fixed_width_strings(self):
+        self.assertEqual(datetime(2019, 9, 4, 5, 3, 0), parse_insights_date_time('2019-9-4 5:03:00'))
+
+    def test_invalid_date_time_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            parse_insights_date_time('2019-13-04 15:30:00')
+        with self.assertRaises(ValueError):
+            parse_insights_date_time('not a date')
+
+
+class TestDateTimeParser(unittest.TestCase):
+
+    def test_repeated_strings_share_a_parsed_value(self):
+        parser = DateTimeParser()
+        first = parser.parse('2019-09-04 15:30:00')
+        self.assertIs(first, parser.parse('2019-09-04 15:30:00'))
+
+
+class TestPrepareRecords(unittest.TestCase):
+
+    def test_start_date_times_are_parsed_once(self):
+        events = prepare_records([
+            {EventFields.ID: '1', EventFields.START_DATE_TIME: '2019-09-04 15:30:00'},
+            {EventFields.ID: '2', EventFields.START_DATE_TIME: None}
+        ], EventFields.START_DATE_TIME)
+        self.assertEqual(datetime(2019, 9, 4, 15, 30), events[0][DerivedFields.START_DATE_TIME])
+        self.assertIsNone(events[1][DerivedFields.START_DATE_TIME])
+
+    def test_get_start_date_time_with_and_without_preparation(self):
+        event = {EventFields.START_DATE_TIME: '2019-09-04 15:30:00'}
+        self.assertEqual(datetime(2019, 9, 4, 15, 30), get_start_date_time(event, EventFields.START_DATE_TIME))
+        prepare_records([event], EventFields.START_DATE_TIME)
+        event[EventFields.START_DATE_TIME] = 'ignored once prepared'
+        self.assertEqual(datetime(2019, 9, 4, 15, 30), get_start_date_time(event, EventFields.START_DATE_TIME))
+
+
+class TestPastAndFuture(unittest.TestCase):
+    NOW = datetime(2020, 1, 1, 12, 0, 0)
+
+    def test_split_past_and_future(self):
+        before = datetime(2019, 12, 31)
+        after = datetime(2020, 1, 2)
+        self.assertEqual({before: True, self.NOW: False, after: False},
+                         split_past_and_future([after, self.NOW, None, before, after], self.NOW))
+
+    def test_prepared_records_are_classified_against_the_given_time(self):
+        events = prepare_records([
+            {EventFields.START_DATE_TIME: '2019-12-31 23:59:59'},
+            {EventFields.START_DATE_TIME: '2020-01-01 12:00:00'},
+            {EventFields.START_DATE_TIME: '2000-01-01 00:00:00'}
+        ], EventFields.START_DATE_TIME, now=self.NOW)
+        self.assertEqual([True, False, True],
+                         [is_past_record(event, EventFields.START_DATE_TIME) for event in events])
+
+    def test_records_without_a_start_date_time_are_neither_past_nor_future(self):
+        events = prepare_records([{EventFields.START_DATE_TIME: None}], EventFields.START_DATE_TIME, now=self.NOW)
+        self.assertNotIn(DerivedFields.IS_PAST, events[0])
+        for event in events + [{EventFields.START_DATE_TIME: None}]:
+            with self.assertRaises(ValueError):
+                is_past_record(event, EventFields.START_DATE_TIME)
+
+    def test_unprepared_records_are_compared_to_the_current_time(self):
+        self.assertTrue(is_past_record({EventFields.START_DATE_TIME: '2000-01-01 00:00:00'},
+                                       EventFields.START_DATE_TIME))
+        self.assertFalse(is_past_record({EventFields.START_DATE_TIME: '9999-01-01 00:00:00'},
+                                        EventFields.START_DATE_TIME))
@@ -0,0 +1,74 @@
+import pickle
+import unittest
+from datetime import datetime, timedelta
+
+from src.insights_fields import EventFields
+from src.preprocessing import prepare_records
+from src.rule_dsl import field, is_past, make_declared_rule, when
+from src.rule_verification import ErrorRecord
+from test.common import NOW, FUTURE, make_event
+
+
+class NumberError(ErrorRecord):
+    __slots__ = ('id', 'error_msg')
+    keys_in_order = ('id', 'error_msg')
+
+    def __init__(self, record: dict, message_func, *message_args):
+        self.id = record[EventFields.ID]
+        self.error_msg = message_func(record, *message_args)
+
+
+def _message(record: dict, *args) -> str:
+    return ' '.join(str(arg) for arg in (record[EventFields.ID],) + args)
+
+
+def _prepared(records: list) -> list:
+    return prepare_records([dict(record) for record in records], EventFields.START_DATE_TIME, now=NOW)
+
+
+RECORDS = [
+    make_event('1', 'Office Hours'),
+    make_event('2', 'office hours', FUTURE),
+    make_event('3', 'Info Session'),
+    make_event('4', 'Info Session', career_center=''),
+]
+
+naming_rule = make_declared_rule(
+    'Events are named after their career center', 'named', NumberError,
+    [when(field(EventFields.CAREER_CENTER).is_truthy() & field(EventFields.NAME).lower().eq('office hours') &
+          is_past(EventFields.START_DATE_TIME), _message, 'past office hours'),
+     when(field(EventFields.CAREER_CENTER).is_truthy() & field(EventFields.NAME).lower().eq('office hours'),
+          _message, 'office hours', 'today'),
+     when(field(EventFields.CAREER_CENTER).is_truthy() & ~field(EventFields.NAME).startswith('Office', 'Career'),
+          _message)],
+    fields=[EventFields.ID, EventFields.NAME, EventFields.CAREER_CENTER, EventFields.START_DATE_TIME],
+    time_field=EventFields.START_DATE_TIME
+)
+
+
+class TestDeclaredRules(unittest.TestCase):
+
+    def test_the_first_case_that_holds_determines_the_error(self):
+        result = naming_rule(_prepared(RECORDS))
+        self.assertEqual([{'id': '1', 'error_msg': '1 past office hours'},
+                          {'id': '2', 'error_msg': '2 office hours today'},
+                          {'id': '3', 'error_msg': '3'}], result.errors)
+
+    def test_rules_that_are_not_prepared_compare_their_start_time_with_now(self):
+        record = make_event('1', 'Office Hours', datetime.now() - timedelta(hours=1))
+        self.assertEqual(['1 past office hours'], [error['error_msg'] for error in naming_rule([record]).errors])
+
+    def test_conditions_are_combined(self):
+        is_homewood = field(EventFields.CAREER_CENTER).eq('Homewood')
+        is_office_hours = field(EventFields.NAME).lower().contains('office')
+        record = make_event('1', 'Office Hours')
+        self.assertTrue((is_homewood & is_office_hours).compile()(record))
+        self.assertFalse((is_homewood & ~is_office_hours).compile()(record))
+        self.assertTrue((~is_homewood | is_office_hours).compile()(record))
+        self.assertFalse((~is_homewood | ~is_office_hours).compile()(record))
+        self.assertTrue(field(EventFields.ID).is_in(['1', '2']).compile()(record))
+        self.assertFalse((~field(EventFields.CAREER_CENTER).is_falsy()).compile()(make_event('2', 'Info', career_center='')))
+
+    def test_rules_can_be_pickled(self):
+        unpickled = pickle.loads(pickle.dumps(naming_rule))
+        self.assertEqual(naming_rule(_prepared(RECORDS)), unpickled(_prepared(RECORDS)))
@@ -0,0 +1,168 @@
+import threading
+import unittest
+
+from src.session_pool import BrowserPool, NoSessionAvailable, SessionPool
+
+
+class FakeSession:
+    opened = []
+
+    def __init__(self, fail_login: bool = False):
+        self.fail_login = fail_login
+        self.closed = False
+        FakeSession.opened.append(self)
+
+    def __enter__(self):
+        if self.fail_login:
+            raise RuntimeError('invalid password')
+        return f'browser {len(FakeSession.opened)}'
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSessionPool(unittest.TestCase):
+
+    def setUp(self):
+        FakeSession.opened = []
+        self.clock = FakeClock()
+        self.expired_browsers = set()
+        self.checked_browsers = []
+
+    def _health_check(self, browser) -> bool:
+        self.checked_browsers.append(browser)
+        return browser not in self.expired_browsers
+
+    def _create_pool(self, max_sessions: int = 2, session_factory=FakeSession) -> SessionPool:
+        return SessionPool(session_factory, max_sessions, health_check=self._health_check,
+                           check_after_seconds=60, clock=self.clock)
+
+    def test_sessions_are_reused_without_logging_in_again(self):
+        pool = self._create_pool()
+        for _ in range(3):
+            with pool.session() as browser:
+                self.assertEqual('browser 1', browser)
+        self.assertEqual(1, pool.login_count)
+        self.assertEqual([], self.checked_browsers)
+        pool.close()
+        self.assertTrue(FakeSession.opened[0].closed)
+
+    def test_sessions_are_opened_as_needed_up_to_the_maximum(self):
+        pool = self._create_pool()
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertEqual({'browser 1', 'browser 2'}, {first, second})
+        with self.assertRaises(NoSessionAvailable):
+            pool.acquire(block=False)
+        pool.release(first)
+        self.assertEqual(first, pool.acquire(block=False))
+        self.assertEqual(2, pool.login_count)
+
+    def test_acquire_waits_for_a_released_browser(self):
+        pool = self._create_pool(max_sessions=1)
+        browser = pool.acquire()
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        waiter.start()
+        waiter.join(timeout=0.1)
+        self.assertEqual([], acquired)
+        pool.release(browser)
+        waiter.join(timeout=5)
+        self.assertEqual([browser], acquired)
+
+    def test_idle_sessions_are_health_checked_and_replaced_only_when_expired(self):
+        pool = self._create_pool()
+        pool.warm()
+        self.clock.now = 61
+        with pool.session() as browser:
+            self.assertEqual('browser 1', browser)
+        self.assertEqual(['browser 1'], self.checked_browsers)
+        self.expired_browsers.add('browser 1')
+        self.clock.now = 200
+        with pool.session() as browser:
+            self.assertEqual('browser 2', browser)
+        self.assertTrue(FakeSession.opened[0].closed)
+        self.assertEqual(2, pool.login_count)
+
+    def test_sessions_are_checked_after_an_error(self):
+        pool = self._create_pool()
+        with self.assertRaises(ValueError):
+            with pool.session():
+                raise ValueError
+        with pool.session() as browser:
+            self.assertEqual('browser 1', browser)
+        self.assertEqual(['browser 1'], self.checked_browsers)
+
+    def test_failed_logins_free_their_place_in_the_pool(self):
+        pool = self._create_pool(max_sessions=1, session_factory=lambda: FakeSession(fail_login=True))
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                pool.acquire(block=False)
+        self.assertTrue(all(session.closed for session in FakeSession.opened))
+        self.assertEqual(0, pool.login_count)
+
+    def test_sessions_in_use_are_closed_when_released_after_the_pool_closes(self):
+        pool = self._create_pool()
+        browser = pool.acquire()
+        pool.close()
+        self.assertFalse(FakeSession.opened[0].closed)
+        pool.release(browser)
+        self.assertTrue(FakeSession.opened[0].closed)
+        with self.assertRaises(RuntimeError):
+            pool.acquire()
+
+
+class FailingCloseSession(FakeSession):
+
+    def close(self):
+        super().close()
+        raise RuntimeError('browser already quit')
+
+
+class TestBrowserPool(unittest.TestCase):
+
+    def setUp(self):
+        FakeSession.opened = []
+        self.expired_browsers = set()
+
+    def _create_pool(self, session_factory=FakeSession) -> BrowserPool:
+        return BrowserPool('main browser', session_factory, 2,
+                           health_check=lambda browser: browser not in self.expired_browsers)
+
+    def test_browsers_that_fail_their_check_are_replaced(self):
+        pool = self._create_pool()
+        main_browser, browser = pool.acquire(), pool.acquire()
+        self.expired_browsers.update([main_browser, browser])
+        pool.release(browser, check=True)
+        pool.release(main_browser, check=True)
+        self.assertEqual({'browser 2', 'browser 3'}, {pool.acquire(), pool.acquire()})
+        self.assertEqual([True, False, False], [session.closed for session in FakeSession.opened])
+
+    def test_browsers_are_only_checked_when_asked(self):
+        pool = self._create_pool()
+        self.expired_browsers.add('main browser')
+        pool.release(pool.acquire())
+        self.assertEqual('main browser', pool.acquire())
+
+    def test_browsers_are_kept_if_no_replacement_can_be_opened(self):
+        pool = self._create_pool(session_factory=lambda: FakeSession(fail_login=True))
+        self.expired_browsers.add('main browser')
+        pool.release(pool.acquire(), check=True)
+        self.assertEqual('main browser', pool.acquire())
+
+    def test_close_closes_every_session_even_if_one_fails_to_close(self):
+        pool = BrowserPool('main browser', FailingCloseSession, 3)
+        browsers = [pool.acquire() for _ in range(3)]
+        for browser in browsers:
+            pool.release(browser)
+        pool.close()
+        self.assertEqual([True, True], [session.closed for session in FakeSession.opened])
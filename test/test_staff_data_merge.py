@@ -1,6 +1,7 @@
 import unittest
 
-from src.data_download_functions import merge_staff_data
+from src.data_download_functions import iter_merged_staff_data, merge_staff_data
+from src.staff_matching import AMBIGUOUS, MATCHED, UNMATCHED, StaffNameIndex
 
 
 class TestStaffDataMerge(unittest.TestCase):
@@ -37,3 +38,33 @@ class TestStaffDataMerge(unittest.TestCase):
             },
         ]
         self.assertEqual(expected, merge_staff_data(names, insights_data))
+
+    def test_names_match_regardless_of_case_whitespace_and_unicode_form(self):
+        names = ['José Núñez', 'Mary  Ann O’Neil']
+        insights_data = [
+            {'Career Service Staffs First Name': 'JOSÉ', 'Career Service Staffs Last Name': 'núñez'},
+            {'Career Service Staffs First Name': 'mary ann', 'Career Service Staffs Last Name': ' o’neil'},
+            {'Career Service Staffs First Name': 'Ｊｏｓｅ', 'Career Service Staffs Last Name': 'Núñez'},
+            {'Career Service Staffs First Name': 'Jose', 'Career Service Staffs Last Name': 'Nunez'},
+        ]
+        self.assertEqual(insights_data[:2], merge_staff_data(names, insights_data))
+
+
+class TestStaffNameIndex(unittest.TestCase):
+
+    def test_rows_are_reported_as_matched_ambiguous_or_unmatched(self):
+        index = StaffNameIndex(['John Smith', 'Ann Lee', 'ann  LEE', 'Unused Name'])
+        insights_data = [
+            {'Career Service Staffs First Name': 'John', 'Career Service Staffs Last Name': 'Smith'},
+            {'Career Service Staffs First Name': 'John', 'Career Service Staffs Last Name': 'Smith'},
+            {'Career Service Staffs First Name': 'Ann', 'Career Service Staffs Last Name': 'Lee'},
+            {'Career Service Staffs First Name': 'Archived', 'Career Service Staffs Last Name': ' Staff'},
+        ]
+        self.assertEqual(insights_data[:3], list(iter_merged_staff_data([], insights_data, index)))
+        self.assertEqual({MATCHED: 2, AMBIGUOUS: 1, UNMATCHED: 1}, index.counts)
+        self.assertEqual([
+            {'name': 'John Smith', 'status': MATCHED, 'staff_page_count': 1, 'insights_row_count': 2},
+            {'name': 'Ann Lee', 'status': AMBIGUOUS, 'staff_page_count': 2, 'insights_row_count': 1},
+            {'name': 'Unused Name', 'status': UNMATCHED, 'staff_page_count': 1, 'insights_row_count': 0},
+            {'name': 'Archived Staff', 'status': UNMATCHED, 'staff_page_count': 0, 'insights_row_count': 1},
+        ], index.report_rows())
@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.rule_verification import check_records, make_rule
+from src.stage_timing import StageTimer
+
+
+class TestStageTimer(unittest.TestCase):
+
+    def setUp(self):
+        self.timer = StageTimer(trace_memory=False)
+
+    def test_stages_record_wall_time_cpu_time_and_rows(self):
+        with self.timer.stage('parse') as stage:
+            stage.add_rows(2)
+            stage.add_rows(3)
+        with self.timer.stage('navigate'):
+            pass
+        parse, navigate = self.timer.stages
+        self.assertEqual(('parse', 5, True), (parse['stage'], parse['rows'], parse['ok']))
+        self.assertIsInstance(parse['seconds'], float)
+        self.assertIsInstance(parse['cpu_seconds'], float)
+        self.assertIsNone(navigate['rows'])
+        self.assertNotIn('peak_memory_bytes', parse)
+
+    def test_failed_stages_are_recorded(self):
+        with self.assertRaises(ValueError):
+            with self.timer.stage('export'):
+                raise ValueError
+        self.assertFalse(self.timer.stages[0]['ok'])
+
+    def test_timed_iter_counts_items_once_exhausted(self):
+        records = self.timer.timed_iter('parse', iter([{'a': 1}, {'a': 2}]))
+        self.assertEqual([], self.timer.stages)
+        self.assertEqual([{'a': 1}, {'a': 2}], list(records))
+        self.assertEqual([('parse', 2, True)],
+                         [(stage['stage'], stage['rows'], stage['ok']) for stage in self.timer.stages])
+
+    def test_child_stages_are_also_recorded_by_the_parent(self):
+        with self.timer.stage('login'):
+            pass
+        child = self.timer.child()
+        with child.stage('verify'):
+            pass
+        self.assertEqual(['verify'], [stage['stage'] for stage in child.stages])
+        self.assertEqual(['login', 'verify'], [stage['stage'] for stage in self.timer.stages])
+
+    def test_peak_memory_of_nested_stages(self):
+        timer = StageTimer(trace_memory=True)
+        try:
+            with timer.stage('outer'):
+                with timer.stage('inner'):
+                    data = [0] * 100000
+                del data
+                with timer.stage('after'):
+                    pass
+        finally:
+            timer.close()
+        peaks = {stage['stage']: stage['peak_memory_bytes'] for stage in timer.stages}
+        self.assertGreater(peaks['inner'], 100000 * 8)
+        self.assertGreaterEqual(peaks['outer'], peaks['inner'])
+        self.assertLess(peaks['after'], peaks['inner'])
+
+    def test_rules_are_timed_when_checked_with_a_timer(self):
+        rules = [make_rule('Dogs should be cute', 'cute', lambda record: None if record['cute'] else record),
+                 make_rule('Dogs should be good', 'good', lambda record: None)]
+        results = check_records(rules, [{'cute': True}, {'cute': False}], self.timer)
+        self.assertEqual([1, 0], [len(result.errors) for result in results])
+        self.assertEqual([('rule:cute', 2), ('rule:good', 2)],
+                         [(stage['stage'], stage['rows']) for stage in self.timer.stages])
+
+    def test_report_is_written_as_json(self):
+        report_dir = tempfile.mkdtemp()
+        try:
+            with self.timer.stage('write_summary_report'):
+                pass
+            report_path = os.path.join(report_dir, 'timing.json')
+            self.timer.write_report(report_path)
+            with open(report_path, encoding='utf-8') as report_file:
+                self.assertEqual({'stages': self.timer.stages}, json.load(report_file))
+        finally:
+            shutil.rmtree(report_dir)
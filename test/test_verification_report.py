@@ -1,7 +1,20 @@
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
+from datetime import datetime
+from io import StringIO
 
-from src.rule_verification import VerificationResult
-from src.verification_report import VerificationReport, verify_rules
+from src.insights_fields import AppointmentFields
+from src.rule_verification import ErrorCounts, VerificationResult, make_rule
+from src.rule_sets.daily_verification import _write_summary_text_report
+from src.rules.appointment_rules import (AppointmentError, _build_appt_type_error_message,
+                                         all_appointments_have_a_type)
+from src.output_formats import CsvFormat, count_output_rows
+from src.verification_report import (VerificationReport, create_partitioned_error_files, partition_errors,
+                                     verify_rules)
+from test.common import make_appt
 
 
 class TestVerificationResult(unittest.TestCase):
@@ -18,6 +31,63 @@ class TestVerificationResult(unittest.TestCase):
         self.assertFalse(result.is_verified)
 
 
+class TestErrorRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.appt = {
+            AppointmentFields.ID: '6352432',
+            AppointmentFields.START_DATE_TIME: '2019-09-20 15:00:00',
+            AppointmentFields.STAFF_MEMBER_FIRST_NAME: ' Alex ',
+            AppointmentFields.STAFF_MEMBER_LAST_NAME: 'Vanderbildt'
+        }
+        self.expected = {
+            'id': '6352432',
+            'start_date_time': datetime(2019, 9, 20, 15),
+            'staff_last_name': 'Vanderbildt',
+            'staff_first_name': ' Alex ',
+            'url': 'https://app.joinhandshake.com/appointments/6352432',
+            'error_msg': 'Appointment 6352432 (Alex Vanderbildt, 2019-09-20 15:00:00) does not have an appointment type'
+        }
+
+    def test_error_records_behave_like_dicts(self):
+        error = AppointmentError(self.appt, _build_appt_type_error_message)
+        self.assertEqual(self.expected, error)
+        self.assertEqual(error, self.expected)
+        self.assertEqual(list(self.expected), list(error))
+        self.assertEqual(self.expected['error_msg'], error['error_msg'])
+        self.assertEqual(repr(self.expected), repr(error))
+        with self.assertRaises(KeyError):
+            error['_error_msg_func']
+
+    def test_error_messages_are_only_built_when_read(self):
+        messages_built = []
+
+        def _build_message(appt: dict) -> str:
+            messages_built.append(appt[AppointmentFields.ID])
+            return 'message'
+
+        error = AppointmentError(self.appt, _build_message)
+        self.assertEqual([], messages_built)
+        self.assertEqual('message', error['error_msg'])
+        self.assertEqual(['6352432'], messages_built)
+
+    def test_error_records_do_not_keep_the_record(self):
+        error = AppointmentError(self.appt, _build_appt_type_error_message)
+        self.assertFalse(hasattr(error, '__dict__'))
+        self.appt[AppointmentFields.STAFF_MEMBER_LAST_NAME] = 'Changed'
+        self.assertEqual(self.expected, error)
+
+    def test_error_records_can_be_pickled(self):
+        error = AppointmentError(self.appt, _build_appt_type_error_message)
+        self.assertEqual(self.expected, pickle.loads(pickle.dumps(error)))
+
+    def test_results_with_error_records_equal_results_with_dicts(self):
+        result = VerificationResult('rule', 'abbrev', [AppointmentError(self.appt, _build_appt_type_error_message)])
+        self.assertEqual(VerificationResult('rule', 'abbrev', [self.expected]), result)
+        self.assertEqual(str(VerificationResult('rule', 'abbrev', [self.expected])), str(result))
+        self.assertEqual(['6352432'], result.parse_errors(lambda error: error['id']))
+
+
 class TestVerificationReport(unittest.TestCase):
 
     def test_report_with_no_results(self):
@@ -129,6 +199,30 @@ class TestVerificationReport(unittest.TestCase):
                     '================== 2 verified, 2 broken ==================')
         self.assertEqual(expected, str(test_report))
 
+    def test_report_written_to_a_file_matches_its_str(self):
+        test_report = VerificationReport([
+            VerificationResult('All dogs should be good', ''),
+            VerificationResult('All numbers should be even', '', [
+                {'error_msg': '3 is not even'},
+                {'error_msg': 'é is not even'}
+            ])
+        ])
+        output_dir = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(output_dir, 'all_errors.txt')
+            _write_summary_text_report(test_report, filepath)
+            with open(filepath, 'rb') as file:
+                self.assertEqual(str(test_report).encode('utf-8'), file.read())
+        finally:
+            shutil.rmtree(output_dir)
+
+    def test_broken_returns_copies_of_the_error_messages(self):
+        test_report = VerificationReport([VerificationResult('All numbers should be even', '', [
+            {'error_msg': '3 is not even'}
+        ])])
+        test_report.broken['All numbers should be even'].append('4 is not even')
+        self.assertEqual({'All numbers should be even': ['3 is not even']}, test_report.broken)
+
 
 class TestVerifyRules(unittest.TestCase):
 
@@ -167,3 +261,180 @@ class TestVerifyRules(unittest.TestCase):
             (func1, data1),
             (func2, data2)
         ]))
+
+    def test_rules_sharing_data_are_verified_in_one_pass(self):
+        visited = []
+
+        def _odd_error(n):
+            visited.append(n)
+            return {'error_msg': f'{n} is odd'} if n % 2 != 0 else None
+
+        def _big_error(n):
+            return {'error_msg': f'{n} is too big'} if n > 5 else None
+
+        data = [2, 5, 6, 7]
+        odd_rule = make_rule('All numbers should be even', 'even', _odd_error)
+        big_rule = make_rule('All numbers should be small', 'small', _big_error)
+
+        def other_rule(data):
+            return VerificationResult('The sky should be blue', '')
+
+        expected = [
+            VerificationResult('All numbers should be even', 'even',
+                               [{'error_msg': '5 is odd'}, {'error_msg': '7 is odd'}]),
+            VerificationResult('The sky should be blue', ''),
+            VerificationResult('All numbers should be small', 'small',
+                               [{'error_msg': '6 is too big'}, {'error_msg': '7 is too big'}])
+        ]
+        self.assertEqual(expected, verify_rules([
+            (odd_rule, data),
+            (other_rule, None),
+            (big_rule, data)
+        ]))
+        self.assertEqual(data, visited)
+
+    def test_rules_can_be_verified_against_a_single_use_iterator(self):
+        data = iter([1, 2, 3])
+        odd_rule = make_rule('All numbers should be even', 'even',
+                             lambda n: {'error_msg': f'{n} is odd'} if n % 2 != 0 else None)
+        big_rule = make_rule('All numbers should be small', 'small',
+                             lambda n: {'error_msg': f'{n} is too big'} if n > 2 else None)
+        expected = [
+            VerificationResult('All numbers should be even', 'even',
+                               [{'error_msg': '1 is odd'}, {'error_msg': '3 is odd'}]),
+            VerificationResult('All numbers should be small', 'small', [{'error_msg': '3 is too big'}])
+        ]
+        self.assertEqual(expected, verify_rules([(odd_rule, data), (big_rule, data)]))
+
+
+def _get_odd_error(n: int):
+    return {'error_msg': f'{n} is odd'} if n % 2 != 0 else None
+
+
+def _get_big_error(n: int):
+    return {'error_msg': f'{n} is too big'} if n > 50 else None
+
+
+odd_rule = make_rule('All numbers should be even', 'even', _get_odd_error)
+big_rule = make_rule('All numbers should be small', 'small', _get_big_error)
+
+
+class TestVerifyRulesInParallel(unittest.TestCase):
+
+    def test_rules_with_module_level_error_functions_can_be_pickled(self):
+        unpickled_rule = pickle.loads(pickle.dumps(odd_rule))
+        self.assertEqual(odd_rule([1, 2, 3]), unpickled_rule([1, 2, 3]))
+
+    def test_parallel_results_match_serial_results(self):
+        data = list(range(100))
+        rules = [(odd_rule, data), (big_rule, data)]
+        expected = verify_rules(rules, processes=1)
+        self.assertEqual(expected, verify_rules(rules, processes=2, chunk_size=7))
+
+    def test_single_use_iterators_can_be_verified_in_parallel(self):
+        data = iter(range(100))
+        expected = verify_rules([(odd_rule, list(range(100)))], processes=1)
+        self.assertEqual(expected, verify_rules([(odd_rule, data)], processes=2, chunk_size=10))
+
+    def test_small_and_empty_inputs_are_verified_serially(self):
+        self.assertEqual(verify_rules([(odd_rule, [1, 2, 3])], processes=1),
+                         verify_rules([(odd_rule, [1, 2, 3])], processes=2, chunk_size=10))
+        self.assertTrue(verify_rules([(odd_rule, [])], processes=2, chunk_size=10)[0].is_verified)
+
+    def test_rules_that_cannot_be_pickled_are_verified_serially(self):
+        closure_rule = make_rule('All numbers should be even', 'even', lambda n: _get_odd_error(n))
+        data = list(range(20))
+        self.assertEqual(verify_rules([(odd_rule, data)], processes=1),
+                         verify_rules([(closure_rule, data)], processes=2, chunk_size=3))
+
+
+class TestCountsOnlyVerification(unittest.TestCase):
+
+    def setUp(self):
+        self.appts = [make_appt('1', appt_type='', staff_first_name='Mary'),
+                      make_appt('2', appt_type='', staff_first_name=' Mary '),
+                      make_appt('3', appt_type='', staff_first_name='Alex'),
+                      make_appt('4', staff_first_name='Alex')]
+        self.numbers = list(range(10))
+        self.rules = [(all_appointments_have_a_type, self.appts), (odd_rule, self.numbers),
+                      (big_rule, self.numbers)]
+
+    def test_counts_match_the_errors_of_a_full_verification(self):
+        full_results = verify_rules(self.rules)
+        counts = verify_rules(self.rules, counts_only=True)
+        self.assertEqual([ErrorCounts.from_result(result) for result in full_results], counts)
+        self.assertEqual([3, 5, 0], [result.error_count for result in counts])
+        self.assertEqual({'Mary Vanderbildt': 2, 'Alex Vanderbildt': 1}, counts[0].counts_by_group())
+
+    def test_parallel_counts_match_serial_counts(self):
+        self.assertEqual(verify_rules(self.rules, processes=1, counts_only=True),
+                         verify_rules(self.rules, processes=2, chunk_size=3, counts_only=True))
+
+    def test_summary_counts_errors_by_group(self):
+        report = VerificationReport(verify_rules(self.rules, counts_only=True))
+        self.assertEqual({
+            'verified': ['small'],
+            'broken': {
+                'appt_missing_type': {'rule': 'All appointments have an associated appointment type',
+                                      'error_count': 3, 'by_group': {'Mary Vanderbildt': 2, 'Alex Vanderbildt': 1}},
+                'even': {'rule': 'All numbers should be even', 'error_count': 5, 'by_group': {'none': 5}},
+            }
+        }, report.summary())
+        self.assertEqual(['All appointments have an associated appointment type', 'All numbers should be even'],
+                         report.broken_rules)
+        self.assertEqual(report.summary(), VerificationReport(verify_rules(self.rules)).summary())
+
+    def test_errors_without_a_group_are_summarized_together(self):
+        report = VerificationReport([ErrorCounts('All numbers should be even', 'even', {None: 2, '': 3, 'Mary': 4})])
+        self.assertEqual({'none': 5, 'Mary': 4}, report.summary()['broken']['even']['by_group'])
+
+    def test_counts_only_reports_are_compared_by_their_counts(self):
+        report = VerificationReport(verify_rules(self.rules, counts_only=True))
+        self.assertEqual(report, VerificationReport(verify_rules(self.rules, counts_only=True)))
+        self.assertNotEqual(report, VerificationReport(verify_rules(self.rules[:1], counts_only=True)))
+        self.assertNotEqual(report, VerificationReport(verify_rules(self.rules)))
+
+    def test_counts_only_reports_have_no_error_messages(self):
+        report = VerificationReport(verify_rules(self.rules, counts_only=True))
+        with self.assertRaises(ValueError):
+            report.broken
+        with self.assertRaises(ValueError):
+            report.write(StringIO())
+
+
+class TestPartitionedErrorFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        appts = [make_appt('1', appt_type='', staff_first_name='Mary'),
+                 make_appt('2', appt_type='', staff_first_name=' Mary '),
+                 make_appt('3', appt_type='', staff_first_name='Alex'),
+                 make_appt('4', staff_first_name='Alex'),
+                 make_appt('5', appt_type='', staff_first_name='A/B'),
+                 make_appt('6', appt_type='', staff_first_name='a/b '),
+                 make_appt('7', appt_type='', staff_first_name='')]
+        self.results = verify_rules([(all_appointments_have_a_type, appts), (odd_rule, list(range(10))),
+                                     (big_rule, list(range(10)))])
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_errors_are_partitioned_by_group_in_order(self):
+        partitions = partition_errors(self.results[0])
+        self.assertEqual(['Mary Vanderbildt', 'Alex Vanderbildt', 'A/B Vanderbildt', 'a/b Vanderbildt', 'Vanderbildt'],
+                         list(partitions))
+        self.assertEqual(['1', '2'], [error['id'] for error in partitions['Mary Vanderbildt']])
+        self.assertEqual({None: self.results[1].errors}, partition_errors(self.results[1]))
+
+    def test_each_group_gets_a_file_for_each_broken_rule(self):
+        filepaths = create_partitioned_error_files(self.results, self.output_dir, CsvFormat(), max_workers=3)
+        rows_by_file = {os.path.relpath(filepath, self.output_dir): count_output_rows(filepath)
+                        for filepath in filepaths}
+        self.assertEqual({
+            os.path.join('Mary Vanderbildt', 'appt_missing_type.csv'): 2,
+            os.path.join('Alex Vanderbildt', 'appt_missing_type.csv'): 1,
+            os.path.join('A_B Vanderbildt', 'appt_missing_type.csv'): 1,
+            os.path.join('a_b Vanderbildt (2)', 'appt_missing_type.csv'): 1,
+            os.path.join('Vanderbildt', 'appt_missing_type.csv'): 1,
+            os.path.join('none', 'even.csv'): 5,
+        }, rows_by_file)